@@ -0,0 +1,51 @@
+"""Compares two benchmark result files and flags regressions.
+
+A benchmark regresses when its ops/s drop by more than --threshold percent
+or it runs more queries per operation. Exits with status 1 if any does:
+
+    python benchmarks/compare.py benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def load(path):
+    payload = json.loads(Path(path).read_text())
+    return payload, {result['name']: result for result in payload['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help="Caída de ops/s tolerada, en %%")
+    args = parser.parse_args()
+
+    baseline, before = load(args.baseline)
+    candidate, after = load(args.candidate)
+    print(f"{baseline['commit']} ({baseline['database']}) -> {candidate['commit']} ({candidate['database']})")
+    if baseline['parameters'] != candidate['parameters']:
+        print("Aviso: los parámetros de las corridas difieren")
+
+    regressions = 0
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = (new['ops_per_second'] - old['ops_per_second']) / old['ops_per_second'] * 100
+        regressed = change < -args.threshold or new['queries'] > old['queries']
+        regressions += regressed
+        print(
+            f"{'!!' if regressed else '  '} {name:<34} {old['ops_per_second']:>10.1f} -> {new['ops_per_second']:>10.1f} ops/s "
+            f"({change:+6.1f}%)  p99 {old['p99_ms']:>8.2f} -> {new['p99_ms']:>8.2f} ms  "
+            f"consultas {old['queries']:.1f} -> {new['queries']:.1f}"
+        )
+    for name in sorted(before.keys() ^ after.keys()):
+        print(f"   {name:<34} solo en {'la base' if name in before else 'la nueva corrida'}")
+
+    print(f"{regressions} regresiones")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Shared plumbing for the Django-backed benchmarks: setup, timing and JSON results."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def setup(database):
+    """Configures Django on the benchmark database and brings its schema up to date"""
+    sys.path.insert(0, str(ROOT))
+    os.environ['BENCH_DB'] = database
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    (Path(__file__).resolve().parent / '.data').mkdir(exist_ok=True)
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    # Lets django.test.Client reach the admin (ALLOWED_HOSTS, no DEBUG).
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+
+
+@dataclass
+class Result:
+    name: str
+    iterations: int
+    ops_per_second: float
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+    queries: float
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def measure(name, operation, iterations, prepare=None, warmup=1):
+    """Times `operation` `iterations` times after `warmup` untimed runs.
+
+    `prepare()` runs before every call outside the timed region and its
+    return value is passed to `operation`. Queries are counted with the
+    same execute_wrapper the request profiler uses.
+    """
+    from stationery.profiling import profile_queries
+
+    timings, queries = [], []
+    for run in range(warmup + iterations):
+        arguments = prepare() if prepare else ()
+        with profile_queries() as profiler:
+            start = time.perf_counter()
+            operation(*arguments)
+            elapsed = time.perf_counter() - start
+        if run >= warmup:
+            timings.append(elapsed * 1000)
+            queries.append(profiler.queries)
+
+    result = Result(
+        name=name,
+        iterations=iterations,
+        ops_per_second=len(timings) / (sum(timings) / 1000),
+        mean_ms=sum(timings) / len(timings),
+        p50_ms=percentile(timings, 0.50),
+        p99_ms=percentile(timings, 0.99),
+        queries=sum(queries) / len(queries),
+    )
+    print(
+        f"{name:<34} {result.ops_per_second:>10.1f} ops/s  p50 {result.p50_ms:>8.2f} ms  "
+        f"p99 {result.p99_ms:>8.2f} ms  {result.queries:>7.1f} consultas"
+    )
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_results(results, parameters, output=None):
+    """Stores the results with the commit, backend and volumes they were measured on"""
+    import django
+    from django.db import connection
+
+    revision = git_revision()
+    payload = {
+        'commit': revision,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'parameters': parameters,
+        'results': [asdict(result) for result in results],
+    }
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{revision}-{connection.vendor}.json"
+    Path(output).write_text(json.dumps(payload, indent=2))
+    print(f"Resultados guardados en {output}")
+    return output
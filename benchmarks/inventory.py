@@ -0,0 +1,209 @@
+"""Benchmarks of the inventory write paths and the admin changelists.
+
+Fills a dedicated database (see benchmarks/settings.py) once with the
+same FixtureGenerator as the generate_fixture_data command, then measures
+ops/s, p50/p99 latency and queries per operation, and stores the numbers
+as JSON for compare.py. Run from the repository root:
+
+    python benchmarks/inventory.py --db sqlite --products 100000 --sales 200000
+    python benchmarks/inventory.py --db postgres --only sale,changelist
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks import harness  # noqa: E402
+
+
+class Suite:
+    def __init__(self, lines, iterations, seed):
+        from stationery.models import Customer, Discount, Product, TransactionStatus
+
+        self.lines = lines
+        self.iterations = iterations
+        self.rng = random.Random(seed)
+        self.product_ids = list(Product.objects.filter(active=True).values_list('pk', flat=True))
+        self.customer = Customer.objects.order_by('pk').first()
+        self.pending = TransactionStatus.objects.get(code='PENDING')
+        self.discounts = list(Discount.objects.filter(active=True).select_related('type', 'scope'))
+
+    def cart(self):
+        from stationery.models import Product
+
+        ids = self.rng.sample(self.product_ids, self.lines)
+        return list(Product.objects.filter(pk__in=ids))
+
+    def new_sale(self):
+        from stationery.models import Sale
+
+        return Sale.objects.create(payment_method_id='CA', status=self.pending, customer=self.customer)
+
+    def new_purchase(self):
+        from stationery.models import Purchase, Supplier
+
+        return Purchase.objects.create(supplier=Supplier.objects.order_by('pk').first(), status=self.pending)
+
+    def sale_detail_save(self):
+        from stationery.models import SaleDetail
+
+        def post(sale, products):
+            for product in products:
+                SaleDetail(sale=sale, product=product, quantity=1, unit_price=product.sale_price).save()
+
+        return harness.measure(
+            f'sale_detail_save[{self.lines}]', post, self.iterations,
+            prepare=lambda: (self.new_sale(), self.cart()),
+        )
+
+    def sale_post_lines(self):
+        from stationery.models import SaleDetail
+
+        def post(sale, products):
+            sale.post_lines([SaleDetail(product_id=product.pk, quantity=1) for product in products])
+
+        return harness.measure(
+            f'sale_post_lines[{self.lines}]', post, self.iterations,
+            prepare=lambda: (self.new_sale(), self.cart()),
+        )
+
+    def purchase_detail_save(self):
+        from stationery.models import PurchaseDetail
+
+        def receive(purchase, products):
+            for product in products:
+                PurchaseDetail(purchase=purchase, product=product, quantity=10, unit_price=product.purchase_price).save()
+
+        return harness.measure(
+            f'purchase_detail_save[{self.lines}]', receive, self.iterations,
+            prepare=lambda: (self.new_purchase(), self.cart()),
+        )
+
+    def purchase_receive_lines(self):
+        from stationery.models import PurchaseDetail
+
+        def receive(purchase, products):
+            purchase.receive_lines([
+                PurchaseDetail(product_id=product.pk, quantity=10, unit_price=product.purchase_price)
+                for product in products
+            ])
+
+        return harness.measure(
+            f'purchase_receive_lines[{self.lines}]', receive, self.iterations,
+            prepare=lambda: (self.new_purchase(), self.cart()),
+        )
+
+    def cancel_sale(self):
+        from stationery.models import Sale, SaleDetail
+
+        def prepare():
+            sale = self.new_sale()
+            sale.post_lines([SaleDetail(product_id=product.pk, quantity=1) for product in self.cart()])
+            return (Sale.objects.filter(pk=sale.pk),)
+
+        return harness.measure(
+            f'cancel_sale[{self.lines}]', lambda queryset: Sale.cancel_many(queryset), self.iterations,
+            prepare=prepare,
+        )
+
+    def discount_apply_to_product(self):
+        def resolve(products):
+            for product in products:
+                for discount in self.discounts:
+                    discount.apply_to_product(product)
+
+        return harness.measure(
+            f'discount_apply_to_product[{self.lines}x{len(self.discounts)}]', resolve, self.iterations,
+            prepare=lambda: (self.cart(),),
+        )
+
+    def discount_engine_best_for(self):
+        from stationery.discounts import discount_engine
+
+        def resolve(products):
+            for product in products:
+                discount_engine.best_for(product)
+
+        discount_engine.invalidate()
+        return harness.measure(
+            f'discount_engine_best_for[{self.lines}]', resolve, self.iterations,
+            prepare=lambda: (self.cart(),),
+        )
+
+    def changelists(self):
+        from django.contrib.auth.models import User
+        from django.test import Client
+        from django.urls import reverse
+
+        user = User.objects.filter(username='bench').first() or User.objects.create_superuser(
+            'bench', 'bench@example.com', 'bench'
+        )
+        client = Client()
+        client.force_login(user)
+        results = []
+        for model in ('product', 'sale', 'purchase', 'stockmovement', 'discount', 'saleinvoice'):
+            url = reverse(f'admin:stationery_{model}_changelist')
+
+            def render(url=url):
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+
+            results.append(harness.measure(f'changelist[{model}]', render, self.iterations))
+        return results
+
+
+def fill(products, sales, seed):
+    """Generates the fixture history unless the database already holds a catalog"""
+    from django.db import connection
+    from stationery.datagen import FixtureGenerator
+    from stationery.models import Product, Sale, StockMovement
+
+    if Product.objects.exists():
+        print(f"Reutilizando datos: {Product.objects.count()} productos, {Sale.objects.count()} ventas, "
+              f"{StockMovement.objects.count()} movimientos (borre la base de datos para regenerarlos)")
+        return
+    print(f"Preparando datos: {products} productos, {sales} ventas")
+    counts = FixtureGenerator(seed=seed, chunk_size=5000).run(products=products, sales=sales)
+    print(f"{counts['sale_lines']} líneas de venta y {counts['movements']} movimientos generados")
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+GROUPS = {
+    'sale': ('sale_detail_save', 'sale_post_lines', 'cancel_sale'),
+    'purchase': ('purchase_detail_save', 'purchase_receive_lines'),
+    'discount': ('discount_apply_to_product', 'discount_engine_best_for'),
+    'changelist': ('changelists',),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--sales', type=int, default=200_000)
+    parser.add_argument('--lines', type=int, default=20, help="Líneas por venta o compra")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', default=','.join(GROUPS), help=f"Grupos a medir: {', '.join(GROUPS)}")
+    parser.add_argument('--output', help="Archivo JSON de resultados (por defecto benchmarks/results/)")
+    args = parser.parse_args()
+
+    harness.setup(args.db)
+    fill(args.products, args.sales, args.seed)
+
+    suite = Suite(args.lines, args.iterations, args.seed)
+    results = []
+    for group in args.only.split(','):
+        for name in GROUPS[group.strip()]:
+            outcome = getattr(suite, name)()
+            results.extend(outcome if isinstance(outcome, list) else [outcome])
+
+    parameters = {name: value for name, value in vars(args).items() if name not in ('only', 'output')}
+    harness.write_results(results, parameters, args.output)
+
+
+if __name__ == '__main__':
+    main()
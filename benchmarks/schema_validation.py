@@ -0,0 +1,65 @@
+"""Per-product cost of validating attributes against a Category.product_schema.
+
+Compares jsonschema.validate() (metaschema check and validator build on every
+call, as Product.clean used to do) with the cached validator from
+stationery.schemas. Run from the repository root:
+
+    python benchmarks/schema_validation.py --properties 60 --products 2000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from jsonschema import validate
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from stationery.schemas import validation_error  # noqa: E402
+
+
+def build_schema(properties):
+    types = ('string', 'number', 'integer', 'boolean')
+    return {
+        "$schema": "https://json-schema.org/draft/2020-12/schema",
+        "type": "object",
+        "properties": {
+            f"attr_{i}": {"type": types[i % len(types)]} for i in range(properties)
+        },
+        "required": [f"attr_{i}" for i in range(0, properties, 2)],
+    }
+
+
+def build_attributes(properties):
+    values = ("azul", 0.7, 12, True)
+    return {f"attr_{i}": values[i % len(values)] for i in range(properties)}
+
+
+def measure(label, func, products):
+    start = time.perf_counter()
+    for _ in range(products):
+        func()
+    elapsed = time.perf_counter() - start
+    per_product = elapsed / products * 1e6
+    print(f"{label:<12} {per_product:10.1f} µs/producto  ({products / elapsed:,.0f} productos/s)")
+    return per_product
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--properties', type=int, default=60)
+    parser.add_argument('--products', type=int, default=2000)
+    args = parser.parse_args()
+
+    schema = build_schema(args.properties)
+    attributes = build_attributes(args.properties)
+    category = SimpleNamespace(pk=1, product_schema=schema)
+
+    print(f"Esquema con {args.properties} propiedades, {args.products} productos")
+    before = measure("antes", lambda: validate(instance=attributes, schema=schema), args.products)
+    after = measure("después", lambda: validation_error(category, attributes), args.products)
+    print(f"aceleración  {before / after:10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
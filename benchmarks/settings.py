@@ -0,0 +1,46 @@
+"""Django settings for the benchmarks: the project settings on a separate database.
+
+BENCH_DB selects the backend (sqlite or postgres). SQLite uses
+benchmarks/.data/bench.sqlite3; PostgreSQL reads BENCH_PG_NAME, BENCH_PG_USER,
+BENCH_PG_PASSWORD, BENCH_PG_HOST and BENCH_PG_PORT.
+"""
+import os
+from pathlib import Path
+
+from core.settings import *  # noqa: F401,F403
+from core.settings import DATABASES
+
+BENCH_DIR = Path(__file__).resolve().parent
+BENCH_DB = os.environ.get('BENCH_DB', 'sqlite')
+
+if BENCH_DB == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('BENCH_PG_NAME', 'stationery_bench'),
+            'USER': os.environ.get('BENCH_PG_USER', 'postgres'),
+            'PASSWORD': os.environ.get('BENCH_PG_PASSWORD', ''),
+            'HOST': os.environ.get('BENCH_PG_HOST', 'localhost'),
+            'PORT': os.environ.get('BENCH_PG_PORT', '5432'),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            **DATABASES['default'],
+            'NAME': BENCH_DIR / '.data' / 'bench.sqlite3',
+        }
+    }
+
+# Measured numbers should not include the profiler or hit shared caches.
+QUERY_PROFILING = False
+STOCK_MOVEMENT_WRITE_BEHIND = False
+CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'bench-{alias}'}
+    for alias in ('default', 'invoices', 'profiling', 'storefront')
+}
+CACHES['versions'] = {
+    'BACKEND': 'stationery.caching.VersionCache',
+    'LOCATION': BENCH_DIR / '.data' / 'versions',
+    'TIMEOUT': None,
+}
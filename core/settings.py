@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stationery.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,10 +80,112 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLite has no row locks: BEGIN IMMEDIATE takes the write lock when a
+        # transaction starts, so concurrent checkouts queue on the busy
+        # timeout instead of failing to upgrade a read lock.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        # A file instead of the in-memory default, so tests can open
+        # concurrent connections (see ConcurrentCheckoutTests).
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# STOREFRONT_CACHE_BACKEND selects where storefront pages and product card
+# fragments live: 'locmem' (per process) or 'file' (shared by all workers).
+# Their keys embed the counters of the 'versions' cache, which is always
+# shared, so every worker sees a bump whichever backend is chosen; the
+# discount engine follows the same counters.
+
+STOREFRONT_CACHE_BACKEND = os.environ.get('STOREFRONT_CACHE_BACKEND', 'locmem')
+STOREFRONT_CACHE_TIMEOUT = int(os.environ.get('STOREFRONT_CACHE_TIMEOUT', 600))
+
+# Write-behind for the stock ledger: when enabled, StockMovement rows are
+# appended to StockMovementJournal and moved in bulk by the
+# flush_stock_movements command.
+STOCK_MOVEMENT_WRITE_BEHIND = os.environ.get('STOCK_MOVEMENT_WRITE_BEHIND', '') == '1'
+
+# Processes the render_invoices command renders PDFs with by default; the
+# admin export always renders in the request process.
+INVOICE_RENDER_WORKERS = int(os.environ.get('INVOICE_RENDER_WORKERS', os.cpu_count() or 1))
+
+# Seconds the admin dashboard KPIs are served from the default cache.
+ADMIN_DASHBOARD_CACHE_TIMEOUT = int(os.environ.get('ADMIN_DASHBOARD_CACHE_TIMEOUT', 60))
+
+# Per-request query and latency profiling (stationery.profiling), off unless
+# QUERY_PROFILING=1. Budgets cap queries, duplicates, db_ms and view_ms per
+# URL name, or per (URL name, method) where a POST does different work;
+# '*' applies to the rest. They are measured on warm caches: lookup tables,
+# the discount engine and cached pages already loaded. Overruns are logged,
+# or raise with QUERY_BUDGET_STRICT, as `pipenv run test` does.
+QUERY_PROFILING = os.environ.get('QUERY_PROFILING', '') == '1'
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '') == '1'
+QUERY_BUDGETS = {
+    '*': {'queries': 50, 'duplicates': 10},
+    'home': {'queries': 5, 'duplicates': 0},
+    'shop': {'queries': 8, 'duplicates': 0},
+    'shopProductDetail': {'queries': 5, 'duplicates': 0},
+    # A prefix not cached yet is searched in the index before loading prices.
+    'admin_product_lookup': {'queries': 5, 'duplicates': 0},
+    'admin_dashboard': {'queries': 12, 'duplicates': 0},
+    # Changelists run COUNT(*) twice for the full and the filtered count.
+    'admin:stationery_product_changelist': {'queries': 12, 'duplicates': 1},
+    'admin:stationery_sale_changelist': {'queries': 12, 'duplicates': 1},
+    'admin:stationery_purchase_changelist': {'queries': 12, 'duplicates': 1},
+    'admin:stationery_supplier_changelist': {'queries': 12, 'duplicates': 1},
+    'admin:stationery_discount_changelist': {'queries': 12, 'duplicates': 1},
+    'admin:stationery_saleinvoice_changelist': {'queries': 12, 'duplicates': 1},
+    # Actions build the changelist twice, once to read the selection and
+    # once more for the action, before doing their own writes.
+    ('admin:stationery_purchase_changelist', 'POST'): {'queries': 20, 'duplicates': 4},
+    ('admin:stationery_sale_changelist', 'POST'): {'queries': 20, 'duplicates': 4},
+}
+
+# Seconds a product lookup prefix stays cached; edits to products drop it earlier.
+PRODUCT_LOOKUP_CACHE_TIMEOUT = int(os.environ.get('PRODUCT_LOOKUP_CACHE_TIMEOUT', 300))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered invoice PDFs, shared by every worker and kept across restarts.
+    'invoices': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'invoices',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    # Samples published by QueryProfilingMiddleware for profile_report.
+    'profiling': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'profiling',
+        'TIMEOUT': 24 * 60 * 60,
+    },
+    # Version counters (stationery.caching) and the discount changes recorded
+    # with them. Counters never expire and the backend only culls expired
+    # changes, scanning every file once past MAX_ENTRIES, so the limit sits
+    # above one counter per product.
+    'versions': {
+        'BACKEND': 'stationery.caching.VersionCache',
+        'LOCATION': BASE_DIR / '.cache' / 'versions',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'storefront': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'storefront',
+        'TIMEOUT': STOREFRONT_CACHE_TIMEOUT,
+    } if STOREFRONT_CACHE_BACKEND == 'file' else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'storefront',
+        'TIMEOUT': STOREFRONT_CACHE_TIMEOUT,
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -18,8 +18,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from stationery.autocomplete import ProductLookupView
+from stationery.dashboard import AdminDashboardView
 
 urlpatterns = [
+    path('admin/dashboard/', admin.site.admin_view(AdminDashboardView.as_view()), name='admin_dashboard'),
+    path('admin/product-lookup/', admin.site.admin_view(ProductLookupView.as_view()), name='admin_product_lookup'),
     path('admin/', admin.site.urls),
     path('', include('stationery.urls'), name='stationery'),
 ]
@@ -6,15 +6,30 @@ from django.urls import reverse
 from django.utils import timezone
 from django.utils.html import format_html
 from django_jsonform.widgets import JSONFormWidget
+from django.core.exceptions import ValidationError
 from django.contrib.admin import SimpleListFilter, DateFieldListFilter, ChoicesFieldListFilter
-from django.db.models import F, Q
+from django.db import transaction
+from django.db.models import F, Q, Count, OuterRef
 from .models import (
     Category, Product, Supplier, Customer,
     StockMovement, PurchaseDetail, Purchase,
     Brand, Company, PaymentMethod, Discount,
     Sale, SaleDetail, SaleInvoice, TransactionStatus,
-    MovementType, DiscountType, ScopeType, PurchaseInvoice
+    MovementType, DiscountType, ScopeType, PurchaseInvoice,
+    StockSnapshot, StockMovementJournal, ReorderLine, DailyProductSales, DailyCategorySales,
+    BELOW_MINIMUM_STOCK
 )
+from .catalog import coerce_value, filter_by_attributes
+from .exports import streaming_export
+from .journal import flush
+from .invoicing import streaming_invoices
+from .autocomplete import ProductLookupMixin
+from .search import search_products
+from .dashboard import due_state, PAID, OVERDUE, PENDING
+from .lookups import REGISTRIES, transaction_statuses
+from .reorder import DRAFT_STATUS
+from .utils.enums import ScopeTypeEnum
+from .utils.queries import count_subquery
 
 
 class SchemaAwareJSONEditor(JSONFormWidget):
@@ -78,15 +93,90 @@ class ProductForm(forms.ModelForm):
             self.fields['attributes'].widget = JSONFormWidget(schema=category.product_schema)
 
 
+class BookedLineForm(forms.ModelForm):
+    """Detail form whose product is fixed once the line is saved"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk and 'product' in self.fields:
+            self.fields['product'].disabled = True
+
+
+class StatusTransitionsMixin:
+    """Keeps `status` out of the change form: a sale or purchase only moves
+    through the changelist actions, which give back or book its stock and
+    rollups. New ones always start pending."""
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly = tuple(super().get_readonly_fields(request, obj))
+        return readonly + ('status',) if obj is not None else readonly
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'status':
+            kwargs['queryset'] = TransactionStatus.objects.filter(code='PENDING')
+            kwargs['empty_label'] = None
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class SupplierListFilter(admin.RelatedFieldListFilter):
+    """Supplier filter loading the companies its labels show in the same query"""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin) or ('name',)
+        return [
+            (supplier.pk, str(supplier))
+            for supplier in Supplier.objects.select_related('company').order_by(*ordering)
+        ]
+
+
+class LookupListFilter(admin.RelatedFieldListFilter):
+    """Filter on a lookup table listing its rows from the LookupRegistry, without a query"""
+
+    def field_choices(self, field, request, model_admin):
+        rows = REGISTRIES[field.related_model._meta.label].all()
+        ordering = [name for name in self.field_admin_ordering(field, request, model_admin) if not name.startswith('-')]
+        rows.sort(key=lambda obj: [getattr(obj, name) for name in ordering] or str(obj))
+        return [(obj.pk, str(obj)) for obj in rows]
+
+
+class LowStockFilter(admin.SimpleListFilter):
+    title = 'Estado de stock'
+    parameter_name = 'stock_status'
+
+    def lookups(self, request, model_admin):
+        return (('low', 'Stock Bajo'), ('ok', 'Stock OK'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'low':
+            return queryset.filter(BELOW_MINIMUM_STOCK)
+        if self.value() == 'ok':
+            return queryset.filter(stock__gte=F('minimum_stock'))
+        return queryset
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'sale_price', 'stock', 'category', 'attribute_preview', 'active', 'id')
     list_editable = ('active',)
-    list_filter = ('category', 'suppliers', 'active')
-    search_fields = ('name', 'description', 'attributes')
+    list_filter = ('category', ('suppliers', SupplierListFilter), 'active', LowStockFilter)
+    search_fields = ('name', 'description')
+    search_help_text = "Busque por nombre, marca, categoría, descripción o atributos (acepta prefijos); use clave=valor para filtrar por atributos (ej. color=azul)"
     readonly_fields = ('last_updated', 'creation_date', 'schema_help')
     filter_horizontal = ('suppliers',)
 
+    def get_search_results(self, request, queryset, search_term):
+        terms = search_term.split()
+        attribute_filters = {}
+        for term in terms:
+            key, sep, value = term.partition('=')
+            if sep and key and value:
+                attribute_filters[key] = coerce_value(value)
+        queryset = filter_by_attributes(queryset, attribute_filters)
+        search_term = " ".join(term for term in terms if '=' not in term)
+        if not search_term:
+            return queryset, False
+        return search_products(search_term, queryset), False
+
     def get_fieldsets(self, request, obj=None):
         return [
             ('Información Básica', {
@@ -144,9 +234,15 @@ class SupplierAdmin(admin.ModelAdmin):
     filter_horizontal = ('brands',)
     readonly_fields = ('last_updated', 'product_count')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _product_count=Count('product', distinct=True)
+        ).prefetch_related('brands')
+
     def brand_list(self, obj):
-        names = [b.name for b in obj.brands.all()[:3]]
-        return ", ".join(names) + ("..." if obj.brands.count() > 3 else "")
+        brands = list(obj.brands.all())
+        names = [b.name for b in brands[:3]]
+        return ", ".join(names) + ("..." if len(brands) > 3 else "")
     brand_list.short_description = "Marcas"
 
     def contact_info(self, obj):
@@ -154,6 +250,8 @@ class SupplierAdmin(admin.ModelAdmin):
     contact_info.short_description = "Contacto"
 
     def product_count(self, obj):
+        if hasattr(obj, '_product_count'):
+            return obj._product_count
         return Product.objects.filter(suppliers=obj).count()
     product_count.short_description = "Productos"
 
@@ -190,13 +288,84 @@ class StockMovementAdmin(admin.ModelAdmin):
     list_filter = ('movement_type', ('product__category', admin.RelatedFieldListFilter))
     readonly_fields = ('date',)
     search_fields = ('product__name',)
+    actions = ['export_csv', 'export_jsonl']
+
+    def export_csv(self, request, queryset):
+        return streaming_export('stock_movements', 'csv', parents=queryset)
+    export_csv.short_description = "Exportar a CSV"
+
+    def export_jsonl(self, request, queryset):
+        return streaming_export('stock_movements', 'jsonl', parents=queryset)
+    export_jsonl.short_description = "Exportar a JSONL"
+
+
+@admin.register(StockMovementJournal)
+class StockMovementJournalAdmin(admin.ModelAdmin):
+    """Movements waiting for flush_stock_movements, in write-behind mode"""
+    list_display = ('product', 'movement_type', 'quantity', 'reason', 'date')
+    list_select_related = ('product', 'movement_type')
+    actions = ['flush_journal']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def flush_journal(self, request, queryset):
+        moved = flush()
+        self.message_user(request, f"{moved} movimientos pasados al historial")
+    flush_journal.short_description = "Volcar todos los pendientes al historial"
+
+
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('product', 'stock', 'taken_at')
+    list_filter = (('taken_at', DateFieldListFilter),)
+    search_fields = ('product__name',)
+    date_hierarchy = 'taken_at'
+    readonly_fields = ('product', 'stock', 'taken_at')
+
+
+class SalesRollupAdmin(admin.ModelAdmin):
+    """Read-only view of the daily sales tables maintained by rollups.py"""
+    date_hierarchy = 'day'
+    list_filter = (('day', DateFieldListFilter),)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def margin_display(self, obj):
+        return f"${obj.margin:,.2f}"
+    margin_display.short_description = "Margen"
+
+
+@admin.register(DailyProductSales)
+class DailyProductSalesAdmin(SalesRollupAdmin):
+    list_display = ('day', 'product', 'units', 'revenue', 'discount', 'cost', 'margin_display')
+    list_filter = SalesRollupAdmin.list_filter + ('product__category',)
+    list_select_related = ('product',)
+    search_fields = ('product__name',)
 
 
+@admin.register(DailyCategorySales)
+class DailyCategorySalesAdmin(SalesRollupAdmin):
+    list_display = ('day', 'category', 'units', 'revenue', 'discount', 'cost', 'margin_display')
+    list_filter = SalesRollupAdmin.list_filter + ('category',)
+    list_select_related = ('category',)
 
-class PurchaseDetailInline(admin.TabularInline):
+
+class PurchaseDetailInline(ProductLookupMixin, admin.TabularInline):
     model = PurchaseDetail
+    form = BookedLineForm
+    lookup_inactive_products = True
     extra = 1
-    autocomplete_fields = ('product',)
     fields = ('product', 'quantity', 'unit_price', 'total_price')
     readonly_fields = ('total_price', 'purchase_attributes')
 
@@ -206,22 +375,44 @@ class PurchaseDetailInline(admin.TabularInline):
         return obj.quantity * obj.unit_price
     total_price.short_description = "Total"
 
+    def has_change_permission(self, request, obj=None):
+        # Received and cancelled purchases have settled their stock.
+        if obj is not None and obj.status.code in ('RECEIVED', 'CANCELLED'):
+            return False
+        return super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        if obj is not None and obj.status.code in ('RECEIVED', 'CANCELLED'):
+            return False
+        return super().has_delete_permission(request, obj)
+
+
+class ReorderLineInline(admin.TabularInline):
+    model = ReorderLine
+    extra = 0
+    can_delete = True
+    fields = ('product', 'quantity', 'unit_price', 'daily_velocity', 'stock')
+    readonly_fields = ('daily_velocity', 'stock')
+    autocomplete_fields = ('product',)
+    verbose_name_plural = "Sugerencias de reposición"
+
 
 @admin.register(Purchase)
-class PurchaseAdmin(admin.ModelAdmin):
+class PurchaseAdmin(StatusTransitionsMixin, admin.ModelAdmin):
     list_display    = ('date', 'status_badge', 'supplier', 'payment_method', 'total_display', 'id')
     list_filter     = (
-        'status',
+        ('status', LookupListFilter),
         ('date', DateFieldListFilter),
-        'supplier',
-        'payment_method',
+        ('supplier', SupplierListFilter),
+        ('payment_method', LookupListFilter),
     )
     search_fields   = ('invoice_number', 'supplier__name')
     raw_id_fields   = ('supplier', 'payment_method')
     date_hierarchy  = 'date'
-    inlines         = [PurchaseDetailInline]
-    actions         = ['mark_as_received', 'cancel_purchase']
+    inlines         = [PurchaseDetailInline, ReorderLineInline]
+    actions         = ['mark_as_received', 'cancel_purchase', 'receive_drafts', 'export_csv', 'export_jsonl']
     readonly_fields = ('created_by', 'date', 'total')
+    list_select_related = ('status', 'supplier__company', 'payment_method')
     fieldsets       = (
         (None, {
             'fields': (
@@ -256,30 +447,94 @@ class PurchaseAdmin(admin.ModelAdmin):
     total_display.short_description = 'Total'
 
     def mark_as_received(self, request, queryset):
-        received = TransactionStatus.objects.get(code='RECEIVED')
-        updated = queryset.exclude(status=received).update(status=received)
+        received = transaction_statuses.get('RECEIVED')
+        # Drafts have booked no stock yet; receive_drafts books their lines.
+        drafts = list(queryset.filter(status__code=DRAFT_STATUS).values_list('pk', flat=True))
+        if drafts:
+            self.message_user(
+                request,
+                f"Compras {', '.join(map(str, drafts))} son borradores de reposición: "
+                f"use \"{self.receive_drafts.short_description}\"",
+                level=messages.ERROR
+            )
+        updated = queryset.exclude(status=received).exclude(pk__in=drafts).update(status=received)
         self.message_user(request, f"{updated} compras marcadas como recibidas")
     mark_as_received.short_description = "Marcar como recibido"
 
     def cancel_purchase(self, request, queryset):
-        received  = TransactionStatus.objects.get(code='RECEIVED')
-        cancelled = TransactionStatus.objects.get(code='CANCELLED')
-        count = 0
-        for purchase in queryset:
-            if purchase.status == received:
-                self.message_user(
-                    request,
-                    f"Compra {purchase.id} no puede cancelarse (ya está recibida)",
-                    level=messages.ERROR
-                )
-                continue
-            purchase.status = cancelled
-            purchase.save()
-            purchase.purchasedetail_set.all().delete()
-            count += 1
-        self.message_user(request, f"{count} compras canceladas")
+        try:
+            cancelled, blocked = Purchase.cancel_many(queryset, created_by=request.user)
+        except ValidationError as e:
+            self.message_user(request, " ".join(e.messages), level=messages.ERROR)
+            return
+        if blocked:
+            self.message_user(
+                request,
+                f"Compras {', '.join(map(str, blocked))} no pueden cancelarse (ya están recibidas)",
+                level=messages.ERROR
+            )
+        self.message_user(request, f"{len(cancelled)} compras canceladas")
     cancel_purchase.short_description = "Cancelar compras seleccionadas"
 
+    def export_csv(self, request, queryset):
+        return streaming_export('purchases', 'csv', parents=queryset)
+    export_csv.short_description = "Exportar detalle a CSV"
+
+    def export_jsonl(self, request, queryset):
+        return streaming_export('purchases', 'jsonl', parents=queryset)
+    export_jsonl.short_description = "Exportar detalle a JSONL"
+
+    def get_deleted_objects(self, objs, request):
+        # Stock of the lines that was sold since cannot be taken back out;
+        # the delete page then refuses like it does for protected objects.
+        deleted, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        shortfalls = PurchaseDetail.removal_shortfalls(
+            PurchaseDetail.objects.filter(purchase__in=[obj.pk for obj in objs])
+        )
+        if shortfalls:
+            self.message_user(request, " ".join(shortfalls), level=messages.ERROR)
+            protected = [*protected, *shortfalls]
+        return deleted, model_count, perms_needed, protected
+
+    def get_inlines(self, request, obj):
+        # Drafts are booked from their reorder lines by receive_drafts; detail
+        # lines added meanwhile would book stock now and again on receipt.
+        if obj is not None and obj.status_id == transaction_statuses.get(DRAFT_STATUS).pk:
+            return [inline for inline in self.inlines if inline is not PurchaseDetailInline]
+        return self.inlines
+
+    def receive_drafts(self, request, queryset):
+        received = transaction_statuses.get('RECEIVED')
+        with transaction.atomic():
+            # Locked and re-checked, so a draft received by a concurrent
+            # request is not booked twice.
+            drafts = list(
+                Purchase.objects.filter(
+                    pk__in=list(queryset.values_list('pk', flat=True)), status__code=DRAFT_STATUS
+                ).select_for_update().prefetch_related('reorder_lines')
+            )
+            for purchase in drafts:
+                purchase.receive_lines([
+                    PurchaseDetail(product_id=line.product_id, quantity=line.quantity, unit_price=line.unit_price)
+                    for line in purchase.reorder_lines.all()
+                ])
+            Purchase.objects.filter(pk__in=[purchase.pk for purchase in drafts]).update(status=received)
+        self.message_user(request, f"{len(drafts)} borradores de reposición recibidos")
+    receive_drafts.short_description = "Recibir borradores de reposición"
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not PurchaseDetail:
+            return super().save_formset(request, form, formset, change)
+
+        instances = formset.save(commit=False)
+        for obj in formset.deleted_objects:
+            obj.delete()
+        for obj in instances:
+            if obj.pk is not None:
+                obj.save()
+        form.instance.receive_lines([obj for obj in instances if obj.pk is None])
+        formset.save_m2m()
+
 
 @admin.register(PurchaseDetail)
 class PurchaseDetailAdmin(admin.ModelAdmin):
@@ -296,6 +551,22 @@ class PurchaseDetailAdmin(admin.ModelAdmin):
         return obj.quantity * obj.unit_price
     total_price.short_description = "Total"
 
+    def get_deleted_objects(self, objs, request):
+        deleted, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        shortfalls = PurchaseDetail.removal_shortfalls(PurchaseDetail.objects.filter(pk__in=[obj.pk for obj in objs]))
+        if shortfalls:
+            self.message_user(request, " ".join(shortfalls), level=messages.ERROR)
+            protected = [*protected, *shortfalls]
+        return deleted, model_count, perms_needed, protected
+
+    def get_readonly_fields(self, request, obj=None):
+        ro = list(self.readonly_fields)
+        if obj:
+            ro += ['purchase', 'product']
+            if obj.purchase.status.code in ('RECEIVED', 'CANCELLED'):
+                ro += ['quantity', 'unit_price']
+        return ro
+
 
 @admin.register(PurchaseInvoice)
 class PurchaseInvoiceAdmin(admin.ModelAdmin):
@@ -342,24 +613,9 @@ class PurchaseInvoiceAdmin(admin.ModelAdmin):
     send_invoice_email.short_description = "Enviar factura por email"
 
     def export_to_pdf(self, request, queryset):
-        self.message_user(request, f"{queryset.count()} PDFs generados")
+        return streaming_invoices('purchase', queryset)
     export_to_pdf.short_description = "Exportar a PDF"
 
-class LowStockFilter(admin.SimpleListFilter):
-    title = 'Estado de stock'
-    parameter_name = 'stock_status'
-
-    def lookups(self, request, model_admin):
-        return (('low', 'Stock Bajo'), ('ok', 'Stock OK'))
-
-    def queryset(self, request, queryset):
-        if self.value() == 'low':
-            return queryset.filter(stock__lt=F('minimum_stock'))
-        if self.value() == 'ok':
-            return queryset.filter(stock__gte=F('minimum_stock'))
-        return queryset
-
-
 @admin.register(Brand)
 class BrandAdmin(admin.ModelAdmin):
     list_display = ('name', 'short_description', 'creation_date', 'image_tag', 'created_by')
@@ -443,6 +699,13 @@ class DiscountAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _all_products_count=count_subquery(Product.objects.all()),
+            _selected_products_count=count_subquery(Product.objects.filter(discount=OuterRef('pk'))),
+            _category_products_count=count_subquery(Product.objects.filter(category__discount=OuterRef('pk'))),
+        )
+
     def type_label(self, obj):
         return obj.type.label
     type_label.short_description = 'Tipo'
@@ -458,7 +721,14 @@ class DiscountAdmin(admin.ModelAdmin):
     active_badge.short_description = 'Estado'
 
     def applicable_products_count(self, obj):
-        return obj.applicable_products().count()
+        if not hasattr(obj, '_all_products_count'):
+            return obj.applicable_products().count()
+        scope = obj.scope_enum
+        if scope in (ScopeTypeEnum.ALL_PRODUCTS, ScopeTypeEnum.ALL_CATEGORIES):
+            return obj._all_products_count
+        if scope == ScopeTypeEnum.SELECTED_CATEGORIES:
+            return obj._category_products_count
+        return obj._selected_products_count
     applicable_products_count.short_description = 'Productos Aplicables'
 
     def applicable_products_preview(self, obj):
@@ -477,24 +747,35 @@ class DiscountAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
-class SaleDetailInline(admin.TabularInline):
+class SaleDetailInline(ProductLookupMixin, admin.TabularInline):
     model = SaleDetail
+    form = BookedLineForm
     extra = 0
-    readonly_fields = ('final_price', 'sale_attributes')
-    autocomplete_fields = ('product',)
+    readonly_fields = ('final_price', 'sale_attributes', 'created_by')
     verbose_name_plural = "Detalles de Venta"
 
+    def has_change_permission(self, request, obj=None):
+        # Lines of paid or cancelled sales are history.
+        if obj is not None and obj.status_id != transaction_statuses.get('PENDING').pk:
+            return False
+        return super().has_change_permission(request, obj)
+
+    def get_queryset(self, request):
+        # Each row is titled with str(detail), which names its sale.
+        return super().get_queryset(request).select_related('sale')
+
 
 @admin.register(Sale)
-class SaleAdmin(admin.ModelAdmin):
+class SaleAdmin(StatusTransitionsMixin, admin.ModelAdmin):
     list_display = ('date', 'status_badge', 'payment_method', 'total_display', 'products_count', 'id')
-    list_filter = ('status', ('date', admin.DateFieldListFilter), 'payment_method')
+    list_filter = (('status', LookupListFilter), ('date', admin.DateFieldListFilter), ('payment_method', LookupListFilter))
     search_fields = ('customer__name', 'customer__email', 'payment_method__name', 'status__label')
     raw_id_fields = ('customer', 'payment_method')
     date_hierarchy = 'date'
     inlines = [SaleDetailInline]
-    actions = ['mark_as_paid', 'cancel_sale']
+    actions = ['mark_as_paid', 'cancel_sale', 'export_csv', 'export_jsonl']
     readonly_fields = ('created_by', 'date', 'subtotal', 'total')
+    list_select_related = ('status', 'payment_method')
     fieldsets = (
         (None, {
             'fields': (
@@ -525,42 +806,48 @@ class SaleAdmin(admin.ModelAdmin):
         return f"${obj.total:.2f}"
     total_display.short_description = 'Total'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_products_count=Count('products'))
+
     def products_count(self, obj):
+        if hasattr(obj, '_products_count'):
+            return obj._products_count
         return obj.products.count()
     products_count.short_description = 'Productos'
 
     def mark_as_paid(self, request, queryset):
-        paid_status = TransactionStatus.objects.get(code='PAID')
+        paid_status = transaction_statuses.get('PAID')
         updated = queryset.exclude(status=paid_status).update(status=paid_status)
         self.message_user(request, f"{updated} ventas marcadas como pagadas")
     mark_as_paid.short_description = "Marcar como pagado"
 
     def cancel_sale(self, request, queryset):
-        paid_status = TransactionStatus.objects.get(code='PAID')
-        cancelled_status = TransactionStatus.objects.get(code='CANCELLED')
-        cancelled_count = 0
-
-        for sale in queryset:
-            if sale.status == paid_status:
-                self.message_user(
-                    request,
-                    f"Venta {sale.id} no puede cancelarse (ya está pagada)",
-                    level=messages.ERROR
-                )
-                continue
-            sale.status = cancelled_status
-            sale.save()
-            sale.saledetail_set.all().delete()
-            cancelled_count += 1
-
-        self.message_user(request, f"{cancelled_count} ventas canceladas")
+        cancelled, blocked = Sale.cancel_many(queryset, created_by=request.user)
+        if blocked:
+            self.message_user(
+                request,
+                f"Ventas {', '.join(map(str, blocked))} no pueden cancelarse (ya están pagadas)",
+                level=messages.ERROR
+            )
+        self.message_user(request, f"{len(cancelled)} ventas canceladas")
     cancel_sale.short_description = "Cancelar ventas seleccionadas"
 
+    def export_csv(self, request, queryset):
+        return streaming_export('sales', 'csv', parents=queryset)
+    export_csv.short_description = "Exportar detalle a CSV"
+
+    def export_jsonl(self, request, queryset):
+        return streaming_export('sales', 'jsonl', parents=queryset)
+    export_jsonl.short_description = "Exportar detalle a JSONL"
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.created_by = request.user
-        obj.update_total()
-        super().save_model(request, obj, form, change)
+            super().save_model(request, obj, form, change)
+        elif form.changed_data:
+            # Totals follow the lines through F() deltas; writing back the
+            # values this request loaded would undo a concurrent one.
+            obj.save(update_fields=form.changed_data)
 
 
 @admin.register(SaleDetail)
@@ -581,8 +868,10 @@ class SaleDetailAdmin(admin.ModelAdmin):
 
     def get_readonly_fields(self, request, obj=None):
         ro = list(self.readonly_fields)
-        if obj and obj.sale.status.code != 'PENDING':
-            ro += ['quantity', 'unit_price']
+        if obj:
+            ro.append('product')
+            if obj.sale.status.code != 'PENDING':
+                ro += ['quantity', 'unit_price', 'discount_name', 'discount_type', 'discount_value']
         return ro
 
 
@@ -591,16 +880,11 @@ class DueDateFilter(SimpleListFilter):
     parameter_name = 'due_status'
 
     def lookups(self, request, model_admin):
-        return (('pending', 'Pendiente'), ('overdue', 'Vencida'), ('paid', 'Pagada'))
+        return ((PENDING, 'Pendiente'), (OVERDUE, 'Vencida'), (PAID, 'Pagada'))
 
     def queryset(self, request, queryset):
-        today = timezone.now().date()
-        if self.value() == 'pending':
-            return queryset.filter(due_date__gt=today, sale__status__code='PAID')
-        if self.value() == 'overdue':
-            return queryset.filter(due_date__lt=today, sale__status__code='PAID')
-        if self.value() == 'paid':
-            return queryset.filter(sale__status__code='PAID')
+        if self.value() in (PAID, OVERDUE, PENDING):
+            return queryset.alias(due_state=due_state('sale__status__code')).filter(due_state=self.value())
         return queryset
 
 
@@ -614,9 +898,11 @@ class SaleInvoiceAdmin(admin.ModelAdmin):
         'issue_date',
         ('sale__status__label', admin.ChoicesFieldListFilter),
         ('due_date', admin.DateFieldListFilter),
+        DueDateFilter,
     )
     search_fields = ('invoice_number', 'sale__id', 'sale__status__label')
     readonly_fields = ('created_by', 'last_updated', 'invoice_number', 'issue_date', 'sale')
+    list_select_related = ('sale__status', 'created_by')
     raw_id_fields = ('sale',)
     date_hierarchy = 'issue_date'
     fieldsets = (
@@ -634,12 +920,13 @@ class SaleInvoiceAdmin(admin.ModelAdmin):
     )
     actions = ['send_invoice_email', 'export_to_pdf']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(due_state=due_state('sale__status__code'))
+
     def due_date_status(self, obj):
-        today = timezone.now().date()
-        code = obj.sale.status.code
-        if obj.due_date < today and code != 'PAID':
+        if obj.due_state == OVERDUE:
             return format_html('<span style="color: red; font-weight: bold;">VENCIDA ({})</span>', obj.due_date)
-        if code == 'PAID':
+        if obj.due_state == PAID:
             return format_html('<span style="color: green;">PAGADA</span>')
         return format_html('<span style="color: orange;">PENDIENTE ({})</span>', obj.due_date)
     due_date_status.short_description = 'Estado'
@@ -670,7 +957,7 @@ class SaleInvoiceAdmin(admin.ModelAdmin):
     send_invoice_email.short_description = "Enviar factura por email"
 
     def export_to_pdf(self, request, queryset):
-        self.message_user(request, f"{queryset.count()} PDFs generados")
+        return streaming_invoices('sale', queryset)
     export_to_pdf.short_description = "Exportar a PDF"
 
 
@@ -749,3 +1036,4 @@ admin.site.site_header = "Administración de Librería"
 admin.site.site_title = "Sistema de Inventario"
 admin.site.index_title = "Panel de Control"
 admin.site.enable_nav_sidebar = False
+admin.site.index_template = "admin/stationery/index.html"
@@ -0,0 +1,214 @@
+import hashlib
+import time
+import unicodedata
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views import View
+
+from . import caching
+from .discounts import discount_engine
+from .models import Product
+from .search import attribute_text, search_products, search_terms
+
+
+# Shorter terms return nothing instead of matching most of the catalog.
+MIN_PREFIX = 2
+RESULT_LIMIT = 20
+# Matches kept per cached prefix; a prefix with fewer matches is complete
+# and longer terms are narrowed from it without querying.
+CANDIDATE_LIMIT = 200
+# Seconds a request waits for another one already searching the same prefix,
+# and how often it looks for the result meanwhile.
+COALESCE_WINDOW = 1.0
+COALESCE_POLL = 0.02
+CENTS = Decimal('0.01')
+
+
+def fold(text):
+    """Lowercase without diacritics, as the FTS tokenizer indexes it"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def normalize(term):
+    return ' '.join(search_terms(fold(term)))
+
+
+def _prefix_key(term, version):
+    digest = hashlib.md5(term.encode()).hexdigest()
+    return f'product-candidates:{version}:{digest}'
+
+
+def _matches(words, tokens):
+    return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+def _search(term):
+    # One row past the limit, unfiltered, tells whether the index had more
+    # matches; filtering before counting would hide a truncated result.
+    rows = list(
+        search_products(term, limit=CANDIDATE_LIMIT + 1)
+        .values_list('pk', 'active', 'name', 'brand__name', 'category__name', 'description', 'attributes')
+        [:CANDIDATE_LIMIT + 1]
+    )
+    candidates = []
+    for pk, active, name, brand, category, description, attributes in rows[:CANDIDATE_LIMIT]:
+        text = ' '.join(value for value in (name, brand, category, description) if value)
+        tokens = sorted(set(search_terms(fold(f'{text} {attribute_text(attributes)}'))))
+        candidates.append((pk, active, tokens))
+    return {'complete': len(rows) <= CANDIDATE_LIMIT, 'candidates': candidates}
+
+
+def _search_and_cache(cache, key, term):
+    entry = _search(term)
+    cache.set(key, entry, settings.PRODUCT_LOOKUP_CACHE_TIMEOUT)
+    return entry
+
+
+def _search_coalesced(cache, key, term):
+    """_search(term) cached under `key`, run once per burst of requests.
+
+    Every keystroke of every open register sends a request, so the same
+    prefix often arrives several times at once. The first request marks it
+    in flight; the others wait up to COALESCE_WINDOW for its result before
+    searching themselves.
+    """
+    marker = f'{key}:in-flight'
+    if cache.add(marker, True, COALESCE_WINDOW):
+        try:
+            return _search_and_cache(cache, key, term)
+        finally:
+            cache.delete(marker)
+    deadline = time.monotonic() + COALESCE_WINDOW
+    while time.monotonic() < deadline:
+        time.sleep(COALESCE_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return _search_and_cache(cache, key, term)
+
+
+def candidate_ids(term, include_inactive=False):
+    """Ranked ids of the products matching `term`, active ones only by default.
+
+    Results are cached per normalized prefix under the catalog version, so
+    editing a product drops them. While the cashier keeps typing, a term is
+    narrowed in memory from the longest cached complete prefix, so only the
+    first keystrokes of a word reach the search index, and requests arriving
+    together for the same uncached prefix share one search.
+    """
+    term = normalize(term)
+    if len(term) < MIN_PREFIX:
+        return []
+    cache = caching.storefront_cache()
+    version = caching.get_version(caching.CATALOG)
+    prefixes = [term[:end].rstrip() for end in range(len(term), MIN_PREFIX - 1, -1)]
+    keys = {prefix: _prefix_key(prefix, version) for prefix in dict.fromkeys(prefixes)}
+    cached = cache.get_many(list(keys.values()))
+
+    entry = cached.get(keys[term])
+    if entry is None:
+        words = term.split()
+        for prefix in prefixes[1:]:
+            parent = cached.get(keys[prefix])
+            if parent is not None and parent['complete']:
+                entry = {
+                    'complete': True,
+                    'candidates': [
+                        (pk, active, tokens) for pk, active, tokens in parent['candidates'] if _matches(words, tokens)
+                    ],
+                }
+                cache.set(keys[term], entry, settings.PRODUCT_LOOKUP_CACHE_TIMEOUT)
+                break
+        else:
+            entry = _search_coalesced(cache, keys[term], term)
+    return [pk for pk, active, _ in entry['candidates'] if active or include_inactive]
+
+
+def discount_payload(product, discount):
+    if discount is None:
+        return None
+    return {
+        'name': discount.name,
+        'type': discount.type_enum,
+        'value': str(discount.value),
+        'final_price': str((product.sale_price - discount.calculate_discount(product.sale_price)).quantize(CENTS)),
+    }
+
+
+def lookup(term, limit=RESULT_LIMIT, include_inactive=False):
+    """Select2 results with live stock, prices and the active discount.
+
+    Costs at most one query for the current stock and prices on top of the
+    cached candidate ids; discounts come from the in-memory engine.
+    """
+    ids = candidate_ids(term, include_inactive)[:limit]
+    if not ids:
+        return []
+    products = Product.objects.filter(pk__in=ids)
+    if not include_inactive:
+        products = products.filter(active=True)
+    products = products.only(
+        'pk', 'name', 'stock', 'sale_price', 'purchase_price', 'category_id'
+    ).in_bulk()
+    discounts = discount_engine.resolve(products.values())
+    results = []
+    for pk in ids:
+        product = products.get(pk)
+        if product is None:
+            continue
+        results.append({
+            'id': str(product.pk),
+            'text': f"{product.name} (stock: {product.stock})",
+            'name': product.name,
+            'stock': product.stock,
+            'price': str(product.sale_price),
+            'purchase_price': str(product.purchase_price),
+            'discount': discount_payload(product, discounts[pk]),
+        })
+    return results
+
+
+class ProductLookupView(View):
+    """Typeahead endpoint for the product field of the detail inlines"""
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.has_perm('stationery.view_product'):
+            raise PermissionDenied
+        results = lookup(request.GET.get('term', ''), include_inactive=request.GET.get('inactive') == '1')
+        return JsonResponse({'results': results, 'pagination': {'more': False}})
+
+
+class ProductLookupSelect(AutocompleteSelect):
+    """Admin autocomplete widget backed by ProductLookupView"""
+
+    def __init__(self, field, admin_site, include_inactive=False, **kwargs):
+        super().__init__(field, admin_site, **kwargs)
+        self.include_inactive = include_inactive
+
+    def get_url(self):
+        url = reverse('admin_product_lookup')
+        return f'{url}?inactive=1' if self.include_inactive else url
+
+
+class ProductLookupMixin:
+    """Renders an inline's `product` foreign key with ProductLookupSelect.
+
+    Inactive products are offered only when `lookup_inactive_products` is
+    set, e.g. to receive stock of a product no longer sold.
+    """
+    lookup_inactive_products = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'product':
+            kwargs['widget'] = ProductLookupSelect(
+                db_field, self.admin_site, include_inactive=self.lookup_inactive_products, using=kwargs.get('using')
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
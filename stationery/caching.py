@@ -0,0 +1,122 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.http import HttpResponse
+
+
+CATALOG = 'catalog'
+PRICING = 'pricing'
+
+
+class VersionCache(FileBasedCache):
+    """File cache that only culls expired entries: a dropped counter would
+    restart at 1 and make pages cached under the old version 1 current again.
+
+    Counters never expire; the discount changes recorded alongside them do,
+    and are deleted once the cache holds more than MAX_ENTRIES files.
+    """
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        for fname in filelist:
+            try:
+                with open(fname, 'rb') as f:
+                    self._is_expired(f)
+            except FileNotFoundError:
+                pass
+
+
+def storefront_cache():
+    return caches['storefront']
+
+
+def version_cache():
+    """Version counters, shared by every worker whatever the storefront backend"""
+    return caches['versions']
+
+
+def _version_key(name):
+    return f'storefront:version:{name}'
+
+
+def get_version(name):
+    return version_cache().get_or_set(_version_key(name), 1, None)
+
+
+def get_versions(names):
+    cache = version_cache()
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(list(keys))
+    missing = {key: 1 for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def bump_version(name):
+    """Invalidates every key built with this version name; returns the new version"""
+    cache = version_cache()
+    try:
+        return cache.incr(_version_key(name))
+    except ValueError:
+        cache.set(_version_key(name), 2, None)
+        return 2
+
+
+def product_version_name(product_id):
+    return f'product:{product_id}'
+
+
+def annotate_card_versions(products):
+    """Sets `card_version` on each product for its {% cache %} fragment key"""
+    versions = get_versions([product_version_name(product.pk) for product in products])
+    for product in products:
+        product.card_version = versions[product_version_name(product.pk)]
+    return products
+
+
+def page_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'storefront:page:{get_version(CATALOG)}:{get_version(PRICING)}:{path}'
+
+
+class CachedPageMixin:
+    """Serves full pages from the storefront cache to anonymous GET requests.
+
+    Keys embed the catalog and pricing versions, so bumping a version from the
+    signal receivers makes every cached page stale at once. The rendered
+    content is stored with the headers the view set.
+    """
+    cache_timeout = None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cache_timeout'] = self.get_cache_timeout()
+        context['pricing_version'] = get_version(PRICING)
+        return context
+
+    def get_cache_timeout(self):
+        return self.cache_timeout if self.cache_timeout is not None else settings.STOREFRONT_CACHE_TIMEOUT
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = storefront_cache()
+        key = page_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, headers = cached
+            return HttpResponse(content, headers=headers)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            timeout = self.get_cache_timeout()
+            response.add_post_render_callback(
+                lambda rendered: cache.set(key, (rendered.content, dict(rendered.items())), timeout)
+            )
+        return response
@@ -0,0 +1,111 @@
+import json
+from collections import defaultdict
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+
+from .models import Product
+
+
+ATTRIBUTE_PREFIX = 'attr_'
+
+
+def coerce_value(value, prop_schema=None):
+    """Converts a query string value to the JSON type stored in attributes"""
+    expected = (prop_schema or {}).get('type')
+    if expected == 'string':
+        return value
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return value
+    if expected in ('number', 'integer') and not isinstance(parsed, (int, float)):
+        return value
+    return parsed if isinstance(parsed, (int, float, bool)) else value
+
+
+def parse_attribute_filters(params, category=None):
+    """Extracts {key: value} from `attr_<key>=<value>` query parameters.
+
+    Values are typed with the category's product_schema when one is given.
+    """
+    properties = (category.product_schema or {}).get('properties', {}) if category else {}
+    filters = {}
+    for name, value in params.items():
+        if name.startswith(ATTRIBUTE_PREFIX) and value != '':
+            key = name[len(ATTRIBUTE_PREFIX):]
+            filters[key] = coerce_value(value, properties.get(key))
+    return filters
+
+
+def filter_by_attributes(queryset, filters):
+    """Narrows `queryset` to products whose attributes contain all `filters`.
+
+    On PostgreSQL this is a single `attributes @> {...}` lookup served by the
+    gin_attributes index; backends without JSON containment compare each key.
+    """
+    if not filters:
+        return queryset
+    if connection.features.supports_json_field_contains:
+        return queryset.filter(attributes__contains=filters)
+    return queryset.filter(**{f'attributes__{key}': value for key, value in filters.items()})
+
+
+def attribute_facets(queryset, keys=None):
+    """Counts products per attribute value for `queryset` in one query.
+
+    Returns {key: {value: count}}; only scalar attribute values are counted.
+    """
+    try:
+        ids_sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    except EmptyResultSet:
+        return {}
+    table = Product._meta.db_table
+    pk_column = Product._meta.pk.column
+    attributes_column = Product._meta.get_field('attributes').column
+    params = list(params)
+
+    if connection.vendor == 'postgresql':
+        sql = (
+            f'SELECT e.key, e.value::text, COUNT(*) FROM "{table}" p '
+            f'CROSS JOIN LATERAL jsonb_each(p."{attributes_column}") e '
+            f'WHERE p."{pk_column}" IN ({ids_sql}) '
+            "AND jsonb_typeof(e.value) IN ('string', 'number', 'boolean')"
+        )
+    else:
+        sql = (
+            f'SELECT e.key, e.value, e.type, COUNT(*) FROM "{table}" p, json_each(p."{attributes_column}") e '
+            f'WHERE p."{pk_column}" IN ({ids_sql}) '
+            "AND e.type IN ('text', 'integer', 'real', 'true', 'false')"
+        )
+    if keys:
+        sql += f" AND e.key IN ({', '.join(['%s'] * len(keys))})"
+        params += list(keys)
+    sql += " GROUP BY 1, 2" + ("" if connection.vendor == 'postgresql' else ", 3")
+
+    facets = defaultdict(dict)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            if connection.vendor == 'postgresql':
+                key, raw, count = row
+                value = json.loads(raw)
+            else:
+                key, value, value_type, count = row
+                if value_type in ('true', 'false'):
+                    value = value_type == 'true'
+            facets[key][value] = count
+    return dict(facets)
+
+
+def search_catalog(params, queryset=None, category=None, facets=True):
+    """Returns (products, active filters, facets) for shop query parameters.
+
+    Facets aggregate over every matching product; pass facets=False when
+    they are not shown and an empty dict comes back instead.
+    """
+    queryset = Product.objects.filter(active=True) if queryset is None else queryset
+    if category is not None:
+        queryset = queryset.filter(category=category)
+    filters = parse_attribute_filters(params, category)
+    products = filter_by_attributes(queryset, filters)
+    return products, filters, attribute_facets(products) if facets else {}
@@ -0,0 +1,127 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.views.generic import TemplateView
+
+from .models import (
+    BELOW_MINIMUM_STOCK, DailyCategorySales, Product, PurchaseInvoice, Sale, SaleInvoice
+)
+from .rollups import top_sellers
+
+
+CACHE_KEY = 'admin:dashboard'
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+PAID = 'paid'
+OVERDUE = 'overdue'
+PENDING = 'pending'
+
+# Statuses that settle an invoice. Purchases are never marked paid: the
+# supplier's invoice is settled once its goods are received.
+SALE_PAID_STATUSES = ('PAID',)
+PURCHASE_PAID_STATUSES = ('RECEIVED',)
+
+
+def due_state(status_field, paid_statuses=SALE_PAID_STATUSES, today=None):
+    """SQL expression classifying an invoice as paid, overdue or pending"""
+    today = today or timezone.localdate()
+    return Case(
+        When(**{f'{status_field}__in': paid_statuses}, then=Value(PAID)),
+        When(due_date__lt=today, then=Value(OVERDUE)),
+        default=Value(PENDING),
+    )
+
+
+def sum_when(condition, value, output_field=MONEY):
+    """Sum(Case(When(condition, then=value), default=0)) for single-pass KPIs"""
+    zero = Value(0, output_field=output_field)
+    return Coalesce(Sum(Case(When(condition, then=value), default=zero, output_field=output_field)), zero)
+
+
+def count_when(condition):
+    return sum_when(condition, Value(1), IntegerField())
+
+
+def sales_kpis(today):
+    """Revenue, cost and units for today, the month and the year, read from the rollups"""
+    periods = {
+        'today': Q(day=today),
+        'month': Q(day__gte=today.replace(day=1)),
+        'year': Q(day__gte=today.replace(month=1, day=1)),
+    }
+    aggregates = {}
+    for name, condition in periods.items():
+        aggregates[f'{name}_revenue'] = sum_when(condition, F('revenue'))
+        aggregates[f'{name}_cost'] = sum_when(condition, F('cost'))
+        aggregates[f'{name}_units'] = sum_when(condition, F('units'), IntegerField())
+    totals = DailyCategorySales.objects.filter(periods['year']).aggregate(**aggregates)
+    return {
+        name: {
+            'revenue': totals[f'{name}_revenue'],
+            'margin': totals[f'{name}_revenue'] - totals[f'{name}_cost'],
+            'units': totals[f'{name}_units'],
+        }
+        for name in periods
+    }
+
+
+def stock_kpis():
+    return Product.objects.filter(active=True).aggregate(
+        cost_value=sum_when(Q(stock__gt=0), F('stock') * F('purchase_price')),
+        retail_value=sum_when(Q(stock__gt=0), F('stock') * F('sale_price')),
+        below_minimum=count_when(BELOW_MINIMUM_STOCK),
+        out_of_stock=count_when(Q(stock__lte=0)),
+        products=Count('pk'),
+    )
+
+
+def invoice_kpis(queryset, status_field, paid_statuses, today):
+    """Counts and amounts per due state, in one aggregate query"""
+    states = queryset.exclude(**{status_field: 'CANCELLED'}).annotate(
+        state=due_state(status_field, paid_statuses, today)
+    )
+    aggregates = {}
+    for state in (PAID, OVERDUE, PENDING):
+        aggregates[f'{state}_count'] = count_when(Q(state=state))
+        aggregates[f'{state}_amount'] = sum_when(Q(state=state), Coalesce('total_amount', Value(Decimal('0'))))
+    totals = states.aggregate(**aggregates)
+    return {
+        state: {'count': totals[f'{state}_count'], 'amount': totals[f'{state}_amount']}
+        for state in (PAID, OVERDUE, PENDING)
+    }
+
+
+def compute_kpis(today=None):
+    today = today or timezone.localdate()
+    return {
+        'today': today,
+        'sales': sales_kpis(today),
+        'open_sales': Sale.objects.filter(status__code='PENDING').count(),
+        'stock': stock_kpis(),
+        'receivables': invoice_kpis(SaleInvoice.objects.all(), 'sale__status__code', SALE_PAID_STATUSES, today),
+        'payables': invoice_kpis(
+            PurchaseInvoice.objects.all(), 'purchase__status__code', PURCHASE_PAID_STATUSES, today
+        ),
+        'top_sellers': top_sellers(today - timedelta(days=29), today, limit=10),
+    }
+
+
+def dashboard_kpis():
+    """compute_kpis() cached for ADMIN_DASHBOARD_CACHE_TIMEOUT seconds"""
+    return cache.get_or_set(CACHE_KEY, compute_kpis, settings.ADMIN_DASHBOARD_CACHE_TIMEOUT)
+
+
+class AdminDashboardView(TemplateView):
+    template_name = 'admin/stationery/dashboard.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(admin.site.each_context(self.request))
+        context['title'] = "Indicadores"
+        context['kpis'] = dashboard_kpis()
+        return context
@@ -0,0 +1,483 @@
+import math
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import caching, rollups, search
+from .discounts import discount_engine
+from .lookups import movement_types, transaction_statuses
+from .models import (
+    Brand, Category, Company, Customer, Discount, DiscountType, MovementType, PaymentMethod,
+    Product, Purchase, PurchaseDetail, Sale, SaleDetail, ScopeType, StockMovement, Supplier,
+    TransactionStatus
+)
+from .schemas import validation_error
+from .utils.enums import MovementReasonEnum, MovementTypeEnum, ScopeTypeEnum
+
+
+CENTS = Decimal('0.01')
+SCHEMA = "https://json-schema.org/draft/2020-12/schema"
+# Categories created when missing, each with a product_schema to fill.
+CATEGORY_SCHEMAS = {
+    'Cuadernos': {
+        'properties': {
+            'hojas': {'type': 'integer', 'minimum': 50, 'maximum': 200},
+            'rayado': {'type': 'string', 'enum': ['liso', 'rayado', 'cuadriculado']},
+            'tapa_dura': {'type': 'boolean'},
+        },
+        'required': ['hojas', 'rayado'],
+    },
+    'Escritura': {
+        'properties': {
+            'color': {'type': 'string', 'enum': ['azul', 'negro', 'rojo', 'verde']},
+            'punta_mm': {'type': 'number', 'minimum': 0.3, 'maximum': 1.6},
+            'recargable': {'type': 'boolean'},
+        },
+        'required': ['color'],
+    },
+    'Papel': {
+        'properties': {
+            'gramaje': {'type': 'integer', 'minimum': 60, 'maximum': 300},
+            'formato': {'type': 'string', 'enum': ['A4', 'A3', 'Carta', 'Oficio']},
+            'hojas': {'type': 'integer', 'minimum': 100, 'maximum': 500},
+        },
+        'required': ['gramaje', 'formato'],
+    },
+    'Arte': {
+        'properties': {
+            'tecnica': {'type': 'string', 'enum': ['acuarela', 'óleo', 'acrílico', 'pastel']},
+            'piezas': {'type': 'integer', 'minimum': 1, 'maximum': 48},
+        },
+        'required': ['tecnica'],
+    },
+    'Oficina': {
+        'properties': {
+            'material': {'type': 'string', 'enum': ['plástico', 'metal', 'cartón']},
+            'color': {'type': 'string', 'maxLength': 20},
+        },
+        'required': ['material'],
+    },
+}
+NOUNS = {
+    'Cuadernos': ('Cuaderno', 'Libreta', 'Block'),
+    'Escritura': ('Bolígrafo', 'Lápiz', 'Marcador', 'Resaltador'),
+    'Papel': ('Resma', 'Papel bond', 'Cartulina'),
+    'Arte': ('Set de pinturas', 'Pinceles', 'Lienzo'),
+    'Oficina': ('Carpeta', 'Engrapadora', 'Archivador', 'Clips'),
+}
+GENERIC_NOUNS = ('Artículo', 'Set', 'Paquete')
+WORDS = ('azul', 'negro', 'rojo', 'verde', 'escolar', 'profesional', 'premium', 'reciclado', 'compacto', 'clásico')
+QUANTITIES = (1, 2, 3, 4, 5, 10)
+QUANTITY_WEIGHTS = (50, 20, 10, 8, 7, 5)
+MEAN_QUANTITY = sum(q * w for q, w in zip(QUANTITIES, QUANTITY_WEIGHTS)) / sum(QUANTITY_WEIGHTS)
+# Share of generated sales left pending or cancelled; the rest are paid.
+PENDING_SHARE = 0.05
+CANCELLED_SHARE = 0.02
+PURCHASE_LINES = 40
+# Column order of the tuples flush() inserts directly.
+SALE_LINE_FIELDS = (
+    'sale', 'product', 'quantity', 'unit_price', 'discount_name', 'discount_type', 'discount_value',
+    'unit_cost', 'sale_attributes',
+)
+PURCHASE_LINE_FIELDS = ('purchase', 'product', 'quantity', 'unit_price', 'purchase_attributes')
+MOVEMENT_FIELDS = ('product', 'quantity', 'movement_type', 'reason', 'date', 'purchase', 'sale')
+
+
+def insert_rows(model, fields, rows):
+    """Inserts tuples of database-ready values with one executemany"""
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+@contextmanager
+def historical_dates(*fields):
+    """Lets bulk_create keep explicit values for auto_now_add fields.
+
+    Flips the flag on the field objects, so it is only meant for the
+    single-threaded generator command.
+    """
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
+
+
+def ensure_lookups():
+    for movement_type in MovementTypeEnum:
+        MovementType.objects.get_or_create(code=movement_type.value, defaults={'label': movement_type.label})
+    for code, label in (('PENDING', 'Pendiente'), ('PAID', 'Pagado'), ('CANCELLED', 'Anulado'), ('RECEIVED', 'Recibido')):
+        TransactionStatus.objects.get_or_create(code=code, defaults={'label': label})
+    for code, name in (('CA', 'Efectivo'), ('TA', 'Tarjeta')):
+        PaymentMethod.objects.get_or_create(code=code, defaults={'name': name})
+    for code in ('PERCENTAGE', 'FIXED_AMOUNT'):
+        DiscountType.objects.get_or_create(code=code, defaults={'label': code.replace('_', ' ').title()})
+    for scope in ScopeTypeEnum:
+        ScopeType.objects.get_or_create(code=scope.name, defaults={'label': scope.label})
+
+
+def attribute_value(rng, prop):
+    if 'enum' in prop:
+        return rng.choice(prop['enum'])
+    kind = prop.get('type')
+    if kind == 'integer':
+        return rng.randint(prop.get('minimum', 1), prop.get('maximum', 100))
+    if kind == 'number':
+        return round(rng.uniform(prop.get('minimum', 0), prop.get('maximum', 100)), 2)
+    if kind == 'boolean':
+        return rng.random() < 0.5
+    if kind == 'string':
+        return rng.choice(WORDS)[:prop.get('maxLength', 50)]
+    return None
+
+
+def generate_attributes(rng, schema):
+    """Attributes for `schema`: every required property and about half of the rest"""
+    required = set(schema.get('required', []))
+    attributes = {}
+    for key, prop in schema.get('properties', {}).items():
+        if key in required or rng.random() < 0.5:
+            value = attribute_value(rng, prop)
+            if value is not None:
+                attributes[key] = value
+    return attributes
+
+
+def zipf_cumulative(count, exponent, rng):
+    """Cumulative Zipf weights over `count` items in a random popularity order"""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(accumulate(1 / rank ** exponent for rank in ranks))
+
+
+class FixtureGenerator:
+    """Builds a consistent sales history with bulk inserts only.
+
+    Products get Zipf-distributed popularity. Days are simulated in order:
+    purchases restock whatever fell below its minimum, then the day's sales
+    take stock. Cancelled sales give their stock back like Sale.cancel_many.
+    Every stock change is a StockMovement row, so at the end each product's
+    stock equals the signed sum of its movements. Rows go in one transaction
+    per `chunk_size` sales, and save() and the signal receivers never run;
+    rollups, the search index and the storefront caches are updated here
+    instead.
+    """
+
+    def __init__(self, seed=0, chunk_size=2000, days=365, exponent=1.1, mean_lines=4, log=None):
+        self.rng = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.days = days
+        self.exponent = exponent
+        self.mean_lines = mean_lines
+        self.log = log or (lambda message: None)
+        self.counts = dict.fromkeys(('products', 'sales', 'sale_lines', 'purchases', 'purchase_lines', 'movements'), 0)
+
+    def run(self, products, sales, customers=2000, discounts=30):
+        ensure_lookups()
+        start = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=self.days)
+        self.statuses = {code: transaction_statuses.get(code) for code in ('PENDING', 'PAID', 'CANCELLED', 'RECEIVED')}
+        self.movement_types = {code: movement_types.get(code) for code in (MovementTypeEnum.IN, MovementTypeEnum.OUT)}
+        self.suppliers = self.create_suppliers()
+        self.customer_ids = self.create_customers(customers)
+        self.products = self.create_products(products, sales, start)
+        self.create_discounts(discounts)
+        self.simulate(sales, start)
+        self.finish()
+        return self.counts
+
+    def create_suppliers(self):
+        company = Company.objects.get_or_create(name='Distribuidora Nacional')[0]
+        return [
+            Supplier.objects.get_or_create(name=f'Mayorista {i}', defaults={'company': company})[0]
+            for i in range(10)
+        ]
+
+    def create_customers(self, count):
+        offset = Customer.objects.count()
+        rows = [
+            Customer(name=f'Cliente {i}', email=f'cliente{i}@example.com')
+            for i in range(offset, offset + count)
+        ]
+        for start in range(0, len(rows), self.chunk_size):
+            Customer.objects.bulk_create(rows[start:start + self.chunk_size])
+        return [customer.pk for customer in rows] or list(Customer.objects.values_list('pk', flat=True))
+
+    def categories(self):
+        """Categories whose product_schema the generated attributes satisfy"""
+        for name, schema in CATEGORY_SCHEMAS.items():
+            Category.objects.get_or_create(
+                name=name, defaults={'product_schema': {'$schema': SCHEMA, 'type': 'object', **schema}}
+            )
+        usable = []
+        for category in Category.objects.all():
+            sample = generate_attributes(self.rng, category.product_schema or {})
+            if validation_error(category, sample) is None:
+                usable.append(category)
+            else:
+                self.log(f"Categoría omitida, su esquema no se puede generar: {category.name}")
+        return usable
+
+    def create_products(self, count, sales, start):
+        rng = self.rng
+        categories = self.categories()
+        brands = [Brand.objects.get_or_create(name=f'Marca {i}')[0] for i in range(30)]
+        self.popularity = zipf_cumulative(count, self.exponent, rng)
+        total_weight = self.popularity[-1] if count else 1
+        units_per_day = sales / self.days * self.mean_lines * MEAN_QUANTITY
+
+        offset = Product.objects.count()
+        products, previous = [], 0.0
+        for i, cumulative in enumerate(self.popularity):
+            category = rng.choice(categories)
+            purchase_price = (Decimal(rng.randint(30, 8000)) / 100).quantize(CENTS)
+            demand = (cumulative - previous) / total_weight * units_per_day
+            previous = cumulative
+            product = Product(
+                name=f'{rng.choice(NOUNS.get(category.name, GENERIC_NOUNS))} {rng.choice(WORDS)} {offset + i}',
+                sku=f'FX-{offset + i:08d}',
+                purchase_price=purchase_price,
+                sale_price=(purchase_price * Decimal(rng.choice(('1.3', '1.5', '1.8')))).quantize(CENTS),
+                minimum_stock=max(5, math.ceil(demand * 3)),
+                stock=0,
+                category=category,
+                brand=rng.choice(brands),
+                creation_date=start,
+                attributes=generate_attributes(rng, category.product_schema or {}),
+            )
+            error = validation_error(category, product.attributes)
+            if error is not None:
+                raise ValueError(f"Atributos inválidos para {category.name}: {error.message}")
+            # Restock target: about two weeks of expected demand.
+            product.reorder_to = product.minimum_stock + max(10, math.ceil(demand * 14))
+            products.append(product)
+
+        with historical_dates(Product._meta.get_field('creation_date')):
+            for chunk in range(0, len(products), self.chunk_size):
+                with transaction.atomic():
+                    Product.objects.bulk_create(products[chunk:chunk + self.chunk_size])
+        Supplied = Product.suppliers.through
+        links = [Supplied(product_id=product.pk, supplier_id=rng.choice(self.suppliers).pk) for product in products]
+        for chunk in range(0, len(links), self.chunk_size):
+            Supplied.objects.bulk_create(links[chunk:chunk + self.chunk_size])
+        for product, link in zip(products, links):
+            product.supplier_id = link.supplier_id
+        self.counts['products'] = len(products)
+        self.log(f"{len(products)} productos creados")
+        return products
+
+    def create_discounts(self, count):
+        rng = self.rng
+        types = list(DiscountType.objects.all())
+        scopes = {scope.code: scope for scope in ScopeType.objects.all()}
+        categories = list(Category.objects.all())
+        scope_plan = ['SELECTED_PRODUCTS'] * 6 + ['SELECTED_CATEGORIES'] * 3 + ['ALL_PRODUCTS']
+        ProductLink, CategoryLink = Discount.products.through, Discount.categories.through
+        product_links, category_links = [], []
+        for i in range(count):
+            discount_type = rng.choice(types)
+            percentage = discount_type.code == 'PERCENTAGE'
+            scope = scopes[scope_plan[i % len(scope_plan)]]
+            # Store-wide promotions are over and few category ones run, or every line would carry one.
+            active = scope.code == 'SELECTED_PRODUCTS' or (scope.code == 'SELECTED_CATEGORIES' and rng.random() < 0.3)
+            discount = Discount.objects.create(
+                name=f'Promoción {Discount.objects.count() + 1}',
+                type=discount_type,
+                value=rng.choice((5, 10, 15, 20)) if percentage else rng.choice((1, 2, 5)),
+                scope=scope,
+                active=active,
+            )
+            if discount.scope.code == 'SELECTED_PRODUCTS' and self.products:
+                for product in rng.sample(self.products, min(len(self.products), rng.randint(5, 200))):
+                    product_links.append(ProductLink(discount_id=discount.pk, product_id=product.pk))
+            elif discount.scope.code == 'SELECTED_CATEGORIES':
+                for category in rng.sample(categories, min(len(categories), 1)):
+                    category_links.append(CategoryLink(discount_id=discount.pk, category_id=category.pk))
+        ProductLink.objects.bulk_create(product_links, batch_size=self.chunk_size)
+        CategoryLink.objects.bulk_create(category_links, batch_size=self.chunk_size)
+        discount_engine.invalidate()
+        self.best_discount = {}
+
+    def pick_products(self, lines):
+        rng, products = self.rng, self.products
+        picked = rng.choices(range(len(products)), cum_weights=self.popularity, k=lines)
+        return [products[index] for index in dict.fromkeys(picked)]
+
+    def simulate(self, sales, start):
+        rng = self.rng
+        self.pending = {'sales': [], 'purchases': []}
+        self.prepared_attributes = {}
+        self.below_minimum = set(range(len(self.products)))
+        self.index = {product.pk: index for index, product in enumerate(self.products)}
+        sales_per_day = sales / self.days if self.days else sales
+        made = 0
+        for day in range(self.days + 1):
+            opening = start + timedelta(days=day)
+            self.restock(opening)
+            target = sales if day == self.days else round(sales_per_day * (day + 1))
+            todays = target - made
+            for moment in sorted(rng.uniform(0, 12 * 3600) for _ in range(todays)):
+                self.sell(opening + timedelta(hours=1, seconds=moment))
+            made = target
+            if len(self.pending['sales']) >= self.chunk_size:
+                self.flush()
+        self.flush()
+
+    def restock(self, when):
+        """One RECEIVED purchase per supplier and PURCHASE_LINES products below minimum"""
+        if not self.below_minimum:
+            return
+        by_supplier = {}
+        for index in sorted(self.below_minimum):
+            product = self.products[index]
+            by_supplier.setdefault(product.supplier_id, []).append(product)
+        self.below_minimum = set()
+        for supplier_id, products in by_supplier.items():
+            for chunk in range(0, len(products), PURCHASE_LINES):
+                lines = []
+                for product in products[chunk:chunk + PURCHASE_LINES]:
+                    quantity = product.reorder_to - product.stock
+                    product.stock += quantity
+                    lines.append(PurchaseDetail(
+                        product=product, quantity=quantity, unit_price=product.purchase_price,
+                        purchase_attributes=product.attributes,
+                    ))
+                purchase = Purchase(
+                    date=when, supplier_id=supplier_id, status=self.statuses['RECEIVED'], payment_method_id='CA',
+                    total=sum(line.unit_price * line.quantity for line in lines),
+                )
+                self.pending['purchases'].append((purchase, lines))
+
+    def discount_for(self, product):
+        if product.pk not in self.best_discount:
+            self.best_discount[product.pk] = discount_engine.best_for(product)
+        return self.best_discount[product.pk]
+
+    def sell(self, when):
+        rng = self.rng
+        lines_wanted = min(20, 1 + round(rng.expovariate(1 / max(self.mean_lines - 1, 0.1))))
+        lines = []
+        for product in self.pick_products(lines_wanted):
+            quantity = min(rng.choices(QUANTITIES, weights=QUANTITY_WEIGHTS)[0], product.stock)
+            if quantity <= 0:
+                continue
+            product.stock -= quantity
+            if product.stock < product.minimum_stock:
+                self.below_minimum.add(self.index[product.pk])
+            line = SaleDetail(
+                product=product, quantity=quantity, unit_price=product.sale_price,
+                unit_cost=product.purchase_price, sale_attributes=product.attributes,
+            )
+            discount = self.discount_for(product)
+            if discount is not None:
+                discount_engine.apply(line, discount)
+            lines.append(line)
+        if not lines:
+            return
+
+        roll = rng.random()
+        status = 'CANCELLED' if roll < CANCELLED_SHARE else 'PENDING' if roll < CANCELLED_SHARE + PENDING_SHARE else 'PAID'
+        if status == 'CANCELLED':
+            for line in lines:
+                line.product.stock += line.quantity
+        amounts = [line.line_amounts() for line in lines]
+        sale = Sale(
+            date=when, status=self.statuses[status], customer_id=rng.choice(self.customer_ids),
+            payment_method_id=rng.choice(('CA', 'CA', 'TA')),
+            subtotal=sum(amount[0] for amount in amounts), total=sum(amount[1] for amount in amounts),
+        )
+        self.pending['sales'].append((sale, lines, amounts))
+
+    def db_value(self, model, field, value):
+        return model._meta.get_field(field).get_db_prep_save(value, connection)
+
+    def db_attributes(self, model, product):
+        """JSON attributes in database form, prepared once per product"""
+        key = (model, product.pk)
+        if key not in self.prepared_attributes:
+            field = 'sale_attributes' if model is SaleDetail else 'purchase_attributes'
+            self.prepared_attributes[key] = self.db_value(model, field, product.attributes)
+        return self.prepared_attributes[key]
+
+    def flush(self):
+        """Writes the pending documents, their lines, movements and rollups in one transaction.
+
+        Sales and purchases go through bulk_create for their ids; the far more
+        numerous lines and movements are inserted as plain tuples.
+        """
+        sales, purchases = self.pending['sales'], self.pending['purchases']
+        if not sales and not purchases:
+            return
+        purchase_rows, sale_rows, movement_rows, deltas = [], [], [], []
+        in_id, out_id = self.movement_types[MovementTypeEnum.IN].pk, self.movement_types[MovementTypeEnum.OUT].pk
+        cancelled = self.statuses['CANCELLED']
+
+        with transaction.atomic(), historical_dates(Sale._meta.get_field('date'), Purchase._meta.get_field('date')):
+            Purchase.objects.bulk_create([purchase for purchase, _ in purchases])
+            for purchase, lines in purchases:
+                date = self.db_value(StockMovement, 'date', purchase.date)
+                for line in lines:
+                    purchase_rows.append((
+                        purchase.pk, line.product_id, line.quantity, line.unit_price,
+                        self.db_attributes(PurchaseDetail, line.product),
+                    ))
+                    movement_rows.append((
+                        line.product_id, line.quantity, in_id, MovementReasonEnum.PURCHASE.value, date, purchase.pk, None,
+                    ))
+
+            Sale.objects.bulk_create([sale for sale, _, _ in sales])
+            for sale, lines, amounts in sales:
+                day = rollups.sale_day(sale.date)
+                date = self.db_value(StockMovement, 'date', sale.date)
+                returned = self.db_value(StockMovement, 'date', sale.date + timedelta(minutes=30))
+                for line, amount in zip(lines, amounts):
+                    sale_rows.append((
+                        sale.pk, line.product_id, line.quantity, line.unit_price, line.discount_name,
+                        line.discount_type, line.discount_value, line.unit_cost,
+                        self.db_attributes(SaleDetail, line.product),
+                    ))
+                    movement_rows.append((
+                        line.product_id, line.quantity, out_id, MovementReasonEnum.SALE.value, date, None, sale.pk,
+                    ))
+                    if sale.status_id == cancelled.pk:
+                        movement_rows.append((
+                            line.product_id, line.quantity, in_id, MovementReasonEnum.CANCELLATION.value,
+                            returned, None, sale.pk,
+                        ))
+                    else:
+                        deltas.append(rollups.line_delta(line, day, amounts=amount))
+
+            insert_rows(PurchaseDetail, PURCHASE_LINE_FIELDS, purchase_rows)
+            insert_rows(SaleDetail, SALE_LINE_FIELDS, sale_rows)
+            insert_rows(StockMovement, MOVEMENT_FIELDS, movement_rows)
+            rollups.apply_deltas(deltas)
+
+        self.counts['sales'] += len(sales)
+        self.counts['sale_lines'] += len(sale_rows)
+        self.counts['purchases'] += len(purchases)
+        self.counts['purchase_lines'] += len(purchase_rows)
+        self.counts['movements'] += len(movement_rows)
+        self.pending = {'sales': [], 'purchases': []}
+        self.log(f"{self.counts['sales']} ventas, {self.counts['movements']} movimientos")
+
+    def finish(self):
+        """Stores the simulated stock and refreshes what save() would have updated"""
+        for chunk in range(0, len(self.products), self.chunk_size):
+            with transaction.atomic():
+                Product.objects.bulk_update(self.products[chunk:chunk + self.chunk_size], ['stock'], batch_size=1000)
+        search.reindex([product.pk for product in self.products])
+        discount_engine.invalidate()
+        caching.bump_version(caching.CATALOG)
+        caching.bump_version(caching.PRICING)
@@ -0,0 +1,220 @@
+import threading
+from collections import defaultdict, namedtuple
+from django.apps import apps
+
+from . import caching
+from .utils.enums import ScopeTypeEnum
+
+
+CompiledDiscount = namedtuple('CompiledDiscount', ['discount', 'scope', 'product_ids', 'category_ids'])
+DiscountIndex = namedtuple('DiscountIndex', ['version', 'compiled', 'by_product', 'by_category', 'global_'])
+
+GLOBAL_SCOPES = (ScopeTypeEnum.ALL_PRODUCTS, ScopeTypeEnum.ALL_CATEGORIES)
+# Seconds a recorded change stays readable; engines further behind rebuild.
+CHANGE_TIMEOUT = 24 * 60 * 60
+# Versions an engine may catch up on by patching before it rebuilds instead.
+MAX_PATCHED_VERSIONS = 50
+
+
+def _change_key(version):
+    return f'storefront:pricing-change:{version}'
+
+
+def record_pricing_change(discount_ids=None):
+    """Bumps PRICING and records which discounts changed in that version.
+
+    Engines catching up on recorded versions refetch only those discounts;
+    None, like a bump made without recording, makes them rebuild everything.
+    """
+    version = caching.bump_version(caching.PRICING)
+    cache = caching.version_cache()
+    change = None if discount_ids is None else sorted(discount_ids)
+    # Two bumps racing to the same version would hide one another's change.
+    if not cache.add(_change_key(version), change, CHANGE_TIMEOUT):
+        cache.set(_change_key(version), None, CHANGE_TIMEOUT)
+    # Engines this far behind rebuild rather than read it, so the record
+    # would only sit on disk until it expired.
+    cache.delete(_change_key(version - MAX_PATCHED_VERSIONS))
+
+
+class DiscountEngine:
+    """In-memory index of the active discounts used to price sale lines.
+
+    Active Discount rows are compiled into product, category and global
+    indexes, so resolving the best discount for a cart costs no queries.
+    The index is stamped with the shared PRICING cache version, which the
+    receivers in signals.py bump whenever a discount changes; every process
+    catches up the next time it sees a different version, refetching only
+    the discounts recorded for the versions it missed.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.RLock()
+
+    def _fetch(self, ids=None):
+        Discount = apps.get_model('stationery', 'Discount')
+        discounts = Discount.objects.filter(active=True, type__active=True, scope__active=True)
+        if ids is not None:
+            discounts = discounts.filter(pk__in=ids)
+        discounts = list(discounts.select_related('type', 'scope'))
+        ids = [discount.pk for discount in discounts]
+
+        product_ids = defaultdict(set)
+        for discount_id, product_id in Discount.products.through.objects.filter(
+            discount_id__in=ids
+        ).values_list('discount_id', 'product_id'):
+            product_ids[discount_id].add(product_id)
+
+        category_ids = defaultdict(set)
+        for discount_id, category_id in Discount.categories.through.objects.filter(
+            discount_id__in=ids
+        ).values_list('discount_id', 'category_id'):
+            category_ids[discount_id].add(category_id)
+
+        return [
+            CompiledDiscount(
+                discount     = discount,
+                scope        = discount.scope_enum,
+                product_ids  = frozenset(product_ids[discount.pk]),
+                category_ids = frozenset(category_ids[discount.pk]),
+            )
+            for discount in discounts
+        ]
+
+    def _build(self, version):
+        return self._patch(DiscountIndex(version, {}, {}, {}, ()), version, (), self._fetch())
+
+    @staticmethod
+    def _slots(compiled):
+        """(index field, key) pairs under which a compiled discount is filed"""
+        if compiled.scope in GLOBAL_SCOPES:
+            return [('global_', None)]
+        if compiled.scope == ScopeTypeEnum.SELECTED_CATEGORIES:
+            return [('by_category', category_id) for category_id in compiled.category_ids]
+        return [('by_product', product_id) for product_id in compiled.product_ids]
+
+    def _patch(self, index, version, removed_ids, added):
+        """A copy of `index` without `removed_ids` and with `added` filed in.
+
+        Only the lists those discounts are filed under are copied, and the
+        old index is left untouched for threads still reading it.
+        """
+        compiled = dict(index.compiled)
+        tables = {
+            'by_product': dict(index.by_product),
+            'by_category': dict(index.by_category),
+            'global_': {None: index.global_} if index.global_ else {},
+        }
+        stale = [compiled.pop(discount_id) for discount_id in removed_ids if discount_id in compiled]
+        stale_ids = {entry.discount.pk for entry in stale}
+        for field, key in {slot for entry in stale for slot in self._slots(entry)}:
+            kept = [other for other in tables[field][key] if other.discount.pk not in stale_ids]
+            if kept:
+                tables[field][key] = kept
+            else:
+                del tables[field][key]
+
+        copied = set()
+        for entry in added:
+            compiled[entry.discount.pk] = entry
+            for slot in self._slots(entry):
+                field, key = slot
+                if slot not in copied:
+                    tables[field][key] = list(tables[field].get(key, ()))
+                    copied.add(slot)
+                tables[field][key].append(entry)
+        return DiscountIndex(
+            version, compiled, tables['by_product'], tables['by_category'], tuple(tables['global_'].get(None, ()))
+        )
+
+    def _changed_since(self, index, version):
+        """Ids of the discounts changed after `index`, or None when unknown"""
+        if not 0 < version - index.version <= MAX_PATCHED_VERSIONS:
+            return None
+        keys = [_change_key(missed) for missed in range(index.version + 1, version + 1)]
+        changes = caching.version_cache().get_many(keys)
+        if len(changes) != len(keys) or any(ids is None for ids in changes.values()):
+            return None
+        return {discount_id for ids in changes.values() for discount_id in ids}
+
+    def _current(self):
+        """The index for the current PRICING version, caught up when it moved.
+
+        The version is read before the discounts, so a change committed in
+        between only costs one more refetch on the next call.
+        """
+        version = caching.get_version(caching.PRICING)
+        index = self._index
+        if index is None or index.version != version:
+            with self._lock:
+                index = self._index
+                if index is None or index.version != version:
+                    changed = None if index is None else self._changed_since(index, version)
+                    if changed is None:
+                        index = self._build(version)
+                    else:
+                        index = self._patch(index, version, changed, self._fetch(changed))
+                    self._index = index
+        return index
+
+    def invalidate(self):
+        """Drops this process' index; other processes follow the PRICING version."""
+        with self._lock:
+            self._index = None
+
+    def _candidates(self, index, product):
+        found = list(index.by_product.get(product.pk, ()))
+        found += index.by_category.get(product.category_id, ())
+        for compiled in index.global_:
+            if compiled.scope == ScopeTypeEnum.ALL_CATEGORIES and not product.category_id:
+                continue
+            found.append(compiled)
+        return [compiled.discount for compiled in found]
+
+    def _best(self, index, product, price=None):
+        price = product.sale_price if price is None else price
+        best, best_amount = None, 0
+        for discount in self._candidates(index, product):
+            amount = discount.calculate_discount(price)
+            if amount > best_amount:
+                best, best_amount = discount, amount
+        return best
+
+    def candidates(self, product):
+        return self._candidates(self._current(), product)
+
+    def best_for(self, product, price=None):
+        """Returns the discount that takes the most off `price`, or None."""
+        return self._best(self._current(), product, price)
+
+    def resolve(self, products):
+        """Maps product id to its best discount (or None) for a batch of products."""
+        index = self._current()
+        return {product.pk: self._best(index, product) for product in products}
+
+    def apply(self, detail, discount=None):
+        """Fills the discount snapshot of a SaleDetail that has none yet."""
+        if detail.discount_name is not None:
+            return detail
+        if discount is None:
+            discount = self.best_for(detail.product, detail.unit_price)
+        return self._snapshot(detail, discount)
+
+    def apply_many(self, details):
+        """apply() for a whole cart, checking the PRICING version once."""
+        index = self._current()
+        for detail in details:
+            if detail.discount_name is None:
+                self._snapshot(detail, self._best(index, detail.product, detail.unit_price))
+        return details
+
+    def _snapshot(self, detail, discount):
+        if discount is not None:
+            detail.discount_name = discount.name
+            detail.discount_type = discount.type_enum
+            detail.discount_value = discount.value
+        return detail
+
+
+discount_engine = DiscountEngine()
@@ -0,0 +1,82 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import journal
+from .models import SaleDetail, PurchaseDetail, StockMovement
+
+
+EXPORTS = {
+    'sales': (SaleDetail, 'sale', (
+        'sale_id', 'sale__date', 'sale__customer__name', 'sale__payment_method_id',
+        'sale__status__code', 'sale__subtotal', 'sale__total', 'product_id', 'product__name',
+        'quantity', 'unit_price', 'discount_name', 'discount_type', 'discount_value',
+    )),
+    'purchases': (PurchaseDetail, 'purchase', (
+        'purchase_id', 'purchase__date', 'purchase__invoice_number', 'purchase__supplier__name',
+        'purchase__status__code', 'purchase__payment_method_id', 'product_id', 'product__name',
+        'quantity', 'unit_price',
+    )),
+    'stock_movements': (StockMovement, None, (
+        'id', 'date', 'product_id', 'product__name', 'movement_type__code', 'quantity',
+        'reason', 'sale_id', 'purchase_id', 'created_by__username',
+    )),
+}
+
+FORMATS = ('csv', 'jsonl')
+
+
+class Echo:
+    """File-like object whose write() hands back the value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(dataset, parents=None, since=None, until=None, chunk_size=2000):
+    """Yields value tuples for `dataset` without building model instances.
+
+    `parents` restricts sales/purchases exports to a Sale/Purchase queryset.
+    Stock movements still waiting in the write-behind journal are flushed
+    first so the export matches the ledger.
+    """
+    model, parent_field, columns = EXPORTS[dataset]
+    if model is StockMovement and journal.write_behind_enabled():
+        journal.flush()
+    rows = model.objects.all()
+    date_field = f'{parent_field}__date' if parent_field else 'date'
+    if parents is not None:
+        rows = rows.filter(**{f'{parent_field}__in' if parent_field else 'pk__in': parents.order_by().values('pk')})
+    if since:
+        rows = rows.filter(**{f'{date_field}__gte': since})
+    if until:
+        rows = rows.filter(**{f'{date_field}__lt': until})
+    return rows.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size)
+
+
+def iter_csv(dataset, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORTS[dataset][2])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(dataset, rows):
+    columns = EXPORTS[dataset][2]
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def iter_export(dataset, fmt, **kwargs):
+    rows = iter_rows(dataset, **kwargs)
+    return iter_csv(dataset, rows) if fmt == 'csv' else iter_jsonl(dataset, rows)
+
+
+def streaming_export(dataset, fmt='csv', **kwargs):
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(iter_export(dataset, fmt, **kwargs), content_type=content_type)
+    filename = f"{dataset}_{timezone.now():%Y%m%d_%H%M%S}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,105 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Case, When, F, IntegerField, Max, Min, Q, Sum, Value
+from django.utils import timezone
+
+from .lookups import movement_types
+from .models import Product, StockMovement, StockMovementJournal, StockSnapshot
+from .utils.enums import MovementTypeEnum
+
+
+def signed_quantity():
+    """StockMovement quantity with the sign of its movement type.
+
+    Adjustments are not signed in the ledger, so only IN and OUT count.
+    """
+    return Case(
+        When(movement_type_id=movement_types.get(MovementTypeEnum.IN).pk, then=F('quantity')),
+        When(movement_type_id=movement_types.get(MovementTypeEnum.OUT).pk, then=-F('quantity')),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def ledger_deltas(**filters):
+    """{product_id: signed quantity} over StockMovement plus unflushed journal entries"""
+    deltas = {}
+    for model in (StockMovement, StockMovementJournal):
+        rows = (
+            model.objects.filter(**filters)
+            .values_list('product_id')
+            .annotate(delta=Sum(signed_quantity()))
+            .order_by()
+        )
+        for product_id, delta in rows:
+            deltas[product_id] = deltas.get(product_id, 0) + (delta or 0)
+    return deltas
+
+
+def take_snapshot(chunk_size=5000):
+    """Stores the current stock of every product; returns the number of rows inserted.
+
+    Writers change stock before dating their movement, so with them held off
+    `taken_at` is stamped after every movement the stock read includes and
+    before any it misses.
+    """
+    with transaction.atomic():
+        # SQLite took its write lock at BEGIN IMMEDIATE (see DATABASES).
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {Product._meta.db_table} IN SHARE MODE')
+        taken_at = timezone.now()
+        snapshots = StockSnapshot.objects.filter(taken_at=taken_at)
+        # bulk_create() can't tell skipped conflicts apart; count what landed.
+        existing = snapshots.count()
+        batch = []
+        for product_id, stock in Product.objects.values_list('pk', 'stock').iterator(chunk_size=chunk_size):
+            batch.append(StockSnapshot(product_id=product_id, stock=stock, taken_at=taken_at))
+            if len(batch) >= chunk_size:
+                StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        if batch:
+            StockSnapshot.objects.bulk_create(batch, ignore_conflicts=True)
+        return snapshots.count() - existing
+
+
+def stock_as_of(product_ids, timestamp):
+    """Returns {product_id: stock} at `timestamp`.
+
+    Each product starts from the snapshot nearest to `timestamp`, earlier or
+    later, with the current stock counting as a snapshot taken now. Movements
+    in between are added walking forward or subtracted walking back; products
+    sharing a snapshot time are walked together with literal date bounds.
+    """
+    product_ids = list(product_ids)
+    now = timezone.now()
+    snapshots = StockSnapshot.objects.filter(product_id__in=product_ids).values('product_id').order_by()
+    earlier = dict(snapshots.filter(taken_at__lte=timestamp).annotate(at=Max('taken_at')).values_list('product_id', 'at'))
+    later = dict(snapshots.filter(taken_at__gt=timestamp).annotate(at=Min('taken_at')).values_list('product_id', 'at'))
+
+    # Snapshot time each product starts from; None is the current stock.
+    groups = defaultdict(list)
+    for product_id in product_ids:
+        before, after = earlier.get(product_id), later.get(product_id)
+        if before is not None and timestamp - before <= (after or now) - timestamp:
+            groups[before].append(product_id)
+        else:
+            groups[after].append(product_id)
+
+    current = groups.pop(None, [])
+    result = dict(Product.objects.filter(pk__in=current).values_list('pk', 'stock'))
+    if groups:
+        condition = Q()
+        for taken_at, ids in groups.items():
+            condition |= Q(taken_at=taken_at, product_id__in=ids)
+        result.update(StockSnapshot.objects.filter(condition).values_list('product_id', 'stock'))
+
+    for taken_at, ids in [*groups.items(), (None, current)]:
+        if taken_at is not None and taken_at <= timestamp:
+            for product_id, delta in ledger_deltas(product_id__in=ids, date__gt=taken_at, date__lte=timestamp).items():
+                result[product_id] += delta
+        elif ids:
+            window = {'date__gt': timestamp} if taken_at is None else {'date__gt': timestamp, 'date__lte': taken_at}
+            for product_id, delta in ledger_deltas(product_id__in=ids, **window).items():
+                result[product_id] -= delta
+    return result
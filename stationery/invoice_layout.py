@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from .pdf import PDFDocument
+
+# Runs in the render_invoices worker processes: keep Django out of the
+# imports so a worker starts without loading the project.
+
+
+def _money(value):
+    return f"${Decimal(value or 0):,.2f}"
+
+
+def render_invoice(document):
+    """Renders one invoice document to PDF bytes; runs in the worker processes"""
+    pdf = PDFDocument()
+    left, right = 50, pdf.width - 50
+    columns = (left, 330, 400, 470, right)
+
+    def header():
+        y = pdf.height - 60
+        pdf.text(left, y, document['title'], size=16, bold=True)
+        pdf.text(right, y, f"Nº {document['number']}", size=12, bold=True, align='right')
+        y -= 24
+        pdf.text(left, y, f"Emisión: {document['issue_date']:%d/%m/%Y}")
+        pdf.text(right, y, f"Vencimiento: {document['due_date']:%d/%m/%Y}", align='right')
+        y -= 14
+        pdf.text(left, y, document['reference'])
+        y -= 24
+        pdf.text(left, y, document['party_label'], bold=True)
+        for value in document['party']:
+            y -= 14
+            pdf.text(left, y, str(value)[:90])
+        y -= 28
+        for x, title, align in zip(columns, ("Producto", "Cant.", "Precio", "Desc.", "Total"),
+                                   ('left', 'right', 'right', 'left', 'right')):
+            pdf.text(x, y, title, bold=True, align=align)
+        pdf.line(left, y - 4, right, y - 4)
+        return y - 18
+
+    y = header()
+    for name, quantity, unit_price, discount, total in document['lines']:
+        if y < 120:
+            pdf.new_page()
+            y = header()
+        pdf.text(columns[0], y, name[:48])
+        pdf.text(columns[1], y, str(quantity), align='right')
+        pdf.text(columns[2], y, _money(unit_price), align='right')
+        pdf.text(columns[3], y, discount[:14])
+        pdf.text(columns[4], y, _money(total), align='right')
+        y -= 14
+
+    pdf.line(left, y + 4, right, y + 4)
+    for label, value, bold in (
+        ("Subtotal", document['subtotal'], False),
+        ("Descuento", document['discount'], False),
+        ("Total", document['total'], True),
+    ):
+        y -= 16
+        pdf.text(columns[3], y, label, bold=bold)
+        pdf.text(columns[4], y, _money(value), bold=bold, align='right')
+    if document['notes']:
+        pdf.text(left, y - 30, document['notes'][:100])
+    return pdf.render()
@@ -0,0 +1,223 @@
+import hashlib
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from django.core.cache import caches
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import PurchaseDetail, PurchaseInvoice, SaleDetail, SaleInvoice
+from .invoice_layout import render_invoice
+
+
+# Bump when the layout changes so cached PDFs are rendered again.
+RENDER_VERSION = 1
+BATCH_SIZE = 200
+# Below this many misses a batch is rendered in-process even with workers;
+# the pool only pays off when there is real work to spread.
+POOL_THRESHOLD = 8
+
+
+def invoice_cache():
+    return caches['invoices']
+
+
+# kind -> (sale or purchase fields the PDF shows, read through the invoice;
+#          line model, its parent field, line fields the PDF shows)
+CONTENT = {
+    'sale': (
+        ('sale_id', 'sale__subtotal', 'sale__total', 'sale__payment_method__name', 'sale__customer__name',
+         'sale__customer__address', 'sale__customer__email', 'sale__customer__phone'),
+        SaleDetail, 'sale_id',
+        ('product__name', 'quantity', 'unit_price', 'discount_name', 'discount_type', 'discount_value'),
+    ),
+    'purchase': (
+        ('purchase_id', 'purchase__total', 'purchase__payment_method__name', 'purchase__supplier__name',
+         'purchase__supplier__company__name', 'purchase__supplier__email', 'purchase__supplier__phone'),
+        PurchaseDetail, 'purchase_id',
+        ('product__name', 'quantity', 'unit_price'),
+    ),
+}
+INVOICE_FIELDS = (
+    'pk', 'invoice_number', 'last_updated', 'issue_date', 'due_date', 'subtotal', 'discount', 'total_amount', 'notes',
+)
+
+
+def cache_key(kind, invoice_id, digest):
+    return f'invoice-pdf:{RENDER_VERSION}:{kind}:{invoice_id}:{digest}'
+
+
+def content_keys(kind, invoice_ids):
+    """{invoice pk: (invoice_number, cache key)} in two queries.
+
+    The key digests everything the PDF shows, including the sale or purchase
+    and its lines, so editing any of them renders the invoice again even
+    though the invoice row itself was not saved.
+    """
+    model = KINDS[kind][0]
+    parent_fields, line_model, parent_field, line_fields = CONTENT[kind]
+    parent = len(INVOICE_FIELDS)
+    rows = list(model.objects.filter(pk__in=invoice_ids).order_by('pk').values_list(*INVOICE_FIELDS, *parent_fields))
+    lines = defaultdict(list)
+    for parent_id, *values in (
+        line_model.objects.filter(**{f'{parent_field}__in': [row[parent] for row in rows]})
+        .order_by('pk').values_list(parent_field, *line_fields)
+    ):
+        lines[parent_id].append(values)
+    keys = {}
+    for row in rows:
+        digest = hashlib.sha1(repr((row, lines[row[parent]])).encode()).hexdigest()
+        keys[row[0]] = (row[1], cache_key(kind, row[0], digest))
+    return keys
+
+
+def sale_document(invoice):
+    """Plain data needed to render a SaleInvoice; safe to send to a worker"""
+    sale = invoice.sale
+    customer = sale.customer
+    lines = [
+        (detail.product.name, detail.quantity, detail.unit_price, detail.discount_name or '', detail.line_amounts()[1])
+        for detail in sale.saledetail_set.all()
+    ]
+    return {
+        'title': "Factura de venta",
+        'number': invoice.invoice_number,
+        'issue_date': invoice.issue_date,
+        'due_date': invoice.due_date,
+        'party_label': "Cliente",
+        'party': [value for value in (customer.name, customer.address, customer.email, customer.phone) if value],
+        'reference': f"Venta #{sale.pk} - {sale.payment_method.name}",
+        'lines': lines,
+        'subtotal': invoice.subtotal if invoice.subtotal is not None else sale.subtotal,
+        'discount': invoice.discount or sale.subtotal - sale.total,
+        'total': invoice.total_amount if invoice.total_amount is not None else sale.total,
+        'notes': invoice.notes or '',
+    }
+
+
+def purchase_document(invoice):
+    purchase = invoice.purchase
+    supplier = purchase.supplier
+    lines = [
+        (detail.product.name, detail.quantity, detail.unit_price, '', detail.unit_price * detail.quantity)
+        for detail in purchase.purchasedetail_set.all()
+    ]
+    return {
+        'title': "Factura de compra",
+        'number': invoice.invoice_number,
+        'issue_date': invoice.issue_date,
+        'due_date': invoice.due_date,
+        'party_label': "Proveedor",
+        'party': [value for value in (supplier.name, supplier.company.name, supplier.email, supplier.phone) if value],
+        'reference': f"Compra #{purchase.pk} - {purchase.payment_method.name}",
+        'lines': lines,
+        'subtotal': invoice.subtotal if invoice.subtotal is not None else purchase.total,
+        'discount': invoice.discount or 0,
+        'total': invoice.total_amount if invoice.total_amount is not None else purchase.total,
+        'notes': invoice.notes or '',
+    }
+
+
+# kind -> (model, queryset loading everything a document needs, document builder)
+KINDS = {
+    'sale': (
+        SaleInvoice,
+        lambda: SaleInvoice.objects.select_related('sale__customer', 'sale__payment_method').prefetch_related(
+            Prefetch('sale__saledetail_set', queryset=SaleDetail.objects.select_related('product').order_by('pk'))
+        ),
+        sale_document,
+    ),
+    'purchase': (
+        PurchaseInvoice,
+        lambda: PurchaseInvoice.objects.select_related(
+            'purchase__supplier__company', 'purchase__payment_method'
+        ).prefetch_related(
+            Prefetch('purchase__purchasedetail_set', queryset=PurchaseDetail.objects.select_related('product').order_by('pk'))
+        ),
+        purchase_document,
+    ),
+}
+
+
+def iter_invoice_pdfs(kind, queryset, batch_size=BATCH_SIZE, workers=1):
+    """Yields (filename, pdf bytes) for every invoice of `queryset`.
+
+    Each batch of `batch_size` invoices costs a fixed number of queries: two
+    to build the cache keys from the rendered content (see content_keys)
+    and, for the cache misses only, one select_related query plus one
+    prefetch of the lines. With `workers` above 1, as the render_invoices
+    command runs it, misses are rendered in a process pool when there are
+    enough of them; web requests render in-process.
+    """
+    _, loader, build = KINDS[kind]
+    cache = invoice_cache()
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    executor = None
+    try:
+        for start in range(0, len(pks), batch_size):
+            keys = content_keys(kind, pks[start:start + batch_size])
+            rendered = cache.get_many([key for _, key in keys.values()])
+
+            missing_ids = [pk for pk, (_, key) in keys.items() if key not in rendered]
+            missing = list(loader().filter(pk__in=missing_ids).order_by('pk')) if missing_ids else []
+            documents = [build(invoice) for invoice in missing]
+            if workers > 1 and len(documents) >= POOL_THRESHOLD:
+                executor = executor or ProcessPoolExecutor(max_workers=workers)
+                pdfs = list(executor.map(render_invoice, documents, chunksize=max(1, len(documents) // workers)))
+            else:
+                pdfs = [render_invoice(document) for document in documents]
+            fresh = {keys[invoice.pk][1]: pdf for invoice, pdf in zip(missing, pdfs)}
+            if fresh:
+                cache.set_many(fresh)
+            rendered.update(fresh)
+
+            for number, key in keys.values():
+                yield f"{kind}_{number}.pdf", rendered[key]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+class ZipStream:
+    """Write-only file object for zipfile that hands written bytes back"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_zip(files):
+    """Streams a zip archive of (filename, bytes) pairs as it is built.
+
+    The PDFs are already compressed, so they are stored as is.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, data in files:
+            archive.writestr(filename, data)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def streaming_invoices(kind, queryset):
+    response = StreamingHttpResponse(iter_zip(iter_invoice_pdfs(kind, queryset)), content_type='application/zip')
+    filename = f"facturas_{kind}_{timezone.now():%Y%m%d_%H%M%S}.zip"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
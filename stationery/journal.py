@@ -0,0 +1,71 @@
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+# Columns copied between StockMovementJournal and StockMovement.
+MOVEMENT_FIELDS = (
+    'product_id', 'quantity', 'reason', 'movement_type_id', 'date', 'created_by_id',
+    'purchase_id', 'sale_id', 'purchase_return_id', 'sale_return_id',
+)
+
+
+def write_behind_enabled():
+    return getattr(settings, 'STOCK_MOVEMENT_WRITE_BEHIND', False)
+
+
+def record_movements(movements):
+    """Stores unsaved StockMovement instances.
+
+    In write-behind mode they are appended to StockMovementJournal in the
+    caller's transaction instead, so they commit or roll back together with
+    the stock update, and flush() moves them to StockMovement later.
+    """
+    movements = list(movements)
+    if not movements:
+        return
+    if not write_behind_enabled():
+        apps.get_model('stationery', 'StockMovement').objects.bulk_create(movements)
+        return
+
+    StockMovementJournal = apps.get_model('stationery', 'StockMovementJournal')
+    now = timezone.now()
+    entries = []
+    for movement in movements:
+        entry = StockMovementJournal(**{field: getattr(movement, field) for field in MOVEMENT_FIELDS})
+        entry.date = movement.date or now
+        entries.append(entry)
+    StockMovementJournal.objects.bulk_create(entries)
+
+
+def outstanding(**filters):
+    """Journal entries not yet flushed, oldest first"""
+    StockMovementJournal = apps.get_model('stationery', 'StockMovementJournal')
+    return StockMovementJournal.objects.filter(**filters).order_by('pk')
+
+
+def flush(batch_size=5000):
+    """Moves journal entries to StockMovement; returns the number moved.
+
+    Each batch is copied and deleted in one transaction, so an entry becomes
+    exactly one movement even if the flusher dies halfway. Concurrent
+    flushers skip rows another one has locked where the database supports it.
+    """
+    StockMovement = apps.get_model('stationery', 'StockMovement')
+    StockMovementJournal = apps.get_model('stationery', 'StockMovementJournal')
+    moved = 0
+    while True:
+        with transaction.atomic():
+            entries = list(
+                StockMovementJournal.objects.order_by('pk')
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not entries:
+                return moved
+            StockMovement.objects.bulk_create([
+                StockMovement(**{field: getattr(entry, field) for field in MOVEMENT_FIELDS})
+                for entry in entries
+            ])
+            StockMovementJournal.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+        moved += len(entries)
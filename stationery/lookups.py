@@ -0,0 +1,60 @@
+import threading
+from django.apps import apps
+
+
+class LookupRegistry:
+    """Process-local cache of a small lookup table keyed by `code`.
+
+    Rows are loaded once per process on first access and dropped by the
+    post_save/post_delete receivers in signals.py whenever the table changes.
+    """
+
+    def __init__(self, model_label, key='code'):
+        self.model_label = model_label
+        self.key = key
+        self._rows = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def _load(self):
+        rows = {getattr(obj, self.key): obj for obj in self.model.objects.all()}
+        with self._lock:
+            self._rows = rows
+        return rows
+
+    def get(self, code):
+        rows = self._rows
+        if rows is None or code not in rows:
+            # A miss may be a row created by another process, reload once.
+            rows = self._load()
+        try:
+            return rows[code]
+        except KeyError:
+            raise self.model.DoesNotExist(
+                f"{self.model.__name__} with {self.key}={code!r} does not exist"
+            )
+
+    def all(self):
+        rows = self._rows
+        if rows is None:
+            rows = self._load()
+        return list(rows.values())
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+
+
+movement_types = LookupRegistry('stationery.MovementType')
+transaction_statuses = LookupRegistry('stationery.TransactionStatus')
+payment_methods = LookupRegistry('stationery.PaymentMethod')
+discount_types = LookupRegistry('stationery.DiscountType')
+scope_types = LookupRegistry('stationery.ScopeType')
+
+REGISTRIES = {
+    registry.model_label: registry
+    for registry in (movement_types, transaction_statuses, payment_methods, discount_types, scope_types)
+}
@@ -0,0 +1,36 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from stationery.exports import EXPORTS, FORMATS, iter_export
+
+
+def parse_date(value):
+    try:
+        return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+    except ValueError:
+        raise CommandError(f"Fecha inválida: {value} (use AAAA-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Exporta ventas, compras o movimientos de stock en CSV/JSONL sin cargar los modelos en memoria"
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="Archivo de salida (por defecto stdout)")
+        parser.add_argument('--since', type=parse_date, help="Fecha inicial inclusiva AAAA-MM-DD")
+        parser.add_argument('--until', type=parse_date, help="Fecha final exclusiva AAAA-MM-DD")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunks = iter_export(
+            options['dataset'], options['format'],
+            since=options['since'], until=options['until'], chunk_size=options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
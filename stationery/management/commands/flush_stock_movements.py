@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+
+from stationery.journal import flush, outstanding
+
+
+class Command(BaseCommand):
+    help = "Pasa los movimientos de stock pendientes del diario al historial (modo write-behind)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--loop', action='store_true', help="Sigue ejecutándose como proceso de fondo")
+        parser.add_argument('--interval', type=float, default=2.0, help="Segundos entre vaciados con --loop")
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            moved = flush(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{moved} movimientos guardados, {outstanding().count()} pendientes"
+            ))
+            return
+
+        while True:
+            moved = flush(batch_size=options['batch_size'])
+            if moved:
+                self.stdout.write(f"{moved} movimientos guardados")
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from stationery.datagen import FixtureGenerator
+
+
+class Command(BaseCommand):
+    help = "Genera productos, compras, ventas, descuentos y movimientos sintéticos y coherentes para pruebas de carga"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--sales', type=int, default=100000)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--discounts', type=int, default=30)
+        parser.add_argument('--days', type=int, default=365, help="Días de historia hasta hoy")
+        parser.add_argument('--lines', type=float, default=4, help="Líneas promedio por venta")
+        parser.add_argument('--zipf', type=float, default=1.1, help="Exponente de la popularidad de los productos")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Ventas por transacción")
+
+    def handle(self, *args, **options):
+        if options['products'] < 1 or options['sales'] < 0 or options['days'] < 1 or options['lines'] < 1:
+            raise CommandError("Se necesita al menos un producto, un día y una línea por venta")
+
+        started = time.perf_counter()
+        generator = FixtureGenerator(
+            seed=options['seed'],
+            chunk_size=options['chunk_size'],
+            days=options['days'],
+            exponent=options['zipf'],
+            mean_lines=options['lines'],
+            log=self.stdout.write,
+        )
+        try:
+            counts = generator.run(
+                products=options['products'],
+                sales=options['sales'],
+                customers=options['customers'],
+                discounts=options['discounts'],
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['products']} productos, {counts['purchases']} compras ({counts['purchase_lines']} líneas), "
+            f"{counts['sales']} ventas ({counts['sale_lines']} líneas) y {counts['movements']} movimientos "
+            f"generados en {time.perf_counter() - started:.0f} s"
+        ))
@@ -0,0 +1,176 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from stationery import caching, search
+from stationery.journal import record_movements
+from stationery.lookups import movement_types
+from stationery.models import Brand, Category, Product, StockMovement
+from stationery.schemas import category_validator
+from stationery.utils.enums import MovementReasonEnum, MovementTypeEnum
+
+
+UPDATE_FIELDS = [
+    'name', 'sale_price', 'purchase_price', 'description', 'minimum_stock',
+    'category', 'brand', 'active', 'attributes',
+]
+
+
+def read_rows(path, fmt):
+    """Yields (line_number, row dict) from a CSV or JSONL file"""
+    with open(path, newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            for line_number, row in enumerate(csv.DictReader(source), start=2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa o actualiza productos por SKU desde un CSV/JSONL validando los atributos contra "
+        "el esquema de su categoría. El stock solo se asigna al crear el producto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help="Por defecto según la extensión")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help="Archivo donde escribir los errores por fila")
+        parser.add_argument('--dry-run', action='store_true', help="Solo valida, no guarda")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.categories = {}
+        for category in Category.objects.all():
+            self.categories[category.name] = category
+            self.categories[str(category.pk)] = category
+        self.brands = dict(Brand.objects.values_list('name', 'pk'))
+        self.errors = []
+
+        imported = 0
+        batch = []
+        try:
+            for line_number, row in read_rows(options['path'], fmt):
+                product = self.build_product(line_number, row)
+                if product is not None:
+                    batch.append(product)
+                if len(batch) >= options['batch_size']:
+                    imported += self.save_batch(batch, options['dry_run'])
+                    batch = []
+            imported += self.save_batch(batch, options['dry_run'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if options['errors'] and self.errors:
+            with open(options['errors'], 'w', encoding='utf-8') as output:
+                output.writelines(f"{line}: {message}\n" for line, message in self.errors)
+        else:
+            for line, message in self.errors[:50]:
+                self.stderr.write(f"Línea {line}: {message}")
+
+        if imported and not options['dry_run']:
+            # bulk_create sends no post_save; names and prices of any product
+            # may have changed, so expire pages and product cards here.
+            caching.bump_version(caching.CATALOG)
+            caching.bump_version(caching.PRICING)
+
+        verb = "validados" if options['dry_run'] else "importados"
+        self.stdout.write(self.style.SUCCESS(f"{imported} productos {verb}, {len(self.errors)} filas con errores"))
+
+    def error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+    def build_product(self, line_number, row):
+        if isinstance(row, Exception):
+            return self.error(line_number, f"JSON inválido: {row}")
+
+        sku = (row.get('sku') or '').strip()
+        if not sku:
+            return self.error(line_number, "Falta el SKU")
+
+        category = self.categories.get(str(row.get('category') or '').strip())
+        if category is None:
+            return self.error(line_number, f"Categoría desconocida: {row.get('category')}")
+
+        brand_name = (row.get('brand') or '').strip()
+        if brand_name and brand_name not in self.brands:
+            return self.error(line_number, f"Marca desconocida: {brand_name}")
+
+        try:
+            sale_price = Decimal(str(row['sale_price']))
+            purchase_price = Decimal(str(row['purchase_price']))
+            minimum_stock = int(row.get('minimum_stock') or 0)
+            stock = int(row.get('stock') or 0)
+        except (KeyError, InvalidOperation, ValueError) as e:
+            return self.error(line_number, f"Valor numérico inválido: {e}")
+        if stock < 0:
+            return self.error(line_number, "Stock cannot be negative")
+        if sale_price < purchase_price:
+            return self.error(line_number, "Sale price cannot be lower than purchase price")
+
+        attributes = row.get('attributes') or {}
+        if isinstance(attributes, str):
+            try:
+                attributes = json.loads(attributes)
+            except ValueError as e:
+                return self.error(line_number, f"Atributos no son JSON válido: {e}")
+        if category.product_schema:
+            messages = [e.message for e in category_validator(category).iter_errors(attributes)]
+            if messages:
+                return self.error(line_number, f"Datos inválidos: {'; '.join(messages)}")
+
+        active = row.get('active', True)
+        if isinstance(active, str):
+            active = active.strip().lower() not in ('0', 'false', 'no', '')
+
+        return Product(
+            sku            = sku,
+            name           = row.get('name') or sku,
+            sale_price     = sale_price,
+            purchase_price = purchase_price,
+            description    = row.get('description') or None,
+            minimum_stock  = minimum_stock,
+            stock          = stock,
+            category       = category,
+            brand_id       = self.brands.get(brand_name),
+            active         = active,
+            attributes     = attributes,
+        )
+
+    def save_batch(self, batch, dry_run):
+        if not batch or dry_run:
+            return len(batch)
+        # Last row wins when a SKU repeats inside the batch.
+        unique = list({product.sku: product for product in batch}.values())
+        skus = [product.sku for product in unique]
+        with transaction.atomic():
+            existing = set(Product.objects.filter(sku__in=skus).values_list('sku', flat=True))
+            Product.objects.bulk_create(
+                unique,
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=UPDATE_FIELDS,
+            )
+            ids = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'pk'))
+            # Opening stock of new products enters the ledger; existing ones keep theirs.
+            record_movements(
+                StockMovement(
+                    product_id=ids[product.sku],
+                    quantity=product.stock,
+                    movement_type=movement_types.get(MovementTypeEnum.IN),
+                    reason=MovementReasonEnum.ADJUSTMENT,
+                )
+                for product in unique
+                if product.sku not in existing and product.stock > 0
+            )
+            search.reindex(ids.values())
+        return len(unique)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from stationery.profiling import LATENCY_BUCKETS, budget_for, clear_published, collect
+
+
+SORT_FIELDS = {
+    'queries': 'queries_max',
+    'db': 'db_ms_avg',
+    'view': 'view_ms_p95',
+    'duplicates': 'duplicates_avg',
+}
+
+
+class Command(BaseCommand):
+    help = "Muestra las vistas con más consultas, tiempo de base de datos o latencia según el perfilador"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_FIELDS), default='queries')
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--histogram', action='store_true', help="Incluye el histograma de latencias")
+        parser.add_argument('--reset', action='store_true', help="Borra las muestras publicadas")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            clear_published()
+            self.stdout.write(self.style.SUCCESS("Muestras del perfilador borradas"))
+            return
+
+        summary = collect()
+        if not summary:
+            self.stdout.write("No hay muestras publicadas todavía")
+            return
+
+        field = SORT_FIELDS[options['sort']]
+        ranked = sorted(summary.items(), key=lambda item: item[1][field], reverse=True)[:options['limit']]
+        self.stdout.write(
+            f"{'Vista':<45} {'Req':>5} {'Cons.':>6} {'Máx':>5} {'Dupl.':>6} {'DB ms':>8} {'p50 ms':>8} {'p95 ms':>8}"
+        )
+        for name, row in ranked:
+            over = budget_for(name) and row['queries_max'] > budget_for(name).get('queries', float('inf'))
+            line = (
+                f"{name[:45]:<45} {row['requests']:>5} {row['queries_avg']:>6.1f} {row['queries_max']:>5} "
+                f"{row['duplicates_avg']:>6.1f} {row['db_ms_avg']:>8.1f} {row['view_ms_p50']:>8.1f} {row['view_ms_p95']:>8.1f}"
+            )
+            self.stdout.write(self.style.ERROR(line) if over else line)
+            for sql, count in row['top_duplicates']:
+                self.stdout.write(f"    {count}x {sql[:150]}")
+            if options['histogram']:
+                labels = [f"≤{bound}" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}"]
+                self.stdout.write("    " + "  ".join(
+                    f"{label}:{count}" for label, count in zip(labels, row['histogram']) if count
+                ))
+        self.stdout.write(self.style.SUCCESS(f"{len(summary)} vistas con muestras"))
@@ -0,0 +1,24 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+
+from stationery.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recalcula las tablas de ventas diarias por producto y categoría a partir de los detalles de venta"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Primer día a recalcular (AAAA-MM-DD)")
+        parser.add_argument('--until', help="Último día a recalcular (AAAA-MM-DD)")
+
+    def parse_day(self, value):
+        if value is None:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Fecha inválida: {value}")
+
+    def handle(self, *args, **options):
+        rows = rebuild(self.parse_day(options['since']), self.parse_day(options['until']))
+        self.stdout.write(self.style.SUCCESS(f"{rows} filas de ventas diarias recalculadas"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from stationery.models import Product
+from stationery.search import reindex
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de productos"
+
+    def handle(self, *args, **options):
+        reindex()
+        self.stdout.write(self.style.SUCCESS(f"{Product.objects.count()} productos indexados"))
@@ -0,0 +1,49 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from stationery.models import Sale, SaleDetail
+
+
+class Command(BaseCommand):
+    help = "Recalcula en bloque el subtotal y total de las ventas cuyos valores almacenados no coinciden con sus detalles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help="Solo reporta las ventas descuadradas")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        zero = Decimal('0.00')
+        checked = fixed = 0
+        last_id = 0
+
+        while True:
+            # The chunk is read, summed and written under its rows' locks, so a
+            # till's F() delta either lands before the read or after the write.
+            with transaction.atomic():
+                sales = Sale.objects.filter(pk__gt=last_id).order_by('pk')
+                if not options['dry_run']:
+                    sales = sales.select_for_update()
+                stored = list(sales.values_list('pk', 'subtotal', 'total')[:chunk_size])
+                if not stored:
+                    break
+                last_id = stored[-1][0]
+
+                computed = SaleDetail.totals_by_sale(
+                    SaleDetail.objects.filter(sale_id__gte=stored[0][0], sale_id__lte=last_id)
+                )
+
+                drifted = []
+                for sale_id, subtotal, total in stored:
+                    expected_subtotal, expected_total = computed.get(sale_id, (zero, zero))
+                    if (subtotal, total) != (expected_subtotal, expected_total):
+                        drifted.append(Sale(pk=sale_id, subtotal=expected_subtotal, total=expected_total))
+
+                checked += len(stored)
+                fixed += len(drifted)
+                if drifted and not options['dry_run']:
+                    Sale.objects.bulk_update(drifted, ['subtotal', 'total'])
+
+        verb = "descuadradas" if options['dry_run'] else "corregidas"
+        self.stdout.write(self.style.SUCCESS(f"{checked} ventas revisadas, {fixed} {verb}"))
@@ -0,0 +1,50 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stationery.invoicing import KINDS, iter_invoice_pdfs, iter_zip
+
+
+class Command(BaseCommand):
+    help = "Genera los PDF de las facturas de un periodo en un archivo zip (cierre de mes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Ruta del archivo zip")
+        parser.add_argument('--kind', choices=sorted(KINDS), default='sale')
+        parser.add_argument('--since', help="Fecha de emisión inicial (AAAA-MM-DD)")
+        parser.add_argument('--until', help="Fecha de emisión final, exclusiva (AAAA-MM-DD)")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--workers', type=int, default=settings.INVOICE_RENDER_WORKERS,
+            help="Procesos de renderizado (por defecto INVOICE_RENDER_WORKERS)",
+        )
+
+    def parse_day(self, value):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Fecha inválida: {value}")
+
+    def handle(self, *args, **options):
+        model = KINDS[options['kind']][0]
+        invoices = model.objects.all()
+        if options['since']:
+            invoices = invoices.filter(issue_date__date__gte=self.parse_day(options['since']))
+        if options['until']:
+            invoices = invoices.filter(issue_date__date__lt=self.parse_day(options['until']))
+
+        count = 0
+
+        def counted(files):
+            nonlocal count
+            for item in files:
+                count += 1
+                yield item
+
+        pdfs = iter_invoice_pdfs(
+            options['kind'], invoices, batch_size=options['batch_size'], workers=options['workers']
+        )
+        with open(options['output'], 'wb') as output:
+            for chunk in iter_zip(counted(pdfs)):
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"{count} facturas guardadas en {options['output']}"))
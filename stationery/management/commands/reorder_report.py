@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from stationery.reorder import create_purchase_drafts, suggest
+
+
+class Command(BaseCommand):
+    help = "Lista los productos bajo stock mínimo con la cantidad sugerida de reposición por proveedor"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Ventana de ventas para calcular la velocidad")
+        parser.add_argument('--cover-days', type=int, default=14, help="Días de demanda a cubrir sobre el mínimo")
+        parser.add_argument('--create-drafts', action='store_true', help="Crea compras en borrador por proveedor")
+
+    def handle(self, *args, **options):
+        suggestions = suggest(days=options['days'], cover_days=options['cover_days'])
+        for suggestion in sorted(suggestions, key=lambda s: (s.supplier_id or 0, s.product.name)):
+            product = suggestion.product
+            self.stdout.write(
+                f"proveedor={suggestion.supplier_id or '-'}\t{product.name}\tstock={product.stock}"
+                f"\tmínimo={product.minimum_stock}\tventas/día={suggestion.daily_velocity}"
+                f"\ten pedido={suggestion.on_order}\tsugerido={suggestion.quantity}"
+            )
+
+        without_supplier = sum(1 for suggestion in suggestions if suggestion.supplier_id is None)
+        if without_supplier:
+            self.stderr.write(f"{without_supplier} productos sin proveedor asignado")
+
+        if options['create_drafts']:
+            purchases = create_purchase_drafts(suggestions)
+            self.stdout.write(self.style.SUCCESS(f"{len(purchases)} compras en borrador creadas"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(suggestions)} productos bajo stock mínimo sin reposición en curso"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from stationery.inventory import take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Guarda una foto del stock actual de todos los productos (programar a diario)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        created = take_snapshot(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{created} fotos de stock guardadas"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='reason',
+            field=models.CharField(blank=True, choices=[('COMPRA', 'Compra a proveedor'), ('VENTA', 'Venta a cliente'), ('DEVOLUCION', 'Devolución'), ('AJUSTE', 'Ajuste de inventario'), ('DANADO', 'Mercancía dañada'), ('VENCIDO', 'Producto vencido'), ('ANULACION', 'Anulación de transacción')], max_length=15, null=True),
+        ),
+    ]
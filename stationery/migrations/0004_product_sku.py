@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0003_stock_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Código del producto en el catálogo del proveedor', max_length=50, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0004_product_sku'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='stationery__name_c9d0c5_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='stationery__name_47692e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['creation_date', 'id'], name='stationery__creatio_fa80e7_idx'),
+        ),
+    ]
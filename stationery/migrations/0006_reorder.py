@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:02
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0005_product_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReorderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('daily_velocity', models.DecimalField(decimal_places=2, help_text='Unidades vendidas por día en la ventana analizada', max_digits=10)),
+                ('stock', models.IntegerField(help_text='Stock al generar la sugerencia')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stock__lt', models.F('minimum_stock'))), fields=['id'], name='product_below_minimum'),
+        ),
+        migrations.AddField(
+            model_name='reorderline',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reorder_lines', to='stationery.product'),
+        ),
+        migrations.AddField(
+            model_name='reorderline',
+            name='purchase',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reorder_lines', to='stationery.purchase'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0006_reorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Total cobrado, con descuentos', max_digits=14)),
+                ('discount', models.DecimalField(decimal_places=2, default=0, help_text='Descuento otorgado', max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, help_text='Unidades por precio de compra', max_digits=14)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='stationery.category')),
+            ],
+            options={
+                'verbose_name_plural': 'daily category sales',
+                'ordering': ['-day'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('day', 'category'), name='unique_daily_category_sales')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Total cobrado, con descuentos', max_digits=14)),
+                ('discount', models.DecimalField(decimal_places=2, default=0, help_text='Descuento otorgado', max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, help_text='Unidades por precio de compra', max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='stationery.product')),
+            ],
+            options={
+                'verbose_name_plural': 'daily product sales',
+                'ordering': ['-day'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['product', 'day'], name='stationery__product_bf6ef0_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='unique_daily_product_sales')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE stationery_product_fts USING fts5(
+    name, taxonomy, description, attributes,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+)
+"""
+
+SQLITE_FILL = """
+INSERT INTO stationery_product_fts (rowid, name, taxonomy, description, attributes)
+SELECT p.id, p.name, TRIM(COALESCE(b.name, '') || ' ' || c.name), COALESCE(p.description, ''),
+       COALESCE((SELECT GROUP_CONCAT(e.value, ' ') FROM json_each(p.attributes) e
+                 WHERE e.type IN ('text', 'integer', 'real')), '')
+FROM stationery_product p
+JOIN stationery_category c ON c.id = p.category_id
+LEFT JOIN stationery_brand b ON b.id = p.brand_id
+"""
+
+POSTGRES_FILL = """
+UPDATE stationery_product p SET search_vector =
+    setweight(to_tsvector('spanish', p.name), 'A')
+    || setweight(to_tsvector('spanish', COALESCE(b.name, '') || ' ' || c.name), 'B')
+    || setweight(to_tsvector('spanish', COALESCE(p.description, '')), 'C')
+    || setweight(to_tsvector('spanish', COALESCE((
+        SELECT string_agg(e.value #>> '{}', ' ') FROM jsonb_each(p.attributes) e
+        WHERE jsonb_typeof(e.value) IN ('string', 'number')), '')), 'D')
+FROM stationery_category c, stationery_product p2
+LEFT JOIN stationery_brand b ON b.id = p2.brand_id
+WHERE c.id = p.category_id AND p2.id = p.id
+"""
+
+
+def build_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_FILL)
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_FILL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE stationery_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0008_stock_movement_journal'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='gin_product_search'),
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
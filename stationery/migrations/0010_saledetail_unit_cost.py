@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:02
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_unit_cost(apps, schema_editor):
+    # Existing lines only know today's purchase price; it is the best estimate left.
+    Product = apps.get_model('stationery', 'Product')
+    SaleDetail = apps.get_model('stationery', 'SaleDetail')
+    SaleDetail.objects.filter(unit_cost__isnull=True).update(
+        unit_cost=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('purchase_price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0009_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saledetail',
+            name='unit_cost',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True, help_text='Precio de compra del producto al momento de la venta'),
+        ),
+        migrations.RunPython(backfill_unit_cost, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='saledetail',
+            name='unit_cost',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, help_text='Precio de compra del producto al momento de la venta'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:10
+
+from django.db import migrations
+
+
+def seed_draft_status(apps, schema_editor):
+    TransactionStatus = apps.get_model('stationery', 'TransactionStatus')
+    TransactionStatus.objects.get_or_create(code='DRAFT', defaults={'label': 'Borrador'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stationery', '0010_saledetail_unit_cost'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_draft_status, migrations.RunPython.noop),
+    ]
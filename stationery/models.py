@@ -1,13 +1,24 @@
-from django.db import models
+from collections import defaultdict
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models import F
+from django.db.models import F, Case, When, Value
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from decimal import Decimal
+from django.utils import timezone
 from django.contrib.postgres.indexes import GinIndex
-from jsonschema import validate, ValidationError
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db.models import Q, CheckConstraint, Sum
+from django.db.models import Q, CheckConstraint, Sum, BigIntegerField
+from django.db.models.functions import Abs, Cast, Greatest, Round, Sign
+from django.db.models.lookups import Exact, GreaterThan
 from .utils.enums import DiscountTypeEnum, ScopeTypeEnum, MovementReasonEnum, MovementTypeEnum
+from .lookups import movement_types, transaction_statuses
+from .discounts import discount_engine
+from .schemas import validation_error
+from . import rollups
+from .reservations import reserve_stock
+from .utils.retry import retry_on_conflict
+from .journal import record_movements
 
 def default_product_schema():
     return {
@@ -17,16 +28,61 @@ def default_product_schema():
         "required": []
     }
 
+def stock_shortfalls(quantities):
+    """Messages for the products of {product_id: units} holding fewer units in stock"""
+    return [
+        f"Stock insuficiente para revertir {product.name}: "
+        f"disponible {product.stock}, requerido {quantities[product.pk]}"
+        for product in Product.objects.filter(pk__in=list(quantities)).only('name', 'stock')
+        if product.stock < quantities[product.pk]
+    ]
+
+def reverse_stock(detail_rows, parent_field, direction, reason, created_by=None):
+    """Compensates the stock booked by a set of detail rows.
+
+    `detail_rows` are (parent_id, product_id, quantity) tuples already grouped
+    by parent and product. `direction` is +1 to give stock back (cancelled
+    sale) or -1 to take it out (cancelled purchase). Issues one UPDATE for all
+    products and one bulk insert of StockMovement rows.
+    """
+    quantities = defaultdict(int)
+    for parent_id, product_id, quantity in detail_rows:
+        quantities[product_id] += quantity
+    if not quantities:
+        return
+
+    if direction < 0:
+        shortfalls = stock_shortfalls(quantities)
+        if shortfalls:
+            raise ValidationError(shortfalls)
+
+    Product.objects.filter(pk__in=list(quantities)).update(
+        stock=Case(*[
+            When(pk=product_id, then=F('stock') + direction * quantity)
+            for product_id, quantity in quantities.items()
+        ])
+    )
+
+    movement_type = movement_types.get(MovementTypeEnum.IN if direction > 0 else MovementTypeEnum.OUT)
+    record_movements([
+        StockMovement(
+            product_id    = product_id,
+            quantity      = quantity,
+            movement_type = movement_type,
+            reason        = reason,
+            created_by    = created_by,
+            **{f'{parent_field}_id': parent_id}
+        )
+        for parent_id, product_id, quantity in detail_rows
+    ])
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
     last_updated = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
-    product_schema = models.JSONField(default={"$schema": "https://json-schema.org/draft/2020-12/schema",
-        "type": "object",
-        "properties": {},
-        "required": []}, blank=True,)
+    product_schema = models.JSONField(default=default_product_schema, blank=True,)
 
     class Meta: 
         verbose_name_plural='Categories'
@@ -57,8 +113,12 @@ class Supplier(models.Model):
     def __str__(self):
         return f'{self.name} - {self.company}'
 
+# Partial index predicate: filters must use this exact Q to hit the index.
+BELOW_MINIMUM_STOCK = Q(stock__lt=F('minimum_stock'))
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
+    sku = models.CharField(max_length=50, unique=True, blank=True, null=True, help_text="Código del producto en el catálogo del proveedor")
     sale_price = models.DecimalField(max_digits=10, decimal_places=2)
     purchase_price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField(blank=True, null=True)
@@ -77,12 +137,17 @@ class Product(models.Model):
         blank=True,
         help_text="Atributos específicos según el tipo de producto"
     )
+    # Maintained by search.reindex() on PostgreSQL; SQLite uses an FTS5 table.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         indexes = [
-            models.Index(fields=['name']),
+            models.Index(fields=['name', 'id']),
+            models.Index(fields=['creation_date', 'id']),
             models.Index(fields=['stock']),
-            GinIndex(fields=['attributes'], name='gin_attributes')
+            models.Index(fields=['id'], condition=BELOW_MINIMUM_STOCK, name='product_below_minimum'),
+            GinIndex(fields=['attributes'], name='gin_attributes'),
+            GinIndex(fields=['search_vector'], name='gin_product_search'),
         ]
         constraints = [
             models.CheckConstraint(
@@ -98,10 +163,9 @@ class Product(models.Model):
             raise ValidationError("Sale price cannot be lower than purchase price")
         
         if self.category and self.category.product_schema:
-            try:
-                validate(instance=self.attributes, schema=self.category.product_schema)
-            except ValidationError as e:
-                raise ValidationError({'attributes': f"Datos inválidos: {e.message}"})
+            error = validation_error(self.category, self.attributes)
+            if error is not None:
+                raise ValidationError({'attributes': f"Datos inválidos: {error.message}"})
 
         
     def check_stock(self, required_quantity):
@@ -179,6 +243,95 @@ class Purchase(models.Model):
         if self.total < 0:
             ValidationError("Total cannot be negative")
 
+    @classmethod
+    def cancel_many(cls, queryset, created_by=None):
+        """Cancels every non-received purchase of `queryset` in one transaction.
+
+        Returns (cancelled_ids, blocked_ids); blocked purchases were already
+        received and are left untouched.
+        """
+        received = transaction_statuses.get('RECEIVED')
+        cancelled = transaction_statuses.get('CANCELLED')
+
+        with transaction.atomic():
+            # Re-select by pk so annotated admin querysets can be locked.
+            queryset = cls.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+            blocked_ids = list(queryset.filter(status=received).values_list('pk', flat=True))
+            cancelled_ids = list(
+                queryset.exclude(status__in=[received, cancelled])
+                .select_for_update()
+                .values_list('pk', flat=True)
+            )
+            if cancelled_ids:
+                detail_rows = list(
+                    PurchaseDetail.objects.filter(purchase_id__in=cancelled_ids)
+                    .values_list('purchase_id', 'product_id')
+                    .annotate(quantity=Sum('quantity'))
+                    .order_by()
+                )
+                reverse_stock(detail_rows, 'purchase', -1, MovementReasonEnum.CANCELLATION, created_by)
+                cls.objects.filter(pk__in=cancelled_ids).update(status=cancelled)
+
+        return cancelled_ids, blocked_ids
+
+    def receive_lines(self, lines):
+        """Books a whole supplier delivery with set-based statements.
+
+        `lines` are unsaved PurchaseDetail instances (without `purchase`).
+        Details and movements are bulk inserted and stock and purchase price
+        of every product are updated with a single UPDATE. When a product
+        appears more than once, the last line sets its purchase price.
+        """
+        lines = list(lines)
+        if not lines:
+            return []
+
+        quantities = defaultdict(int)
+        prices = {}
+        for line in lines:
+            quantities[line.product_id] += line.quantity
+            prices[line.product_id] = line.unit_price
+
+        with transaction.atomic():
+            products = Product.objects.in_bulk(list(quantities))
+            missing = [product_id for product_id in quantities if product_id not in products]
+            if missing:
+                raise ValidationError([f"Producto {product_id} no existe" for product_id in missing])
+
+            for line in lines:
+                product = products[line.product_id]
+                line.purchase = self
+                line.product = product
+                line.purchase_attributes = product.attributes.copy()
+
+            PurchaseDetail.objects.bulk_create(lines)
+
+            Product.objects.filter(pk__in=list(quantities)).update(
+                stock=Case(*[
+                    When(pk=product_id, then=F('stock') + quantity)
+                    for product_id, quantity in quantities.items()
+                ]),
+                purchase_price=Case(*[
+                    When(pk=product_id, then=Value(price))
+                    for product_id, price in prices.items()
+                ], output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+            )
+
+            in_type = movement_types.get(MovementTypeEnum.IN)
+            record_movements([
+                StockMovement(
+                    product_id     = line.product_id,
+                    quantity       = line.quantity,
+                    movement_type  = in_type,
+                    reason         = MovementReasonEnum.PURCHASE,
+                    purchase       = self,
+                    created_by_id  = self.created_by_id
+                )
+                for line in lines
+            ])
+
+        return lines
+
     def __str__(self):
         return f"Purchase {self.id} - {self.date}"
 
@@ -192,29 +345,82 @@ class PurchaseDetail(models.Model):
         help_text="Atributos del producto al momento de la compra"
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'quantity' in field_names and 'product_id' in field_names:
+            instance._loaded_quantity = instance.quantity
+            instance._loaded_product_id = instance.product_id
+        return instance
+
+    @classmethod
+    def removal_shortfalls(cls, details):
+        """stock_shortfalls() of deleting the PurchaseDetail queryset `details`.
+
+        Deleting a line takes its units back out of stock (see signals.py)
+        unless its purchase was cancelled, so callers can refuse the delete
+        up front instead of failing halfway through it.
+        """
+        quantities = dict(
+            details.exclude(purchase__status=transaction_statuses.get('CANCELLED'))
+            .filter(quantity__gt=0)
+            .values_list('product_id')
+            .annotate(quantity=Sum('quantity'))
+            .order_by()
+        )
+        return stock_shortfalls(quantities)
+
     def save(self, *args, **kwargs):
         is_new = self.pk is None
 
         if is_new and self.product:
             self.purchase_attributes = self.product.attributes.copy()
 
-        self.product.stock = F('stock') + self.quantity
-        self.product.purchase_price = self.unit_price
-        self.product.save()
-
-        super().save(*args, **kwargs)
-
         if is_new:
-            in_type = MovementType.objects.get(code='IN')
-            StockMovement.objects.create(
-                product        = self.product,
-                quantity       = self.quantity,
-                movement_type  = in_type,
-                reason         = MovementReasonEnum.PURCHASE,
-                purchase       = self.purchase,
-                created_by     = self.purchase.created_by
+            old_quantity, old_product_id = 0, self.product_id
+        elif hasattr(self, '_loaded_quantity'):
+            old_quantity, old_product_id = self._loaded_quantity, self._loaded_product_id
+        else:
+            old_quantity, old_product_id = PurchaseDetail.objects.values_list('quantity', 'product_id').get(pk=self.pk)
+        if old_product_id != self.product_id:
+            raise ValidationError("No se puede cambiar el producto de una línea guardada; elimínela y agregue otra")
+
+        with transaction.atomic():
+            if not is_new:
+                status_id = Purchase.objects.select_for_update().filter(pk=self.purchase_id).values_list(
+                    'status_id', flat=True
+                ).first()
+                closed = [transaction_statuses.get(code).pk for code in ('RECEIVED', 'CANCELLED')]
+                if status_id in closed:
+                    raise ValidationError("No se pueden modificar las líneas de una compra recibida o cancelada")
+
+            # Only the change in quantity moves stock; fewer units received
+            # has to find them still on hand.
+            delta = self.quantity - old_quantity
+            created_by = self.purchase.created_by
+            if delta < 0:
+                reverse_stock(
+                    [(self.purchase_id, self.product_id, -delta)], 'purchase', -1,
+                    MovementReasonEnum.ADJUSTMENT, created_by,
+                )
+            Product.objects.filter(pk=self.product_id).update(
+                stock=F('stock') + max(delta, 0), purchase_price=self.unit_price
             )
 
+            super().save(*args, **kwargs)
+
+            if delta > 0:
+                record_movements([StockMovement(
+                    product_id     = self.product_id,
+                    quantity       = delta,
+                    movement_type  = movement_types.get('IN'),
+                    reason         = MovementReasonEnum.PURCHASE,
+                    purchase_id    = self.purchase_id,
+                    created_by     = created_by
+                )])
+        self._loaded_quantity = self.quantity
+        self._loaded_product_id = self.product_id
+
     def __str__(self):
         return f"{self.product.name} - {self.quantity} units"
 
@@ -269,22 +475,30 @@ class Discount(models.Model):
     def __str__(self):
         return f"{self.name}"
 
+    @property
+    def scope_enum(self):
+        return ScopeTypeEnum.from_code(self.scope.code)
+
+    @property
+    def type_enum(self):
+        return DiscountTypeEnum.from_code(self.type.code)
+
     def clean(self):
-        if self.scope == ScopeTypeEnum.SELECTED_PRODUCTS and not self.products.exists():
+        if self.scope_enum == ScopeTypeEnum.SELECTED_PRODUCTS and not self.products.exists():
             raise ValidationError("You must select at least one product for this scope")
             
-        if self.scope == ScopeTypeEnum.SELECTED_CATEGORIES and not self.categories.exists():
+        if self.scope_enum == ScopeTypeEnum.SELECTED_CATEGORIES and not self.categories.exists():
             raise ValidationError("You must select at least one category for this scope")
 
     def applicable_products(self):
         """Returns queryset with products eligible for discount"""
-        if self.scope == ScopeTypeEnum.ALL_PRODUCTS:
+        if self.scope_enum == ScopeTypeEnum.ALL_PRODUCTS:
             return Product.objects.all()
         
-        if self.scope == ScopeTypeEnum.ALL_CATEGORIES:
+        if self.scope_enum == ScopeTypeEnum.ALL_CATEGORIES:
             return Product.objects.filter(category__isnull=False)
         
-        if self.scope == ScopeTypeEnum.SELECTED_CATEGORIES:
+        if self.scope_enum == ScopeTypeEnum.SELECTED_CATEGORIES:
             return Product.objects.filter(category__in=self.categories.all())
         
         return self.products.all()
@@ -294,22 +508,22 @@ class Discount(models.Model):
         if not self.active:
             return False
             
-        if self.scope == ScopeTypeEnum.ALL_PRODUCTS:
+        if self.scope_enum == ScopeTypeEnum.ALL_PRODUCTS:
             return True
             
-        if self.scope == ScopeTypeEnum.ALL_CATEGORIES and product.category:
+        if self.scope_enum == ScopeTypeEnum.ALL_CATEGORIES and product.category_id:
             return True
             
-        if self.scope == ScopeTypeEnum.SELECTED_CATEGORIES:
-            return product.category in self.categories.all()
+        if self.scope_enum == ScopeTypeEnum.SELECTED_CATEGORIES:
+            return self.categories.filter(pk=product.category_id).exists()
             
-        return product in self.products.all()
+        return self.products.filter(pk=product.pk).exists()
 
     def calculate_discount(self, original_price):
-        if not self.is_active:
+        if not self.active:
             return 0
             
-        if self.type == DiscountTypeEnum.PERCENTAGE:
+        if self.type_enum == DiscountTypeEnum.PERCENTAGE:
             return original_price * (self.value / 100)
             
         return min(self.value, original_price)    
@@ -341,9 +555,145 @@ class Sale(models.Model):
             models.Index(fields=['status']),
         ]
 
+    @staticmethod
+    def apply_total_delta(sale_id, subtotal_delta, total_delta):
+        """Shifts the stored totals of a sale with a single F() update"""
+        if not subtotal_delta and not total_delta:
+            return
+        Sale.objects.filter(pk=sale_id).update(
+            subtotal=F('subtotal') + subtotal_delta,
+            total=F('total') + total_delta,
+        )
+
+    def update_total(self):
+        """Recomputes subtotal and total from the details (does not save)"""
+        if self.pk is None:
+            return
+        totals = SaleDetail.totals_by_sale(self.saledetail_set.all())
+        zero = Decimal('0.00')
+        self.subtotal, self.total = totals.get(self.pk, (zero, zero))
+
+    @classmethod
+    def cancel_many(cls, queryset, created_by=None):
+        """Cancels every unpaid sale of `queryset` in one transaction.
+
+        Stock is given back for all details and compensating movements are
+        written; the details themselves are kept as history. Returns
+        (cancelled_ids, blocked_ids); blocked sales were already paid.
+        """
+        paid = transaction_statuses.get('PAID')
+        cancelled = transaction_statuses.get('CANCELLED')
+
+        with transaction.atomic():
+            # Re-select by pk so annotated admin querysets can be locked.
+            queryset = cls.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+            blocked_ids = list(queryset.filter(status=paid).values_list('pk', flat=True))
+            cancelled_ids = list(
+                queryset.exclude(status__in=[paid, cancelled])
+                .select_for_update()
+                .values_list('pk', flat=True)
+            )
+            if cancelled_ids:
+                detail_rows = list(
+                    SaleDetail.objects.filter(sale_id__in=cancelled_ids)
+                    .values_list('sale_id', 'product_id')
+                    .annotate(quantity=Sum('quantity'))
+                    .order_by()
+                )
+                reverse_stock(detail_rows, 'sale', 1, MovementReasonEnum.CANCELLATION, created_by)
+                rollups.apply_deltas(rollups.sale_deltas(cancelled_ids, sign=-1))
+                cls.objects.filter(pk__in=cancelled_ids).update(status=cancelled)
+
+        return cancelled_ids, blocked_ids
+
+    def post_lines(self, lines):
+        """Books a whole cart in a fixed number of queries.
+
+        `lines` are unsaved SaleDetail instances (without `sale`). The cart's
+        products are locked and their stock taken by reserve_stock(), details
+        and movements are bulk inserted, and the whole booking is retried on
+        lock conflicts when it runs outside an outer transaction. Raises
+        InsufficientStock listing every short product.
+        """
+        lines = list(lines)
+        if not lines:
+            return []
+
+        subtotal_delta, total_delta = self._book_lines(lines)
+        self.subtotal += subtotal_delta
+        self.total += total_delta
+        return lines
+
+    @retry_on_conflict()
+    def _book_lines(self, lines):
+        quantities = defaultdict(int)
+        for line in lines:
+            # A retried attempt inserts the lines again.
+            line.pk = None
+            line._state.adding = True
+            quantities[line.product_id] += line.quantity
+
+        products = reserve_stock(quantities)
+
+        for line in lines:
+            product = products[line.product_id]
+            line.sale = self
+            line.product = product
+            line.sale_attributes = product.attributes.copy()
+            line.unit_cost = product.purchase_price
+            if line.unit_price is None:
+                line.unit_price = product.sale_price
+            if line.created_by_id is None:
+                line.created_by_id = self.created_by_id
+        discount_engine.apply_many(lines)
+
+        SaleDetail.objects.bulk_create(lines)
+
+        amounts = [line.line_amounts() for line in lines]
+        for line, line_amount in zip(lines, amounts):
+            line._loaded_amounts = line_amount
+            line._loaded_quantity = line.quantity
+            line._loaded_product_id = line.product_id
+        subtotal_delta = sum(amount[0] for amount in amounts)
+        total_delta = sum(amount[1] for amount in amounts)
+        Sale.apply_total_delta(self.pk, subtotal_delta, total_delta)
+        if rollups.counts_towards_rollups(self):
+            day = rollups.sale_day(self.date)
+            rollups.apply_deltas([
+                rollups.line_delta(line, day, amounts=amount) for line, amount in zip(lines, amounts)
+            ])
+
+        out_type = movement_types.get(MovementTypeEnum.OUT)
+        record_movements([
+            StockMovement(
+                product_id    = line.product_id,
+                quantity      = line.quantity,
+                movement_type = out_type,
+                reason        = MovementReasonEnum.SALE,
+                sale          = self,
+                created_by_id = line.created_by_id
+            )
+            for line in lines
+        ])
+        return subtotal_delta, total_delta
+
     def __str__(self):
         return f"Sale {self.id} - {self.date}"
 
+def _divide_half_even(dividend, divisor):
+    """SQL `dividend / divisor` for non-negative integers, rounded half to even
+    like Decimal.quantize(), using only integer arithmetic."""
+    quotient = dividend / Value(divisor)
+    remainder = dividend - quotient * Value(divisor)
+    odd = quotient - quotient / Value(2) * Value(2)
+    return quotient + Case(
+        When(GreaterThan(remainder * Value(2), divisor), then=Value(1)),
+        When(Exact(remainder * Value(2), divisor), then=odd),
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )
+
+
 class SaleDetail(models.Model):
     sale = models.ForeignKey('Sale', on_delete=models.CASCADE)
     product = models.ForeignKey('Product', on_delete=models.CASCADE)
@@ -352,6 +702,10 @@ class SaleDetail(models.Model):
     discount_name = models.CharField(max_length=100, blank=True, null=True)
     discount_type = models.PositiveIntegerField(choices=DiscountTypeEnum.choices, blank=True, null=True)
     discount_value = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    unit_cost = models.DecimalField(
+        max_digits=10, decimal_places=2, editable=False,
+        help_text="Precio de compra del producto al momento de la venta"
+    )
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
 
     sale_attributes = models.JSONField(
@@ -361,13 +715,81 @@ class SaleDetail(models.Model):
 
     @property
     def final_price(self):
-        if self.discount_type == DiscountTypeEnum.PERCENTAGE:
-            return self.unit_price * (1 - self.discount_value/100)
-        elif self.discount_type == DiscountTypeEnum.FIXED_AMOUNT:
-            return max(self.unit_price - self.discount_value, Decimal('0'))
-        return self.unit_price
-
-
+        return SaleDetail.price_after_discount(self.unit_price, self.discount_type, self.discount_value)
+
+    @staticmethod
+    def price_after_discount(unit_price, discount_type, discount_value):
+        if discount_type == DiscountTypeEnum.PERCENTAGE:
+            return unit_price * (1 - discount_value/100)
+        elif discount_type == DiscountTypeEnum.FIXED_AMOUNT:
+            return max(unit_price - discount_value, Decimal('0'))
+        return unit_price
+
+    AMOUNT_FIELDS = ('quantity', 'unit_price', 'discount_type', 'discount_value')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.AMOUNT_FIELDS):
+            instance._loaded_amounts = instance.line_amounts()
+            instance._loaded_quantity = instance.quantity
+            instance._loaded_product_id = instance.product_id
+        return instance
+
+    @staticmethod
+    def amounts(quantity, unit_price, discount_type, discount_value):
+        """(subtotal, total) of a line, each rounded to cents.
+
+        This is the only rounding rule for sale money: stored sale totals,
+        update_total(), reconcile_sale_totals and the rollups all add up
+        these per-line amounts, never a rounded SQL sum. line_cents() is
+        the same rule as a SQL expression.
+        """
+        cents = Decimal('0.01')
+        final_price = SaleDetail.price_after_discount(unit_price, discount_type, discount_value)
+        return (unit_price * quantity).quantize(cents), (final_price * quantity).quantize(cents)
+
+    def line_amounts(self):
+        """Returns this line's (subtotal, total) contribution to its sale"""
+        return SaleDetail.amounts(self.quantity, self.unit_price, self.discount_type, self.discount_value)
+
+    @staticmethod
+    def line_cents():
+        """SQL (subtotal, total) of each line in integer cents, rounded like amounts().
+
+        Prices are read as whole cents so the arithmetic stays exact even
+        where the database stores decimals as floats.
+        """
+        cents = lambda field: Cast(Round(F(field) * 100), BigIntegerField())
+        price, quantity, discount = cents('unit_price'), F('quantity'), cents('discount_value')
+        subtotal = price * quantity
+        # cents * (1 - value / 100) with the value in hundredths, so the
+        # exact amount is this over 10000.
+        percentage = price * quantity * (Value(10000) - discount)
+        total = Case(
+            When(
+                discount_type=DiscountTypeEnum.PERCENTAGE,
+                then=Sign(percentage) * _divide_half_even(Abs(percentage), 10000),
+            ),
+            When(discount_type=DiscountTypeEnum.FIXED_AMOUNT, then=Greatest(price - discount, Value(0)) * quantity),
+            default=subtotal,
+            output_field=BigIntegerField(),
+        )
+        return subtotal, total
+
+    @classmethod
+    def totals_by_sale(cls, details):
+        """{sale_id: (subtotal, total)} of a SaleDetail queryset, in one aggregate query"""
+        subtotal, total = cls.line_cents()
+        rows = (
+            details.order_by().values('sale_id')
+            .annotate(subtotal_cents=Sum(subtotal), total_cents=Sum(total))
+            .values_list('sale_id', 'subtotal_cents', 'total_cents')
+        )
+        return {
+            sale_id: (Decimal(subtotal_cents).scaleb(-2), Decimal(total_cents).scaleb(-2))
+            for sale_id, subtotal_cents, total_cents in rows
+        }
 
     def clean(self):
         try:
@@ -382,23 +804,75 @@ class SaleDetail(models.Model):
 
         if is_new and self.product:
             self.sale_attributes = self.product.attributes.copy()
-
-        self.product.stock = F('stock') - self.quantity
-        self.product.save()
-
-        super().save(*args, **kwargs)
+            self.unit_cost = self.product.purchase_price
+            discount_engine.apply(self)
 
         if is_new:
-            out_type = MovementType.objects.get(code='OUT')
-            StockMovement.objects.create(
-                product       = self.product,
-                quantity      = self.quantity,
-                movement_type = out_type,
-                reason        = MovementReasonEnum.SALE,
-                sale          = self.sale,
-                created_by    = self.created_by
+            old_amounts, old_quantity, old_product_id = (Decimal('0'), Decimal('0')), 0, self.product_id
+        elif hasattr(self, '_loaded_amounts'):
+            old_amounts, old_quantity, old_product_id = (
+                self._loaded_amounts, self._loaded_quantity, self._loaded_product_id
+            )
+        else:
+            stored = SaleDetail.objects.get(pk=self.pk)
+            old_amounts, old_quantity, old_product_id = stored.line_amounts(), stored.quantity, stored.product_id
+        new_amounts = self.line_amounts()
+
+        # Stock, movements, unit_cost and sale_attributes all belong to the
+        # booked product; a different product is a new line.
+        if old_product_id != self.product_id:
+            raise ValidationError("No se puede cambiar el producto de una línea guardada; elimínela y agregue otra")
+
+        with transaction.atomic():
+            if not is_new and (self.quantity != old_quantity or new_amounts != old_amounts):
+                # Locked so a concurrent cancel_many cannot slip in between.
+                status_id = Sale.objects.select_for_update().filter(pk=self.sale_id).values_list(
+                    'status_id', flat=True
+                ).first()
+                if status_id != transaction_statuses.get('PENDING').pk:
+                    raise ValidationError("Solo se pueden modificar las líneas de una venta pendiente")
+            # Only the change in quantity moves stock; growing a line has to
+            # pass the same locked availability check as a new cart.
+            delta = self.quantity - old_quantity
+            if delta > 0:
+                locked = reserve_stock({self.product_id: delta}, allow_inactive=not is_new)
+                self.product.stock = locked[self.product_id].stock
+            elif delta < 0:
+                Product.objects.filter(pk=self.product_id).update(stock=F('stock') - delta)
+                self.product.stock -= delta
+
+            super().save(*args, **kwargs)
+
+            Sale.apply_total_delta(
+                self.sale_id,
+                new_amounts[0] - old_amounts[0],
+                new_amounts[1] - old_amounts[1],
             )
 
+            if rollups.counts_towards_rollups(self.sale):
+                day = rollups.sale_day(self.sale.date)
+                rollups.apply_deltas([
+                    rollups.line_delta(self, day, old_quantity, old_amounts, sign=-1),
+                    rollups.line_delta(self, day, amounts=new_amounts),
+                ])
+
+            if delta:
+                record_movements([self.stock_movement(delta)])
+        self._loaded_amounts = new_amounts
+        self._loaded_quantity = self.quantity
+        self._loaded_product_id = self.product_id
+
+    def stock_movement(self, delta):
+        """Unsaved movement for `delta` more (OUT) or fewer (IN) units sold"""
+        return StockMovement(
+            product_id    = self.product_id,
+            quantity      = abs(delta),
+            movement_type = movement_types.get('OUT' if delta > 0 else 'IN'),
+            reason        = MovementReasonEnum.SALE if delta > 0 else MovementReasonEnum.ADJUSTMENT,
+            sale_id       = self.sale_id,
+            created_by_id = self.created_by_id
+        )
+
     def __str__(self):
         return f"{self.product.name} - {self.quantity} units from {self.sale}"
 
@@ -430,7 +904,8 @@ class StockMovement(models.Model):
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)], help_text="Número de unidades movidas (debe ser ≥ 1)")
     reason = models.CharField(max_length=15, choices=MovementReasonEnum.choices, blank=True, null=True)
     movement_type = models.ForeignKey(MovementType, on_delete=models.PROTECT, related_name='stock_movements')
-    date = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: movements flushed from the journal keep their original time.
+    date = models.DateTimeField(default=timezone.now, editable=False)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements_created')
 
     purchase = models.ForeignKey(
@@ -471,6 +946,7 @@ class StockMovement(models.Model):
         indexes = [
             models.Index(fields=['date']),
             models.Index(fields=['movement_type']),
+            models.Index(fields=['product', 'date']),
         ]
         constraints = [
             models.CheckConstraint(
@@ -506,6 +982,93 @@ class StockMovement(models.Model):
     def __str__(self):
         return f"{self.movement_type} of {self.quantity} units of {self.product.name}"
 
+class StockMovementJournal(models.Model):
+    """Write-behind queue of StockMovement rows (see journal.py).
+
+    Same columns as StockMovement, without its secondary indexes, so
+    appending from a checkout is a narrow insert.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False, related_name='+')
+    quantity = models.PositiveIntegerField()
+    reason = models.CharField(max_length=15, choices=MovementReasonEnum.choices, blank=True, null=True)
+    movement_type = models.ForeignKey(MovementType, on_delete=models.PROTECT, db_index=False, related_name='+')
+    date = models.DateTimeField(default=timezone.now)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
+    purchase = models.ForeignKey('Purchase', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
+    sale = models.ForeignKey('Sale', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
+    purchase_return = models.ForeignKey('PurchaseReturn', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
+    sale_return = models.ForeignKey('SaleReturn', on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='+')
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} units pending since {self.date}"
+
+class ReorderLine(models.Model):
+    purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name='reorder_lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reorder_lines')
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    daily_velocity = models.DecimalField(max_digits=10, decimal_places=2, help_text="Unidades vendidas por día en la ventana analizada")
+    stock = models.IntegerField(help_text="Stock al generar la sugerencia")
+
+    def __str__(self):
+        return f"{self.product.name} - {self.quantity} units (sugerido)"
+
+class StockSnapshot(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_snapshots')
+    stock = models.IntegerField()
+    taken_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ['-taken_at']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'taken_at'], name='unique_product_snapshot')
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.stock} units at {self.taken_at}"
+
+class SalesRollup(models.Model):
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Total cobrado, con descuentos")
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Descuento otorgado")
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Unidades por precio de compra")
+
+    class Meta:
+        abstract = True
+        ordering = ['-day']
+
+    @property
+    def margin(self):
+        return self.revenue - self.cost
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta(SalesRollup.Meta):
+        verbose_name_plural = "daily product sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product_sales')
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} on {self.day}: {self.units} units"
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta(SalesRollup.Meta):
+        verbose_name_plural = "daily category sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_daily_category_sales')
+        ]
+
+    def __str__(self):
+        return f"{self.category_id} on {self.day}: {self.units} units"
+
 class PurchaseReturn(models.Model):
     purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
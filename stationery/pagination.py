@@ -0,0 +1,108 @@
+import base64
+import json
+from datetime import datetime
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from .utils.queries import RowCompare
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Seek pagination over a unique (field, 'id') ordering.
+
+    Pages are fetched with the row-value comparison
+    `WHERE (field, id) > (last field, last id)` instead of OFFSET, so page 500
+    costs the same index range seek as page 1. Both columns of the ordering
+    must run in the same direction. Cursors are opaque url-safe strings
+    carrying the boundary row's values.
+    """
+
+    def __init__(self, queryset, ordering, per_page=20):
+        self.queryset = queryset
+        self.field, self.tiebreak = ordering
+        self.descending = self.field.startswith('-')
+        if self.tiebreak.startswith('-') != self.descending:
+            raise ValueError("Keyset orderings must sort both columns the same way")
+        self.field_name = self.field.lstrip('-')
+        self.per_page = per_page
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.field_name)
+        if isinstance(value, datetime):
+            # DjangoJSONEncoder keeps milliseconds only, which would seek past
+            # rows sharing the boundary's millisecond.
+            value = value.isoformat()
+        values = [value, obj.pk]
+        return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        # Cursors come back from the query string, so anything that is not a
+        # well-formed boundary falls back to the first page.
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            return None
+        if type(pk) is not int or isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return None
+        if self.field_name.endswith('date'):
+            try:
+                value = parse_datetime(value) if isinstance(value, str) else None
+            except ValueError:
+                return None
+            if value is None:
+                return None
+        return value, pk
+
+    def seek(self, value, pk, forward):
+        greater = forward != self.descending
+        return RowCompare([self.field_name, self.tiebreak.lstrip('-')], '>' if greater else '<', [value, pk])
+
+    def ordering(self, forward):
+        if forward:
+            return (self.field, self.tiebreak)
+        flip = lambda name: name[1:] if name.startswith('-') else f'-{name}'
+        return (flip(self.field), flip(self.tiebreak))
+
+    def page(self, after=None, before=None):
+        forward = before is None
+        cursor = self.decode_cursor(after or before) if (after or before) else None
+        queryset = self.queryset
+        if cursor is not None:
+            queryset = queryset.filter(self.seek(*cursor, forward=forward))
+
+        rows = list(queryset.order_by(*self.ordering(forward))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return KeysetPage([])
+
+        if forward:
+            next_cursor = self.encode_cursor(rows[-1]) if has_more else None
+            previous_cursor = self.encode_cursor(rows[0]) if cursor is not None else None
+        else:
+            next_cursor = self.encode_cursor(rows[-1])
+            previous_cursor = self.encode_cursor(rows[0]) if has_more else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,87 @@
+import zlib
+
+
+A4 = (595, 842)
+# Helvetica advance widths (1/1000 em) for the characters invoices print;
+# anything else uses the average width.
+HELVETICA_WIDTHS = {
+    **dict.fromkeys('0123456789$', 556), ' ': 278, ',': 278, '.': 278, '-': 333, '%': 889,
+}
+AVERAGE_WIDTH = 556
+
+
+def text_width(text, size):
+    return sum(HELVETICA_WIDTHS.get(char, AVERAGE_WIDTH) for char in text) * size / 1000
+
+
+def _literal(text):
+    """PDF literal string in WinAnsiEncoding"""
+    escaped = []
+    for byte in text.encode('cp1252', errors='replace'):
+        char = chr(byte)
+        if char in '\\()':
+            escaped.append('\\' + char)
+        elif 32 <= byte < 127:
+            escaped.append(char)
+        else:
+            escaped.append(f'\\{byte:03o}')
+    return '(' + ''.join(escaped) + ')'
+
+
+class PDFDocument:
+    """Minimal text-only PDF writer (Helvetica, WinAnsi, Flate streams).
+
+    Enough for invoices and reports without a PDF dependency: text placed at
+    absolute positions, horizontal rules and automatic page objects.
+    """
+
+    def __init__(self, page_size=A4):
+        self.width, self.height = page_size
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append([])
+
+    def text(self, x, y, text, size=10, bold=False, align='left'):
+        if align == 'right':
+            x -= text_width(text, size)
+        font = 'F2' if bold else 'F1'
+        self.pages[-1].append(f'BT /{font} {size} Tf {x:.2f} {y:.2f} Td {_literal(text)} Tj ET')
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.pages[-1].append(f'{width} w {x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S')
+
+    def render(self):
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # page tree, filled in once the page ids are known
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        ]
+        page_ids = []
+        for operations in self.pages:
+            stream = zlib.compress('\n'.join(operations).encode('latin-1'))
+            objects.append(
+                b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream'
+            )
+            content_id = len(objects)
+            objects.append((
+                f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.width} {self.height}] '
+                f'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>'
+            ).encode())
+            page_ids.append(len(objects))
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        objects[1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode()
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(output)
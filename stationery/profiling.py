@@ -0,0 +1,253 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the view latency histogram; the last bucket is open.
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Requests kept per URL name; older samples fall out of the statistics.
+WINDOW = 500
+# Seconds between copies of this process's samples to the profiling cache.
+PUBLISH_INTERVAL = 10
+PROCESSES_KEY = 'profiling:processes'
+UNRESOLVED = '<unresolved>'
+
+Sample = namedtuple('Sample', ['queries', 'db_ms', 'view_ms', 'duplicates', 'top_duplicates'])
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """SQL with literals and IN lists collapsed, so N+1 lookups share one key"""
+    return _LITERAL.sub('?', _IN_LIST.sub('(...)', sql))
+
+
+class QueryProfiler:
+    """execute_wrapper counting and timing every query of a request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def db_ms(self):
+        return self.duration * 1000
+
+    def duplicates(self):
+        """{fingerprint: executions} for queries run more than once"""
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+@contextmanager
+def profile_queries():
+    profiler = QueryProfiler()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profiler))
+        yield profiler
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def histogram(values):
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for value in values:
+        counts[next((i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound), len(LATENCY_BUCKETS))] += 1
+    return counts
+
+
+def summarize(samples):
+    """Aggregates a list of samples of one URL name"""
+    duplicates = Counter()
+    for sample in samples:
+        duplicates.update(dict(sample.top_duplicates))
+    view_ms = [sample.view_ms for sample in samples]
+    return {
+        'requests': len(samples),
+        'queries_avg': sum(sample.queries for sample in samples) / len(samples),
+        'queries_max': max(sample.queries for sample in samples),
+        'db_ms_avg': sum(sample.db_ms for sample in samples) / len(samples),
+        'view_ms_p50': percentile(view_ms, 0.5),
+        'view_ms_p95': percentile(view_ms, 0.95),
+        'view_ms_max': max(view_ms),
+        'duplicates_avg': sum(sample.duplicates for sample in samples) / len(samples),
+        'histogram': histogram(view_ms),
+        'top_duplicates': duplicates.most_common(3),
+    }
+
+
+class RollingStats:
+    """Last WINDOW samples per URL name, shared by the threads of a process"""
+
+    def __init__(self, window=WINDOW):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._published = 0.0
+
+    def record(self, name, sample):
+        with self._lock:
+            self._samples[name].append(sample)
+
+    def export(self):
+        with self._lock:
+            return {name: [tuple(sample) for sample in samples] for name, samples in self._samples.items()}
+
+    def summary(self):
+        return {name: summarize([Sample(*row) for row in rows]) for name, rows in self.export().items()}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def publish_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._published < PUBLISH_INTERVAL:
+                return False
+            self._published = now
+        return True
+
+
+stats = RollingStats()
+
+
+def profiling_cache():
+    return caches['profiling']
+
+
+def _process_key(pid):
+    return f'profiling:process:{pid}'
+
+
+def publish():
+    """Copies this process's samples to the profiling cache for profile_report"""
+    cache = profiling_cache()
+    pid = os.getpid()
+    cache.set(_process_key(pid), stats.export())
+    processes = set(cache.get(PROCESSES_KEY, ()))
+    if pid not in processes:
+        cache.set(PROCESSES_KEY, sorted(processes | {pid}))
+
+
+def collect():
+    """Samples published by every process, merged per URL name"""
+    cache = profiling_cache()
+    pids = cache.get(PROCESSES_KEY, [])
+    published = cache.get_many([_process_key(pid) for pid in pids])
+    merged = defaultdict(list)
+    for rows_by_name in published.values():
+        for name, rows in rows_by_name.items():
+            merged[name].extend(Sample(*row) for row in rows)
+    return {name: summarize(samples) for name, samples in merged.items()}
+
+
+def clear_published():
+    cache = profiling_cache()
+    cache.delete_many([_process_key(pid) for pid in cache.get(PROCESSES_KEY, [])] + [PROCESSES_KEY])
+
+
+def budget_for(name, method='GET'):
+    """QUERY_BUDGETS entry for a URL name and method.
+
+    Falls back to the entry of the bare URL name, then to the '*' entry.
+    """
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    for key in ((name, method), name, '*'):
+        if key in budgets:
+            return budgets[key]
+    return None
+
+
+def budget_violations(name, sample, method='GET'):
+    budget = budget_for(name, method) or {}
+    return [
+        f"{field}={getattr(sample, field):.0f} > {limit}"
+        for field, limit in budget.items()
+        if getattr(sample, field) > limit
+    ]
+
+
+def url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else UNRESOLVED
+
+
+class QueryProfilingMiddleware:
+    """Records queries, DB time, duplicate queries and view time per URL name.
+
+    Samples go to the in-process RollingStats and are published periodically
+    for the profile_report command. With DEBUG the numbers are also sent as
+    X-DB-Queries and Server-Timing headers. Requests over their QUERY_BUDGETS
+    entry are logged, or raise QueryBudgetExceeded when QUERY_BUDGET_STRICT is
+    set, which fails the test that made them. Queries run while a streaming
+    response is consumed are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_PROFILING', False):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with profile_queries() as profiler:
+            response = self.get_response(request)
+        view_ms = (time.perf_counter() - start) * 1000
+
+        duplicates = profiler.duplicates()
+        top_duplicates = Counter(duplicates).most_common(3)
+        sample = Sample(
+            queries=profiler.queries,
+            db_ms=round(profiler.db_ms, 3),
+            view_ms=round(view_ms, 3),
+            duplicates=sum(count - 1 for count in duplicates.values()),
+            top_duplicates=top_duplicates,
+        )
+        name = url_name(request)
+        stats.record(name, sample)
+        if stats.publish_due():
+            publish()
+
+        if settings.DEBUG:
+            response['X-DB-Queries'] = f"{sample.queries} ({sample.duplicates} duplicadas)"
+            response['Server-Timing'] = f'db;dur={sample.db_ms:.1f};desc="{sample.queries} queries", view;dur={sample.view_ms:.1f}'
+
+        violations = budget_violations(name, sample, request.method)
+        if violations:
+            message = f"{name} ({request.method}) excedió su presupuesto: {', '.join(violations)}"
+            if top_duplicates:
+                message += f"; consulta más repetida ({top_duplicates[0][1]}x): {top_duplicates[0][0]}"
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,105 @@
+import math
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .lookups import transaction_statuses
+from .models import BELOW_MINIMUM_STOCK, Product, Purchase, ReorderLine
+from .rollups import units_per_day
+
+
+Suggestion = namedtuple('Suggestion', ['product', 'supplier_id', 'quantity', 'daily_velocity', 'on_order'])
+
+DRAFT_STATUS = 'DRAFT'
+# Purchases whose reorder lines are ordered but not yet in stock.
+OPEN_STATUSES = (DRAFT_STATUS, 'PENDING')
+
+
+def low_stock_products():
+    """Active products below their minimum stock, served by the partial index"""
+    return Product.objects.filter(BELOW_MINIMUM_STOCK, active=True)
+
+
+def suggest(days=30, cover_days=14):
+    """Builds one suggestion per product below minimum stock.
+
+    The suggested quantity refills the product up to its minimum plus
+    `cover_days` of recent demand, minus what open reorder drafts already
+    ask for; products those drafts fully cover are left out, so repeated
+    runs do not order the same shortfall twice. Each product is assigned to
+    its first supplier; products without suppliers get supplier_id None.
+
+    Velocity is read from the DailyProductSales rollups rather than summed
+    from StockMovement: the rollups hold the same units sold (OUT movements
+    with reason SALE), net of later line edits, without cancelled sales,
+    and without purchases or inventory adjustments, at one row per product
+    and day instead of one per movement. Movements still waiting in the
+    write-behind journal are counted as well.
+    """
+    products = list(low_stock_products().only('id', 'name', 'stock', 'minimum_stock', 'purchase_price'))
+    product_ids = [product.pk for product in products]
+    velocity = units_per_day(product_ids, days)
+    on_order = dict(
+        ReorderLine.objects.filter(product_id__in=product_ids, purchase__status__code__in=OPEN_STATUSES)
+        .values_list('product_id')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+
+    suppliers = {}
+    for product_id, supplier_id in (
+        Product.suppliers.through.objects.filter(product_id__in=product_ids)
+        .order_by('product_id', 'supplier_id')
+        .values_list('product_id', 'supplier_id')
+    ):
+        suppliers.setdefault(product_id, supplier_id)
+
+    suggestions = []
+    for product in products:
+        daily = velocity.get(product.pk, Decimal('0'))
+        target = product.minimum_stock + daily * cover_days
+        ordered = on_order.get(product.pk, 0)
+        quantity = max(math.ceil(target - product.stock), 1) - ordered
+        if quantity <= 0:
+            continue
+        suggestions.append(
+            Suggestion(product, suppliers.get(product.pk), quantity, daily.quantize(Decimal('0.01')), ordered)
+        )
+    return suggestions
+
+
+def create_purchase_drafts(suggestions, created_by=None):
+    """Creates one DRAFT Purchase per supplier holding its ReorderLine rows.
+
+    Drafts carry no PurchaseDetail rows, so no stock is booked until the
+    delivery is received.
+    """
+    by_supplier = defaultdict(list)
+    for suggestion in suggestions:
+        if suggestion.supplier_id is not None:
+            by_supplier[suggestion.supplier_id].append(suggestion)
+    if not by_supplier:
+        return []
+
+    draft = transaction_statuses.get(DRAFT_STATUS)
+    notes = f"Borrador de reposición generado el {timezone.now():%d-%m-%Y %H:%M}"
+    with transaction.atomic():
+        purchases = Purchase.objects.bulk_create([
+            Purchase(supplier_id=supplier_id, status=draft, notes=notes, created_by=created_by)
+            for supplier_id in by_supplier
+        ])
+        ReorderLine.objects.bulk_create([
+            ReorderLine(
+                purchase       = purchase,
+                product        = suggestion.product,
+                quantity       = suggestion.quantity,
+                unit_price     = suggestion.product.purchase_price,
+                daily_velocity = suggestion.daily_velocity,
+                stock          = suggestion.product.stock,
+            )
+            for purchase, lines in zip(purchases, by_supplier.values())
+            for suggestion in lines
+        ])
+    return purchases
@@ -0,0 +1,67 @@
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Case, F, When
+from django.db.transaction import TransactionManagementError
+
+
+class InsufficientStock(ValidationError):
+    """Raised when a cart asks for more units than are on hand.
+
+    `shortfalls` maps product_id to (available, requested).
+    """
+
+    def __init__(self, messages, shortfalls):
+        super().__init__(messages)
+        self.shortfalls = shortfalls
+
+
+def reserve_stock(quantities, allow_inactive=False):
+    """Locks the products of a cart and takes `quantities` from their stock.
+
+    `quantities` maps product_id to units. Must run inside a transaction:
+    rows are locked with SELECT ... FOR UPDATE in primary key order, so two
+    carts sharing products always queue in the same order and cannot
+    deadlock. Availability is checked on the locked rows, then every product
+    is decremented with one UPDATE. Returns {product_id: Product} with the
+    stock left after the reservation.
+    """
+    if not connection.in_atomic_block:
+        raise TransactionManagementError("reserve_stock() must run inside transaction.atomic()")
+    if not quantities:
+        return {}
+
+    Product = apps.get_model('stationery', 'Product')
+    products = {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=sorted(quantities)).order_by('pk')
+    }
+
+    errors = []
+    shortfalls = {}
+    for product_id, quantity in sorted(quantities.items()):
+        product = products.get(product_id)
+        if product is None:
+            errors.append(f"Producto {product_id} no existe")
+        elif not product.active and not allow_inactive:
+            errors.append(f"No se puede vender un producto inactivo: {product.name}")
+        elif not product.check_stock(quantity):
+            shortfalls[product_id] = (product.stock, quantity)
+            errors.append(
+                f"Stock insuficiente para {product.name}: "
+                f"disponible {product.stock}, solicitado {quantity}"
+            )
+    if shortfalls:
+        raise InsufficientStock(errors, shortfalls)
+    if errors:
+        raise ValidationError(errors)
+
+    Product.objects.filter(pk__in=list(quantities)).update(
+        stock=Case(*[
+            When(pk=product_id, then=F('stock') - quantity)
+            for product_id, quantity in quantities.items()
+        ])
+    )
+    for product_id, quantity in quantities.items():
+        products[product_id].stock -= quantity
+    return products
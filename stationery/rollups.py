@@ -0,0 +1,205 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .lookups import transaction_statuses
+
+
+VALUE_FIELDS = ('units', 'revenue', 'discount', 'cost')
+# Rows per INSERT, keeps the bound parameters under SQLite's limit.
+UPSERT_BATCH = 100
+
+
+def sale_day(date):
+    return timezone.localtime(date).date() if timezone.is_aware(date) else date.date()
+
+
+def counts_towards_rollups(sale):
+    """Cancelled sales are kept as history but never counted as demand"""
+    try:
+        cancelled = transaction_statuses.get('CANCELLED')
+    except transaction_statuses.model.DoesNotExist:
+        return True
+    return sale.status_id != cancelled.pk
+
+
+def line_delta(detail, day, quantity=None, amounts=None, sign=1):
+    """(day, product_id, category_id, units, revenue, discount, cost) for a line.
+
+    `quantity` and `amounts` default to the line's current values; pass the
+    loaded ones to describe what the line contributed before an edit.
+    """
+    quantity = detail.quantity if quantity is None else quantity
+    subtotal, total = detail.line_amounts() if amounts is None else amounts
+    return (
+        day,
+        detail.product_id,
+        detail.product.category_id,
+        sign * quantity,
+        sign * total,
+        sign * (subtotal - total),
+        sign * (detail.unit_cost * quantity),
+    )
+
+
+def _increment(model, key_fields, rows):
+    """Adds `rows` to the stored aggregates with INSERT ... ON CONFLICT DO UPDATE.
+
+    Keeps concurrent tills from racing on read-modify-write; both SQLite and
+    PostgreSQL accept the same statement.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    key_columns = [model._meta.get_field(name).column for name in key_fields]
+    value_columns = [model._meta.get_field(name).column for name in VALUE_FIELDS]
+    columns = ', '.join(qn(column) for column in key_columns + value_columns)
+    updates = ', '.join(f'{qn(c)} = {table}.{qn(c)} + excluded.{qn(c)}' for c in value_columns)
+    row_sql = '(' + ', '.join(['%s'] * (len(key_columns) + len(value_columns))) + ')'
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[start:start + UPSERT_BATCH]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {", ".join([row_sql] * len(batch))} '
+                f'ON CONFLICT ({", ".join(qn(c) for c in key_columns)}) DO UPDATE SET {updates}',
+                [value for row in batch for value in row],
+            )
+
+
+def apply_deltas(deltas):
+    """Folds line deltas into the daily product and category tables.
+
+    `deltas` are tuples built by line_delta(); they are summed per key first,
+    so a whole cart costs two statements. Returns the number of product rows
+    touched.
+    """
+    by_product = defaultdict(lambda: [0, Decimal('0'), Decimal('0'), Decimal('0')])
+    by_category = defaultdict(lambda: [0, Decimal('0'), Decimal('0'), Decimal('0')])
+    for day, product_id, category_id, *values in deltas:
+        for totals in (by_product[(day, product_id)], by_category[(day, category_id)]):
+            for index, value in enumerate(values):
+                totals[index] += value
+
+    product_rows = [key + tuple(values) for key, values in by_product.items() if any(values)]
+    category_rows = [key + tuple(values) for key, values in by_category.items() if any(values)]
+    if product_rows:
+        _increment(apps.get_model('stationery', 'DailyProductSales'), ('day', 'product'), product_rows)
+    if category_rows:
+        _increment(apps.get_model('stationery', 'DailyCategorySales'), ('day', 'category'), category_rows)
+    return len(product_rows)
+
+
+def sale_deltas(sale_ids, sign=1):
+    """Line deltas of whole sales (ids or a pk queryset).
+
+    Amounts come from SaleDetail.amounts() line by line, so they round
+    exactly like the deltas post_lines() and SaleDetail.save() applied.
+    """
+    SaleDetail = apps.get_model('stationery', 'SaleDetail')
+    rows = (
+        SaleDetail.objects.filter(sale_id__in=sale_ids)
+        .values_list('sale__date', 'product_id', 'product__category_id', 'unit_cost',
+                     *SaleDetail.AMOUNT_FIELDS)
+        .order_by()
+        .iterator(chunk_size=5000)
+    )
+    deltas = []
+    for date, product_id, category_id, unit_cost, quantity, *pricing in rows:
+        subtotal, total = SaleDetail.amounts(quantity, *pricing)
+        deltas.append((
+            sale_day(date), product_id, category_id,
+            sign * quantity,
+            sign * total,
+            sign * (subtotal - total),
+            sign * (unit_cost * quantity),
+        ))
+    return deltas
+
+
+def rebuild(since=None, until=None):
+    """Recomputes the daily tables from SaleDetail for [since, until].
+
+    Both paths value cost at the unit_cost stored on each line when it was
+    booked, so a rebuild matches the incremental totals. Returns the number
+    of product rows.
+    """
+    Sale = apps.get_model('stationery', 'Sale')
+    DailyProductSales = apps.get_model('stationery', 'DailyProductSales')
+    DailyCategorySales = apps.get_model('stationery', 'DailyCategorySales')
+
+    sales = Sale.objects.annotate(day=TruncDate('date'))
+    days = {}
+    if since is not None:
+        days['day__gte'] = since
+    if until is not None:
+        days['day__lte'] = until
+    sales = sales.filter(**days)
+    try:
+        sales = sales.exclude(status=transaction_statuses.get('CANCELLED'))
+    except transaction_statuses.model.DoesNotExist:
+        pass
+
+    with transaction.atomic():
+        DailyProductSales.objects.filter(**days).delete()
+        DailyCategorySales.objects.filter(**days).delete()
+        rows = apply_deltas(sale_deltas(sales.values('pk')))
+    return rows
+
+
+def _window(start, end):
+    return {'day__gte': start, 'day__lte': end}
+
+
+def product_totals(start, end, category_id=None):
+    """Units, revenue, discount, cost and margin per product for [start, end]"""
+    DailyProductSales = apps.get_model('stationery', 'DailyProductSales')
+    rows = DailyProductSales.objects.filter(**_window(start, end))
+    if category_id is not None:
+        rows = rows.filter(product__category_id=category_id)
+    return (
+        rows.values('product_id', 'product__name')
+        .annotate(**{field: Sum(field) for field in VALUE_FIELDS})
+        .annotate(margin=F('revenue') - F('cost'))
+        .order_by()
+    )
+
+
+def top_sellers(start, end, limit=10, by='units', category_id=None):
+    if by not in VALUE_FIELDS + ('margin',):
+        raise ValueError(f"Unknown rollup measure: {by}")
+    return list(product_totals(start, end, category_id).order_by(f'-{by}', 'product_id')[:limit])
+
+
+def daily_series(start, end, product_id=None, category_id=None):
+    """Per-day totals for [start, end], for a product, a category or the shop"""
+    if product_id is not None:
+        rows = apps.get_model('stationery', 'DailyProductSales').objects.filter(product_id=product_id)
+    else:
+        rows = apps.get_model('stationery', 'DailyCategorySales').objects.all()
+        if category_id is not None:
+            rows = rows.filter(category_id=category_id)
+    return list(
+        rows.filter(**_window(start, end))
+        .values('day')
+        .annotate(**{field: Sum(field) for field in VALUE_FIELDS})
+        .annotate(margin=F('revenue') - F('cost'))
+        .order_by('day')
+    )
+
+
+def units_per_day(product_ids, days=30):
+    """Average units sold per day over the last `days` days, by product"""
+    end = timezone.localdate()
+    rows = (
+        apps.get_model('stationery', 'DailyProductSales').objects
+        .filter(product_id__in=list(product_ids), **_window(end - timedelta(days=days - 1), end))
+        .values_list('product_id')
+        .annotate(units=Sum('units'))
+        .order_by()
+    )
+    return {product_id: Decimal(units) / days for product_id, units in rows}
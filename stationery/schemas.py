@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+
+_validators = {}
+_category_validators = {}
+_lock = threading.Lock()
+
+
+def schema_hash(schema):
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+def compiled_validator(schema):
+    """Returns a jsonschema validator for `schema`, built once per distinct schema.
+
+    The metaschema check runs only when a schema is first seen.
+    """
+    key = schema_hash(schema)
+    validator = _validators.get(key)
+    if validator is None:
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        with _lock:
+            validator = _validators.setdefault(key, cls(schema))
+    return validator
+
+
+def category_validator(category):
+    """Returns the compiled validator for a Category's product_schema.
+
+    Cached by (category id, schema hash); the hash is computed once per
+    Category instance, and the post_save receiver drops the entry when a
+    category changes.
+    """
+    digest = getattr(category, '_schema_hash', None)
+    if digest is None:
+        digest = category._schema_hash = schema_hash(category.product_schema)
+    key = (category.pk, digest)
+    validator = _category_validators.get(key)
+    if validator is None:
+        validator = compiled_validator(category.product_schema)
+        if category.pk is not None:
+            with _lock:
+                _category_validators[key] = validator
+    return validator
+
+
+def validation_error(category, attributes):
+    """Returns the most relevant schema error for `attributes`, or None"""
+    return best_match(category_validator(category).iter_errors(attributes))
+
+
+def invalidate_category(category_id):
+    with _lock:
+        for key in [key for key in _category_validators if key[0] == category_id]:
+            del _category_validators[key]
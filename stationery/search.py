@@ -0,0 +1,159 @@
+import json
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.db import connection
+from django.db.models import Case, CharField, F, FloatField, Func, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Concat
+
+from .models import Product
+
+
+# Shadow table used on SQLite; PostgreSQL keeps Product.search_vector instead.
+FTS_TABLE = 'stationery_product_fts'
+FTS_COLUMNS = ('name', 'taxonomy', 'description', 'attributes')
+# bm25 weight per FTS column, mirroring the A-D weights used on PostgreSQL.
+FTS_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+SEARCH_CONFIG = 'spanish'
+REINDEX_CHUNK = 500
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def attribute_text(attributes):
+    if not isinstance(attributes, dict):
+        return ''
+    return ' '.join(str(value) for value in attributes.values() if isinstance(value, (str, int, float)))
+
+
+def documents(product_ids):
+    """Yields (pk, name, brand and category, description, attribute values)"""
+    rows = Product.objects.filter(pk__in=product_ids).values_list(
+        'pk', 'name', 'brand__name', 'category__name', 'description', 'attributes'
+    )
+    for pk, name, brand, category, description, attributes in rows:
+        taxonomy = ' '.join(value for value in (brand, category) if value)
+        yield pk, name, taxonomy, description or '', attribute_text(attributes)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), REINDEX_CHUNK):
+        yield ids[start:start + REINDEX_CHUNK]
+
+
+def reindex(product_ids=None):
+    """Rebuilds the search document of `product_ids` (all products when None)"""
+    if product_ids is None:
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        product_ids = Product.objects.values_list('pk', flat=True).order_by('pk')
+    for ids in _chunks(product_ids):
+        docs = list(documents(ids))
+        if connection.vendor == 'postgresql':
+            _update_vectors(docs)
+        elif connection.vendor == 'sqlite':
+            _replace_fts_rows(ids, docs)
+
+
+def remove(product_ids):
+    if connection.vendor == 'sqlite':
+        for ids in _chunks(product_ids):
+            _delete_fts_rows(ids)
+
+
+def _update_vectors(docs):
+    if not docs:
+        return
+    vectors = [
+        When(pk=pk, then=(
+            SearchVector(Value(name), weight='A', config=SEARCH_CONFIG)
+            + SearchVector(Value(taxonomy), weight='B', config=SEARCH_CONFIG)
+            + SearchVector(Value(description), weight='C', config=SEARCH_CONFIG)
+            + SearchVector(Value(attributes), weight='D', config=SEARCH_CONFIG)
+        ))
+        for pk, name, taxonomy, description, attributes in docs
+    ]
+    Product.objects.filter(pk__in=[doc[0] for doc in docs]).update(
+        search_vector=Case(*vectors, output_field=SearchVectorField())
+    )
+
+
+def _delete_fts_rows(ids):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(ids))})', list(ids))
+
+
+def _replace_fts_rows(ids, docs):
+    _delete_fts_rows(ids)
+    if not docs:
+        return
+    row_sql = '(' + ', '.join(['%s'] * (len(FTS_COLUMNS) + 1)) + ')'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FTS_COLUMNS)}) VALUES {", ".join([row_sql] * len(docs))}',
+            [value for doc in docs for value in doc],
+        )
+
+
+def _fts_scores(words, queryset=None, limit=None):
+    """{pk: score} of the matching products, restricted to `queryset` in the same query"""
+    match = ' '.join(f'"{word}"*' for word in words)
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    sql = f'SELECT rowid, -bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    params = [match]
+    if queryset is not None:
+        ids_sql, ids_params = queryset.order_by().values('pk').query.sql_with_params()
+        sql += f' AND rowid IN ({ids_sql})'
+        params += ids_params
+    sql += ' ORDER BY score DESC'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return dict(cursor.fetchall())
+
+
+def search_products(query, queryset=None, limit=None):
+    """Narrows `queryset` to products matching every word of `query`.
+
+    Each word also matches as a prefix, for typeahead. The result is
+    annotated with `rank` (higher is better) and ordered by it. On SQLite
+    the filters of `queryset` are applied inside the index query, and only
+    the best `limit` matches are kept when a limit is given.
+    """
+    restrict_to = queryset
+    queryset = Product.objects.all() if queryset is None else queryset
+    words = search_terms(query)
+    if not words:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+    if connection.vendor == 'postgresql':
+        tsquery = SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+        return (
+            queryset.filter(search_vector=tsquery)
+            .annotate(rank=SearchRank(F('search_vector'), tsquery))
+            .order_by('-rank', '-pk')
+        )
+
+    if connection.vendor == 'sqlite':
+        scores = _fts_scores(words, restrict_to, limit)
+        # Scores travel as one JSON parameter, however many products match.
+        scores_json = json.dumps({str(pk): score for pk, score in scores.items()})
+        return (
+            queryset.filter(pk__in=RawSQL('SELECT CAST(key AS INTEGER) FROM json_each(%s)', [scores_json]))
+            .annotate(rank=Func(
+                Value(scores_json), Concat(Value('$."'), Cast('pk', CharField()), Value('"')),
+                function='json_extract', output_field=FloatField(),
+            ))
+            .order_by('-rank', '-pk')
+        )
+
+    condition = Q()
+    for word in words:
+        condition &= Q(name__icontains=word) | Q(description__icontains=word)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,171 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import caching, rollups, search
+from .discounts import record_pricing_change
+from .journal import record_movements
+from .lookups import REGISTRIES, transaction_statuses
+from .schemas import invalidate_category
+from .utils.enums import MovementReasonEnum
+from .models import Discount, Product, Purchase, PurchaseDetail, Sale, SaleDetail, reverse_stock
+
+
+def invalidate_lookup_registry(sender, **kwargs):
+    REGISTRIES[sender._meta.label].invalidate()
+
+
+for model_label in REGISTRIES:
+    post_save.connect(invalidate_lookup_registry, sender=model_label)
+    post_delete.connect(invalidate_lookup_registry, sender=model_label)
+
+
+@receiver([post_save, post_delete], sender='stationery.Category')
+def invalidate_category_validator(sender, instance, **kwargs):
+    instance.__dict__.pop('_schema_hash', None)
+    invalidate_category(instance.pk)
+
+
+def _deleting(model, origin):
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
+def _sale_deleted_in_bulk(instance, origin):
+    """Whether `instance`'s sale already settled its lines in reverse_sale_stock()"""
+    return instance.sale_id in getattr(origin, '_deleted_sale_ids', ())
+
+
+@receiver(pre_delete, sender=Sale)
+def reverse_sale_stock(sender, instance, origin=None, **kwargs):
+    """Gives back the stock and rollups of a deleted sale's lines at once.
+
+    Runs before the cascade deletes the lines, with set-based statements,
+    and records the sale on `origin` so the per-line receivers below skip
+    its lines instead of reading the sale and writing once per line.
+    """
+    if origin is None:
+        return
+    if not hasattr(origin, '_deleted_sale_ids'):
+        origin._deleted_sale_ids = set()
+    origin._deleted_sale_ids.add(instance.pk)
+    if not rollups.counts_towards_rollups(instance):
+        # Cancelled sales gave their stock back already.
+        return
+    detail_rows = [
+        # The sale is going away, so its movements are written without it.
+        (None, product_id, quantity)
+        for product_id, quantity in SaleDetail.objects.filter(sale_id=instance.pk)
+        .values_list('product_id').annotate(quantity=Sum('quantity')).order_by()
+    ]
+    reverse_stock(detail_rows, 'sale', 1, MovementReasonEnum.ADJUSTMENT, instance.created_by)
+    rollups.apply_deltas(rollups.sale_deltas([instance.pk], sign=-1))
+
+
+@receiver(post_delete, sender=SaleDetail)
+def subtract_sale_detail_total(sender, instance, origin=None, **kwargs):
+    if _sale_deleted_in_bulk(instance, origin):
+        return
+    subtotal, total = getattr(instance, '_loaded_amounts', None) or instance.line_amounts()
+    Sale.apply_total_delta(instance.sale_id, -subtotal, -total)
+
+
+@receiver(post_delete, sender=SaleDetail)
+def subtract_sale_detail_rollups(sender, instance, origin=None, **kwargs):
+    if _sale_deleted_in_bulk(instance, origin):
+        return
+    sale = Sale.objects.filter(pk=instance.sale_id).only('date', 'status').first()
+    if sale is None or not rollups.counts_towards_rollups(sale):
+        return
+    quantity = getattr(instance, '_loaded_quantity', instance.quantity)
+    rollups.apply_deltas([
+        rollups.line_delta(instance, rollups.sale_day(sale.date), quantity, getattr(instance, '_loaded_amounts', None), sign=-1)
+    ])
+
+
+@receiver(post_delete, sender=SaleDetail)
+def return_sale_detail_stock(sender, instance, origin=None, **kwargs):
+    # A deleted product takes its movements with it.
+    if _deleting(Product, origin) or _sale_deleted_in_bulk(instance, origin):
+        return
+    sale = Sale.objects.filter(pk=instance.sale_id).only('status').first()
+    if sale is None or not rollups.counts_towards_rollups(sale):
+        # Cancelled sales gave their stock back already.
+        return
+    quantity = getattr(instance, '_loaded_quantity', instance.quantity)
+    Product.objects.filter(pk=instance.product_id).update(stock=F('stock') + quantity)
+    record_movements([instance.stock_movement(-quantity)])
+
+
+@receiver(post_delete, sender=PurchaseDetail)
+def take_back_purchase_detail_stock(sender, instance, origin=None, **kwargs):
+    if _deleting(Product, origin):
+        return
+    purchase = Purchase.objects.filter(pk=instance.purchase_id).only('status').first()
+    if purchase is None or purchase.status_id == transaction_statuses.get('CANCELLED').pk:
+        # Cancelled purchases took their stock out already.
+        return
+    quantity = getattr(instance, '_loaded_quantity', instance.quantity)
+    if quantity > 0:
+        purchase_id = None if _deleting(Purchase, origin) else instance.purchase_id
+        reverse_stock([(purchase_id, instance.product_id, quantity)], 'purchase', -1, MovementReasonEnum.ADJUSTMENT)
+
+
+@receiver([post_save, post_delete], sender='stationery.Product')
+def invalidate_product_pages(sender, instance, **kwargs):
+    product_id = instance.pk
+
+    def bump():
+        caching.bump_version(caching.product_version_name(product_id))
+        caching.bump_version(caching.CATALOG)
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender='stationery.Category')
+@receiver([post_save, post_delete], sender='stationery.Brand')
+def invalidate_catalog_pages(sender, **kwargs):
+    transaction.on_commit(lambda: caching.bump_version(caching.CATALOG))
+
+
+# The discount engine of every process catches up when PRICING moves,
+# refetching only the discounts recorded with each version.
+@receiver([post_save, post_delete], sender=Discount)
+def invalidate_discount(sender, instance, **kwargs):
+    discount_id = instance.pk
+    transaction.on_commit(lambda: record_pricing_change([discount_id]))
+
+
+@receiver(m2m_changed, sender=Discount.products.through)
+@receiver(m2m_changed, sender=Discount.categories.through)
+def invalidate_discount_targets(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    # From the product or category side pk_set holds discounts; a clear lists none.
+    discount_ids = (None if pk_set is None else list(pk_set)) if reverse else [instance.pk]
+    transaction.on_commit(lambda: record_pricing_change(discount_ids))
+
+
+@receiver([post_save, post_delete], sender='stationery.DiscountType')
+@receiver([post_save, post_delete], sender='stationery.ScopeType')
+def invalidate_pricing(sender, **kwargs):
+    transaction.on_commit(record_pricing_change)
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: search.reindex([product_id]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: search.remove([product_id]))
+
+
+@receiver(post_save, sender='stationery.Brand')
+@receiver(post_save, sender='stationery.Category')
+def reindex_related_products(sender, instance, **kwargs):
+    field = 'brand' if sender._meta.model_name == 'brand' else 'category'
+    product_ids = Product.objects.filter(**{field: instance.pk}).values_list('pk', flat=True)
+    transaction.on_commit(lambda: search.reindex(list(product_ids)))
@@ -1,3 +1,1470 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.db import connection, transaction
+from django.db.models.fields.files import FieldFile
+from django.template.response import TemplateResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.views.generic import TemplateView
 
-# Create your tests here.
+from . import autocomplete, caching, discounts, invoicing, journal, rollups, schemas, search
+from .caching import CachedPageMixin, VersionCache
+from .dashboard import compute_kpis
+from .datagen import FixtureGenerator
+from .discounts import DiscountEngine, discount_engine
+from .inventory import ledger_deltas, stock_as_of, take_snapshot
+from .pagination import KeysetPaginator
+from .lookups import REGISTRIES, movement_types, transaction_statuses
+from .invoicing import iter_invoice_pdfs
+from .profiling import QueryBudgetExceeded, fingerprint
+from .reorder import DRAFT_STATUS, suggest
+from .reservations import InsufficientStock, reserve_stock
+
+from .models import (
+    Category, Product, Supplier, Company, Brand, Customer,
+    Sale, SaleDetail, Discount, DiscountType, ScopeType,
+    PaymentMethod, TransactionStatus, MovementType,
+    DailyProductSales, DailyCategorySales, StockMovement, StockSnapshot,
+    Purchase, PurchaseDetail, PurchaseInvoice, ReorderLine, SaleInvoice
+)
+from .utils.enums import DiscountTypeEnum, MovementReasonEnum
+
+
+def setUpModule():
+    # The file caches under BASE_DIR/.cache are shared with a running dev
+    # server, so each test process gets its own counters and samples.
+    location = tempfile.mkdtemp(prefix='stationery-versions-')
+    isolated = override_settings(CACHES={
+        **settings.CACHES,
+        **{
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'tests-{alias}'}
+            for alias in ('invoices', 'profiling', 'storefront')
+        },
+        'versions': {'BACKEND': 'stationery.caching.VersionCache', 'LOCATION': location, 'TIMEOUT': None},
+    })
+    isolated.enable()
+    unittest.addModuleCleanup(shutil.rmtree, location, ignore_errors=True)
+    unittest.addModuleCleanup(isolated.disable)
+
+
+def create_catalog(products=5):
+    for code in ('IN', 'OUT', 'ADJ'):
+        MovementType.objects.get_or_create(code=code, defaults={'label': code})
+    for code in ('PENDING', 'PAID', 'CANCELLED', 'RECEIVED'):
+        TransactionStatus.objects.get_or_create(code=code, defaults={'label': code})
+    PaymentMethod.objects.get_or_create(code='CA', defaults={'name': 'Efectivo'})
+    category = Category.objects.create(name='Escritura')
+    return [
+        Product.objects.create(
+            name=f'Lapicero {i}', sale_price=10, purchase_price=5,
+            minimum_stock=5, stock=1000, category=category,
+        )
+        for i in range(products)
+    ]
+
+
+def warm_caches():
+    """Loads what QUERY_BUDGETS assumes warm: lookup tables and the discount engine"""
+    for registry in REGISTRIES.values():
+        registry.all()
+    discount_engine.resolve([])
+
+
+def change_form_data(response):
+    """POST data resubmitting an admin change form and its inlines as rendered"""
+    forms = [response.context['adminform'].form]
+    for inline in response.context['inline_admin_formsets']:
+        forms += [inline.formset.management_form, *inline.formset.forms]
+    data = {}
+    for form in forms:
+        for field in form:
+            value = field.value()
+            if not field.field.disabled and value not in (None, False) and not isinstance(value, FieldFile):
+                data[field.html_name] = value
+    return data
+
+
+class AdminFixturesMixin:
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+        self.products = create_catalog()
+        self.company = Company.objects.create(name='Distribuidora')
+        self.brands = [Brand.objects.create(name=f'Marca {i}') for i in range(4)]
+        self.customer = Customer.objects.create(name='Cliente')
+
+    def add_suppliers(self, count, offset=0):
+        for i in range(offset, offset + count):
+            supplier = Supplier.objects.create(name=f'Proveedor {i}', company=self.company)
+            supplier.brands.set(self.brands)
+            supplier.product_set.set(self.products)
+
+    def add_sales(self, count):
+        pending = TransactionStatus.objects.get(code='PENDING')
+        for _ in range(count):
+            sale = Sale.objects.create(payment_method_id='CA', status=pending, customer=self.customer)
+            sale.post_lines([SaleDetail(product_id=p.pk, quantity=1) for p in self.products])
+
+    def add_discounts(self, count):
+        discount_type = DiscountType.objects.get_or_create(code='PERCENTAGE', defaults={'label': '%'})[0]
+        scopes = [
+            ScopeType.objects.get_or_create(code=code, defaults={'label': code})[0]
+            for code in ('ALL_PRODUCTS', 'SELECTED_PRODUCTS', 'SELECTED_CATEGORIES')
+        ]
+        for i in range(count):
+            discount = Discount.objects.create(
+                name=f'Descuento {i}', type=discount_type, value=5, scope=scopes[i % len(scopes)]
+            )
+            discount.products.set(self.products[:2])
+            discount.categories.set([self.products[0].category])
+
+
+class LedgerAssertionsMixin:
+    def assertLedgerMatchesStock(self, opening=1000):
+        ledger = ledger_deltas()
+        for product in Product.objects.all():
+            self.assertEqual(product.stock, opening + ledger.get(product.pk, 0))
+
+
+class LookupRegistryTests(TestCase):
+    def setUp(self):
+        create_catalog(products=0)
+        warm_caches()
+
+    def test_saved_rows_drop_the_loaded_table(self):
+        TransactionStatus.objects.create(code='REFUNDED', label='Reembolsada')
+
+        self.assertIn('REFUNDED', [status.code for status in transaction_statuses.all()])
+        with self.assertNumQueries(0):
+            self.assertEqual(transaction_statuses.get('REFUNDED').label, 'Reembolsada')
+
+    def test_rows_created_elsewhere_load_on_first_miss(self):
+        # bulk_create sends no post_save, like a row saved by another process.
+        MovementType.objects.bulk_create([MovementType(code='TRF', label='Traspaso')])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(movement_types.get('TRF').label, 'Traspaso')
+        with self.assertNumQueries(0):
+            movement_types.get('TRF')
+        with self.assertNumQueries(1), self.assertRaises(MovementType.DoesNotExist):
+            movement_types.get('XXX')
+
+
+class ChangelistQueryBudgetTests(AdminFixturesMixin, TestCase):
+    rows = 100
+
+    def assertConstantQueries(self, url, add_rows):
+        add_rows(1)
+        warm_caches()
+        with CaptureQueriesContext(connection) as baseline:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        add_rows(self.rows - 1)
+        with self.assertNumQueries(len(baseline)):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_supplier_changelist(self):
+        self.assertConstantQueries(
+            reverse('admin:stationery_supplier_changelist'),
+            lambda count: self.add_suppliers(count, offset=Supplier.objects.count()),
+        )
+
+    def test_sale_changelist(self):
+        self.assertConstantQueries(reverse('admin:stationery_sale_changelist'), self.add_sales)
+
+    def test_discount_changelist(self):
+        self.assertConstantQueries(reverse('admin:stationery_discount_changelist'), self.add_discounts)
+
+    def test_supplier_counts(self):
+        self.add_suppliers(1)
+        response = self.client.get(reverse('admin:stationery_supplier_changelist'))
+        supplier = response.context['cl'].result_list[0]
+        self.assertEqual(supplier._product_count, len(self.products))
+
+
+class PostLinesTests(TestCase):
+    def setUp(self):
+        discount_engine.invalidate()
+        self.products = create_catalog(products=10)
+        self.customer = Customer.objects.create(name='Cliente')
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'), customer=self.customer
+        )
+
+    def test_books_stock_details_movements_and_totals(self):
+        lines = self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=3) for p in self.products[:3]])
+
+        self.assertEqual([line.unit_price for line in lines], [10] * 3)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products[:4]]).values_list('stock', flat=True)),
+            [997, 997, 997, 1000],
+        )
+        movements = StockMovement.objects.filter(sale=self.sale)
+        self.assertEqual(movements.count(), 3)
+        self.assertEqual(set(movements.values_list('movement_type__code', 'quantity')), {('OUT', 3)})
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.subtotal, self.sale.total), (90, 90))
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        # Warms the lookup registries and the discount engine.
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=1)])
+        with CaptureQueriesContext(connection) as one_line:
+            self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=1)])
+        with self.assertNumQueries(len(one_line)):
+            self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=1) for p in self.products])
+
+    def test_lines_take_the_best_discount(self):
+        percentage = DiscountType.objects.create(code='PERCENTAGE', label='%')
+        fixed = DiscountType.objects.create(code='FIXED_AMOUNT', label='$')
+        selected = ScopeType.objects.create(code='SELECTED_PRODUCTS', label='Productos')
+        categories = ScopeType.objects.create(code='SELECTED_CATEGORIES', label='Categorías')
+        half = Discount.objects.create(name='Mitad', type=percentage, value=50, scope=selected)
+        half.products.add(self.products[0])
+        Discount.objects.create(name='Tres menos', type=fixed, value=3, scope=categories).categories.add(
+            self.products[0].category
+        )
+        discount_engine.invalidate()
+
+        first, second = self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=2) for p in self.products[:2]])
+
+        self.assertEqual((first.discount_name, first.final_price), ('Mitad', 5))
+        self.assertEqual((second.discount_name, second.final_price), ('Tres menos', 7))
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.subtotal, self.sale.total), (40, 24))
+
+
+class DiscountEngineTests(TestCase):
+    def setUp(self):
+        caches['storefront'].clear()
+        self.products = create_catalog(products=2)
+        percentage = DiscountType.objects.create(code='PERCENTAGE', label='%')
+        selected = ScopeType.objects.create(code='SELECTED_PRODUCTS', label='Productos')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discount = Discount.objects.create(name='Diez', type=percentage, value=10, scope=selected)
+            self.discount.products.add(self.products[0])
+
+    def test_other_processes_follow_the_pricing_version(self):
+        # A second engine stands in for another worker's process.
+        worker = DiscountEngine()
+        self.assertEqual(worker.best_for(self.products[0]), self.discount)
+        with self.assertNumQueries(0):
+            self.assertIsNone(worker.best_for(self.products[1]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discount.products.add(self.products[1])
+        self.assertEqual(worker.best_for(self.products[1]), self.discount)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discount.active = False
+            self.discount.save()
+        self.assertIsNone(worker.best_for(self.products[0]))
+
+    def test_catches_up_by_refetching_only_changed_discounts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Discount.objects.create(name='Cinco', type=self.discount.type, value=5, scope=self.discount.scope)
+            other.products.add(self.products[1])
+        worker = DiscountEngine()
+        self.assertEqual(worker.best_for(self.products[1]), other)
+        unchanged = worker.best_for(self.products[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.value = 20
+            other.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(worker.best_for(self.products[1]).value, 20)
+        self.assertIn(f'IN ({other.pk})', queries[0]['sql'])
+        self.assertIs(worker.best_for(self.products[0]), unchanged)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertIsNone(worker.best_for(self.products[1]))
+        self.assertIs(worker.best_for(self.products[0]), unchanged)
+
+    def test_inactive_types_and_scopes_do_not_apply(self):
+        worker = DiscountEngine()
+        for lookup in (self.discount.type, self.discount.scope):
+            with self.subTest(lookup=lookup):
+                with self.captureOnCommitCallbacks(execute=True):
+                    lookup.active = False
+                    lookup.save()
+                self.assertIsNone(worker.best_for(self.products[0]))
+                with self.captureOnCommitCallbacks(execute=True):
+                    lookup.active = True
+                    lookup.save()
+                self.assertEqual(worker.best_for(self.products[0]), self.discount)
+
+    def test_only_patchable_changes_are_kept(self):
+        versions = caching.version_cache()
+        start = caching.get_version(caching.PRICING)
+        for _ in range(discounts.MAX_PATCHED_VERSIONS + 5):
+            discounts.record_pricing_change([self.discount.pk])
+        end = caching.get_version(caching.PRICING)
+        kept = versions.get_many([discounts._change_key(version) for version in range(start, end + 1)])
+        self.assertEqual(len(kept), discounts.MAX_PATCHED_VERSIONS)
+
+    def test_a_cart_is_priced_without_queries(self):
+        discount_engine.best_for(self.products[0])
+        lines = [SaleDetail(product=p, unit_price=p.sale_price, quantity=1) for p in self.products]
+        with self.assertNumQueries(0):
+            discount_engine.apply_many(lines)
+        self.assertEqual([line.discount_name for line in lines], ['Diez', None])
+
+
+class SaleTotalsTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=3)
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'),
+            customer=Customer.objects.create(name='Cliente'),
+        )
+        # 3 x 1.15 with 10% off is 3.105 per line: rounding each line and
+        # rounding the sum give different totals.
+        self.sale.post_lines([
+            SaleDetail(
+                product_id=p.pk, quantity=3, unit_price=Decimal('1.15'), discount_name='Diez',
+                discount_type=DiscountTypeEnum.PERCENTAGE, discount_value=Decimal('10'),
+            )
+            for p in self.products[:2]
+        ])
+
+    def reconcile(self, *args):
+        stdout = StringIO()
+        call_command('reconcile_sale_totals', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_posted_totals_round_per_line(self):
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.subtotal, self.sale.total), (Decimal('6.90'), Decimal('6.20')))
+        self.sale.update_total()
+        self.assertEqual((self.sale.subtotal, self.sale.total), (Decimal('6.90'), Decimal('6.20')))
+        self.assertIn('1 ventas revisadas, 0 descuadradas', self.reconcile('--dry-run'))
+
+    def test_sql_totals_round_each_line_like_amounts(self):
+        prices = ['0.01', '0.04', '0.05', '0.29', '1.15', '2.35', '99.99']
+        discounts = [
+            (None, None), (DiscountTypeEnum.PERCENTAGE, '10'), (DiscountTypeEnum.PERCENTAGE, '12.5'),
+            (DiscountTypeEnum.PERCENTAGE, '33.33'), (DiscountTypeEnum.PERCENTAGE, '0.5'),
+            (DiscountTypeEnum.FIXED_AMOUNT, '0.30'), (DiscountTypeEnum.FIXED_AMOUNT, '200'),
+        ]
+        lines = []
+        for price in prices:
+            sale = Sale.objects.create(payment_method_id='CA', status=self.sale.status, customer=self.sale.customer)
+            for (discount_type, value), quantity in zip(discounts, (1, 3, 7, 1, 3, 7, 1)):
+                lines.append(SaleDetail(
+                    sale=sale, product=self.products[0], quantity=quantity, unit_price=Decimal(price),
+                    unit_cost=0, discount_type=discount_type, discount_value=value and Decimal(value),
+                ))
+        SaleDetail.objects.bulk_create(lines)
+
+        expected = {}
+        for line in lines:
+            subtotal, total = line.line_amounts()
+            previous = expected.get(line.sale_id, (0, 0))
+            expected[line.sale_id] = (previous[0] + subtotal, previous[1] + total)
+        with self.assertNumQueries(1):
+            computed = SaleDetail.totals_by_sale(SaleDetail.objects.filter(sale_id__in=list(expected)))
+        self.assertEqual(computed, expected)
+
+    def test_edits_and_deletes_keep_totals_reconciled(self):
+        detail = SaleDetail.objects.filter(sale=self.sale).first()
+        detail.quantity = 5
+        detail.save()
+        extra = SaleDetail(sale=self.sale, product=self.products[2], quantity=1, unit_price=Decimal('0.99'))
+        extra.save()
+        detail.delete()
+        self.assertIn('0 descuadradas', self.reconcile('--dry-run'))
+
+    def test_drifted_totals_are_fixed(self):
+        Sale.objects.filter(pk=self.sale.pk).update(subtotal=0, total=0)
+        self.assertIn('1 ventas revisadas, 1 corregidas', self.reconcile())
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.subtotal, self.sale.total), (Decimal('6.90'), Decimal('6.20')))
+        self.assertIn('0 corregidas', self.reconcile())
+
+
+class FixtureGeneratorTests(TestCase):
+    def setUp(self):
+        self.counts = FixtureGenerator(seed=1, chunk_size=50, days=20).run(
+            products=30, sales=120, customers=10, discounts=5
+        )
+
+    def test_stock_matches_the_ledger(self):
+        ledger = ledger_deltas()
+        stock = dict(Product.objects.values_list('pk', 'stock'))
+        self.assertEqual(len(stock), 30)
+        self.assertEqual(stock, {pk: ledger.get(pk, 0) for pk in stock})
+
+    def test_rollups_match_live_sales(self):
+        live = Sale.objects.exclude(status__code='CANCELLED').values('pk')
+        expected = {}
+        for day, product_id, _, *values in rollups.sale_deltas(live):
+            totals = expected.setdefault((day, product_id), [0, 0, 0, 0])
+            for index, value in enumerate(values):
+                totals[index] += value
+        stored = {
+            (day, product_id): [units, revenue, discount, cost]
+            for day, product_id, units, revenue, discount, cost in DailyProductSales.objects.values_list(
+                'day', 'product_id', 'units', 'revenue', 'discount', 'cost'
+            )
+        }
+        self.assertTrue(expected)
+        self.assertEqual(stored, expected)
+
+    def test_sale_totals_reconcile(self):
+        self.assertEqual(Sale.objects.count(), self.counts['sales'])
+        stdout = StringIO()
+        call_command('reconcile_sale_totals', '--dry-run', stdout=stdout)
+        self.assertIn(f"{self.counts['sales']} ventas revisadas, 0 descuadradas", stdout.getvalue())
+
+
+class ReceiveLinesTests(LedgerAssertionsMixin, TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=3)
+        self.supplier = Supplier.objects.create(name='Proveedor', company=Company.objects.create(name='Distribuidora'))
+        self.purchase = Purchase.objects.create(supplier=self.supplier, status=TransactionStatus.objects.get(code='PENDING'))
+
+    def test_books_stock_price_and_movements(self):
+        Product.objects.filter(pk=self.products[0].pk).update(attributes={'color': 'azul'})
+        self.purchase.receive_lines([
+            PurchaseDetail(product_id=self.products[0].pk, quantity=3, unit_price=Decimal('4.50')),
+            PurchaseDetail(product_id=self.products[1].pk, quantity=2, unit_price=Decimal('4.00')),
+            PurchaseDetail(product_id=self.products[0].pk, quantity=1, unit_price=Decimal('6.00')),
+        ])
+
+        first, second, untouched = Product.objects.filter(pk__in=[p.pk for p in self.products]).order_by('pk')
+        self.assertEqual((first.stock, first.purchase_price), (1004, Decimal('6.00')))
+        self.assertEqual((second.stock, second.purchase_price), (1002, Decimal('4.00')))
+        self.assertEqual((untouched.stock, untouched.purchase_price), (1000, 5))
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(purchase=self.purchase).values_list('movement_type__code', 'quantity')),
+            [('IN', 1), ('IN', 2), ('IN', 3)],
+        )
+        self.assertEqual(
+            PurchaseDetail.objects.filter(product=self.products[0]).first().purchase_attributes, {'color': 'azul'}
+        )
+
+    def test_unknown_product_writes_nothing(self):
+        with self.assertRaises(ValidationError):
+            self.purchase.receive_lines([
+                PurchaseDetail(product_id=self.products[0].pk, quantity=3, unit_price=5),
+                PurchaseDetail(product_id=0, quantity=1, unit_price=5),
+            ])
+        self.assertFalse(PurchaseDetail.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1000)
+
+    def test_edits_and_deletes_move_only_the_difference(self):
+        line, = self.purchase.receive_lines([PurchaseDetail(product_id=self.products[0].pk, quantity=5, unit_price=5)])
+        line = PurchaseDetail.objects.get(pk=line.pk)
+        for quantity, stock in ((6, 1006), (2, 1002)):
+            line.quantity = quantity
+            line.save()
+            self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, stock)
+            self.assertLedgerMatchesStock()
+
+        line.delete()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1000)
+        self.assertLedgerMatchesStock()
+
+    def test_lines_of_received_purchases_cannot_be_edited(self):
+        line, = self.purchase.receive_lines([PurchaseDetail(product_id=self.products[0].pk, quantity=5, unit_price=5)])
+        Purchase.objects.filter(pk=self.purchase.pk).update(status=TransactionStatus.objects.get(code='RECEIVED'))
+        line = PurchaseDetail.objects.get(pk=line.pk)
+        line.quantity = 9
+        with self.assertRaises(ValidationError):
+            line.save()
+        line.refresh_from_db()
+        line.product = self.products[1]
+        with self.assertRaises(ValidationError):
+            line.save()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1005)
+        self.assertLedgerMatchesStock()
+
+
+class CancelManyTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=3)
+        self.customer = Customer.objects.create(name='Cliente')
+        self.pending = TransactionStatus.objects.get(code='PENDING')
+        self.supplier = Supplier.objects.create(name='Proveedor', company=Company.objects.create(name='Distribuidora'))
+
+    def post_sale(self, quantity=2):
+        sale = Sale.objects.create(payment_method_id='CA', status=self.pending, customer=self.customer)
+        sale.post_lines([SaleDetail(product_id=p.pk, quantity=quantity) for p in self.products])
+        return sale
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def test_sales_give_stock_back_except_paid_ones(self):
+        sales = [self.post_sale() for _ in range(3)]
+        Sale.objects.filter(pk=sales[0].pk).update(status=TransactionStatus.objects.get(code='PAID'))
+
+        cancelled, blocked = Sale.cancel_many(Sale.objects.all())
+
+        self.assertEqual((sorted(cancelled), blocked), (sorted(s.pk for s in sales[1:]), [sales[0].pk]))
+        self.assertEqual(self.stock(), [998] * 3)
+        self.assertEqual(set(Sale.objects.filter(pk__in=cancelled).values_list('status__code', flat=True)), {'CANCELLED'})
+        returned = StockMovement.objects.filter(reason=MovementReasonEnum.CANCELLATION)
+        self.assertEqual(set(returned.values_list('movement_type__code', 'quantity')), {('IN', 2)})
+        self.assertEqual(returned.count(), 6)
+        self.assertEqual(SaleDetail.objects.count(), 9)
+
+        self.assertEqual(Sale.cancel_many(Sale.objects.all()), ([], [sales[0].pk]))
+        self.assertEqual(self.stock(), [998] * 3)
+
+    def test_purchases_take_stock_out_except_received_ones(self):
+        purchases = []
+        for status in ('PENDING', 'RECEIVED'):
+            purchase = Purchase.objects.create(supplier=self.supplier, status=TransactionStatus.objects.get(code=status))
+            purchase.receive_lines([PurchaseDetail(product_id=self.products[0].pk, quantity=5, unit_price=5)])
+            purchases.append(purchase)
+
+        cancelled, blocked = Purchase.cancel_many(Purchase.objects.all())
+
+        self.assertEqual((cancelled, blocked), ([purchases[0].pk], [purchases[1].pk]))
+        self.assertEqual(self.stock()[0], 1005)
+        self.assertTrue(StockMovement.objects.filter(
+            purchase=purchases[0], movement_type__code='OUT', reason=MovementReasonEnum.CANCELLATION, quantity=5
+        ).exists())
+
+    def test_purchase_whose_stock_was_sold_is_not_cancelled(self):
+        purchase = Purchase.objects.create(supplier=self.supplier, status=self.pending)
+        purchase.receive_lines([PurchaseDetail(product_id=self.products[0].pk, quantity=5, unit_price=5)])
+        Product.objects.filter(pk=self.products[0].pk).update(stock=3)
+
+        with self.assertRaises(ValidationError):
+            Purchase.cancel_many(Purchase.objects.all())
+        self.assertEqual(Purchase.objects.get(pk=purchase.pk).status, self.pending)
+        self.assertEqual(self.stock()[0], 3)
+
+
+    def test_admin_refuses_deleting_purchases_whose_stock_was_sold(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        purchase = Purchase.objects.create(supplier=self.supplier, status=self.pending)
+        detail, = purchase.receive_lines([PurchaseDetail(product_id=self.products[0].pk, quantity=5, unit_price=5)])
+        Product.objects.filter(pk=self.products[0].pk).update(stock=3)
+
+        requests = [
+            (reverse('admin:stationery_purchase_delete', args=[purchase.pk]), {'post': 'yes'}),
+            (reverse('admin:stationery_purchase_changelist'),
+             {'action': 'delete_selected', 'post': 'yes', '_selected_action': [purchase.pk]}),
+            (reverse('admin:stationery_purchasedetail_delete', args=[detail.pk]), {'post': 'yes'}),
+        ]
+        for url, data in requests:
+            with self.subTest(url=url):
+                response = self.client.post(url, data)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Stock insuficiente')
+                self.assertTrue(PurchaseDetail.objects.filter(pk=detail.pk).exists())
+        self.assertEqual(self.stock()[0], 3)
+
+        Product.objects.filter(pk=self.products[0].pk).update(stock=5)
+        self.client.post(requests[0][0], requests[0][1])
+        self.assertFalse(Purchase.objects.filter(pk=purchase.pk).exists())
+        self.assertEqual(self.stock()[0], 0)
+
+class ReorderTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=2)
+        self.supplier = Supplier.objects.create(name='Proveedor', company=Company.objects.create(name='Distribuidora'))
+        self.supplier.product_set.set(self.products)
+        Product.objects.filter(pk=self.products[0].pk).update(minimum_stock=1200)
+
+    def create_drafts(self):
+        call_command('reorder_report', '--create-drafts', stdout=StringIO(), stderr=StringIO())
+        return ReorderLine.objects.filter(purchase__status__code=DRAFT_STATUS)
+
+    def test_open_drafts_are_not_ordered_again(self):
+        self.assertEqual(list(self.create_drafts().values_list('product_id', 'quantity')), [(self.products[0].pk, 200)])
+        self.assertEqual(self.create_drafts().count(), 1)
+
+        Product.objects.filter(pk=self.products[0].pk).update(minimum_stock=1250)
+        self.assertEqual(sorted(self.create_drafts().values_list('quantity', flat=True)), [50, 200])
+        self.assertEqual([s.on_order for s in suggest()], [])
+
+    def test_drafts_are_received_through_their_own_action(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        draft = self.create_drafts().get().purchase
+        url = reverse('admin:stationery_purchase_changelist')
+        warm_caches()
+
+        self.client.post(url, {'action': 'mark_as_received', '_selected_action': [draft.pk]})
+        self.assertEqual(Purchase.objects.get(pk=draft.pk).status.code, DRAFT_STATUS)
+
+        self.client.post(url, {'action': 'receive_drafts', '_selected_action': [draft.pk]})
+        self.assertEqual(Purchase.objects.get(pk=draft.pk).status.code, 'RECEIVED')
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1200)
+        self.assertEqual(suggest(), [])
+
+        # A repeated submission finds no draft left to book.
+        self.client.post(url, {'action': 'receive_drafts', '_selected_action': [draft.pk]})
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1200)
+
+    def test_drafts_offer_no_detail_lines(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        draft = self.create_drafts().get().purchase
+        url = reverse('admin:stationery_purchase_change', args=[draft.pk])
+        response = self.client.get(url)
+        self.assertEqual(
+            [inline.formset.model for inline in response.context['inline_admin_formsets']], [ReorderLine]
+        )
+        data = change_form_data(response)
+        data.update({
+            'purchasedetail_set-TOTAL_FORMS': 1, 'purchasedetail_set-INITIAL_FORMS': 0,
+            'purchasedetail_set-0-product': self.products[0].pk,
+            'purchasedetail_set-0-quantity': 50, 'purchasedetail_set-0-unit_price': 5,
+        })
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertFalse(PurchaseDetail.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1000)
+
+
+class StockAsOfTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=2)
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'),
+            customer=Customer.objects.create(name='Cliente'),
+        )
+
+    def sell(self, quantity):
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=quantity)])
+
+    def test_walks_forward_from_the_latest_snapshot(self):
+        self.sell(2)
+        take_snapshot()
+        self.sell(5)
+        between = timezone.now()
+        self.sell(7)
+        ids = [p.pk for p in self.products]
+        self.assertEqual(stock_as_of(ids, between), {ids[0]: 993, ids[1]: 1000})
+        self.assertEqual(stock_as_of(ids, timezone.now()), {ids[0]: 986, ids[1]: 1000})
+
+    def test_walks_back_from_current_stock_without_snapshot(self):
+        before = timezone.now()
+        self.sell(2)
+        take_snapshot()
+        self.sell(5)
+        self.assertEqual(stock_as_of([self.products[0].pk], before), {self.products[0].pk: 1000})
+        self.assertEqual(stock_as_of([self.products[0].pk], before - timedelta(days=1)), {self.products[0].pk: 1000})
+
+    def test_walks_back_from_a_later_snapshot(self):
+        self.sell(2)
+        between = timezone.now()
+        self.sell(5)
+        take_snapshot()
+        # Stock drifted after the snapshot without a movement; only walking
+        # back from the snapshot still gives the right answer.
+        Product.objects.update(stock=0)
+        ids = [p.pk for p in self.products]
+        with self.assertNumQueries(5):
+            self.assertEqual(stock_as_of(ids, between), {ids[0]: 998, ids[1]: 1000})
+
+    def test_snapshot_matches_the_ledger(self):
+        self.sell(3)
+        take_snapshot()
+        snapshot = StockSnapshot.objects.get(product=self.products[0])
+        self.assertEqual(snapshot.stock, 997)
+        self.assertFalse(StockMovement.objects.filter(product=self.products[0], date__gt=snapshot.taken_at).exists())
+
+    def test_snapshot_counts_only_inserted_rows(self):
+        with mock.patch('stationery.inventory.timezone.now', return_value=timezone.now()):
+            self.assertEqual(take_snapshot(chunk_size=1), 2)
+            self.assertEqual(take_snapshot(chunk_size=1), 0)
+        self.assertEqual(StockSnapshot.objects.count(), 2)
+
+
+@override_settings(STOCK_MOVEMENT_WRITE_BEHIND=True)
+class WriteBehindJournalTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=3)
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'),
+            customer=Customer.objects.create(name='Cliente'),
+        )
+
+    def test_movements_wait_in_the_journal_until_flushed(self):
+        self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=2) for p in self.products])
+        self.assertFalse(StockMovement.objects.exists())
+        dates = list(journal.outstanding().values_list('date', flat=True))
+        self.assertEqual(len(dates), 3)
+        self.assertEqual(ledger_deltas(), {p.pk: -2 for p in self.products})
+
+        self.assertEqual(journal.flush(batch_size=2), 3)
+
+        self.assertFalse(journal.outstanding().exists())
+        self.assertEqual(list(StockMovement.objects.order_by('pk').values_list('date', flat=True)), dates)
+        self.assertEqual(ledger_deltas(), {p.pk: -2 for p in self.products})
+        self.assertEqual(journal.flush(), 0)
+
+
+class ExportDataTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=2)
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'),
+            customer=Customer.objects.create(name='Cliente'),
+        )
+        self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=2) for p in self.products])
+
+    def export(self, *args):
+        stdout = StringIO()
+        call_command('export_data', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_csv_to_stdout(self):
+        header, *rows = self.export('sales').splitlines()
+        self.assertTrue(header.startswith('sale_id,sale__date,sale__customer__name'))
+        self.assertEqual(len(rows), 2)
+
+    def test_jsonl_since(self):
+        rows = [json.loads(line) for line in self.export('stock_movements', '--format', 'jsonl').splitlines()]
+        self.assertEqual([(row['movement_type__code'], row['quantity']) for row in rows], [('OUT', 2)] * 2)
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        self.assertEqual(self.export('stock_movements', '--format', 'jsonl', '--since', tomorrow), '')
+
+    @override_settings(STOCK_MOVEMENT_WRITE_BEHIND=True)
+    def test_stock_movements_include_the_journal(self):
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=1)])
+        self.assertTrue(journal.outstanding().exists())
+        header, *rows = self.export('stock_movements').splitlines()
+        self.assertEqual(len(rows), 3)
+        self.assertFalse(journal.outstanding().exists())
+
+
+class InvoicePdfTests(TestCase):
+    def setUp(self):
+        caches['invoices'].clear()
+        self.products = create_catalog(products=2)
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'),
+            customer=Customer.objects.create(name='Cliente'),
+        )
+        self.lines = self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=2) for p in self.products])
+        self.invoice = SaleInvoice.objects.create(
+            sale=self.sale, invoice_number='F-001', due_date=timezone.localdate() + timedelta(days=30)
+        )
+
+    def render(self):
+        (name, pdf), = iter_invoice_pdfs('sale', SaleInvoice.objects.all())
+        return pdf
+
+    def test_cached_pdfs_cost_only_the_key_queries(self):
+        first = self.render()
+        # invoice pks, invoice and sale fields, lines
+        with self.assertNumQueries(3):
+            self.assertEqual(self.render(), first)
+
+    def test_editing_the_sale_renders_again(self):
+        first = self.render()
+        detail = SaleDetail.objects.get(pk=self.lines[0].pk)
+        detail.quantity = 3
+        detail.save()
+        second = self.render()
+        self.assertNotEqual(second, first)
+
+        Customer.objects.filter(pk=self.sale.customer_id).update(name='Otro cliente')
+        self.assertNotEqual(self.render(), second)
+
+    @mock.patch.object(invoicing, 'POOL_THRESHOLD', 1)
+    @mock.patch.object(invoicing, 'ProcessPoolExecutor', side_effect=AssertionError("pool inside a request"))
+    def test_admin_export_renders_in_process(self, pool):
+        response = invoicing.streaming_invoices('sale', SaleInvoice.objects.all())
+        self.assertTrue(b''.join(response.streaming_content))
+
+    def test_layout_imports_no_django(self):
+        code = 'import sys, stationery.invoice_layout; sys.exit("django" in sys.modules)'
+        subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, check=True)
+
+
+class CategoryValidatorTests(TestCase):
+    def setUp(self):
+        # A schema no other test compiles, so the first use here builds it.
+        self.schema = {
+            'type': 'object',
+            'properties': {'color': {'type': 'string'}},
+            'required': ['color'],
+            'title': f'{self.id()}',
+        }
+        self.category = Category.objects.create(name='Cuadernos', product_schema=self.schema)
+
+    def cached_keys(self):
+        return [key for key in schemas._category_validators if key[0] == self.category.pk]
+
+    def test_repeat_validations_reuse_the_compiled_validator(self):
+        with mock.patch('stationery.schemas.validator_for', wraps=schemas.validator_for) as build:
+            first = schemas.category_validator(Category.objects.get(pk=self.category.pk))
+            for _ in range(3):
+                category = Category.objects.get(pk=self.category.pk)
+                self.assertIs(schemas.category_validator(category), first)
+                self.assertIsNone(schemas.validation_error(category, {'color': 'azul'}))
+        self.assertEqual(build.call_count, 1)
+
+    def test_schema_edits_apply_new_rules(self):
+        self.assertIsNone(schemas.validation_error(self.category, {'color': 'azul'}))
+        old_keys = self.cached_keys()
+        self.category.product_schema = {**self.schema, 'required': ['color', 'hojas']}
+        self.category.save()
+        self.assertEqual(self.cached_keys(), [])
+
+        self.assertIn('hojas', schemas.validation_error(self.category, {'color': 'azul'}).message)
+        category = Category.objects.get(pk=self.category.pk)
+        self.assertIsNotNone(schemas.validation_error(category, {'color': 'azul'}))
+        self.assertNotEqual(self.cached_keys(), old_keys)
+
+    def test_deleting_a_category_evicts_its_validator(self):
+        schemas.validation_error(self.category, {'color': 'azul'})
+        self.assertEqual(len(self.cached_keys()), 1)
+        category_id = self.category.pk
+        self.category.delete()
+        self.assertEqual([key for key in schemas._category_validators if key[0] == category_id], [])
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        for code in ('IN', 'OUT'):
+            MovementType.objects.create(code=code, label=code)
+        self.category = Category.objects.create(name='Escritura', product_schema={
+            'type': 'object', 'properties': {'color': {'type': 'string'}}, 'required': ['color'],
+        })
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_import(self, *rows):
+        path = os.path.join(self.directory.name, 'productos.jsonl')
+        with open(path, 'w', encoding='utf-8') as source:
+            source.writelines(row if isinstance(row, str) else json.dumps(row) + "\n" for row in rows)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_products', path, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def row(self, sku, **fields):
+        return {'sku': sku, 'name': sku, 'sale_price': '2.50', 'purchase_price': '1.00', 'stock': 5,
+                'category': 'Escritura', 'attributes': {'color': 'azul'}, **fields}
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        stdout, stderr = self.run_import(
+            self.row('A1', name='Bolígrafo azul'),
+            self.row('A2', attributes={}),
+            self.row('A3', sale_price='0.50'),
+            '{roto\n',
+        )
+        self.assertIn('1 productos importados, 3 filas con errores', stdout)
+        self.assertIn('Línea 2', stderr)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['A1'])
+        self.assertEqual(list(search.search_products('boligrafo').values_list('sku', flat=True)), ['A1'])
+
+    def test_existing_skus_are_updated_but_keep_their_stock(self):
+        self.run_import(self.row('A1'))
+        Product.objects.filter(sku='A1').update(stock=42)
+        self.run_import(self.row('A1', name='Bolígrafo rojo', sale_price='3.00', stock=500, attributes={'color': 'rojo'}))
+
+        product = Product.objects.get(sku='A1')
+        self.assertEqual(
+            (product.name, product.sale_price, product.stock, product.attributes),
+            ('Bolígrafo rojo', Decimal('3.00'), 42, {'color': 'rojo'}),
+        )
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_opening_stock_of_new_products_enters_the_ledger(self):
+        self.run_import(self.row('A1'), self.row('A2', stock=0))
+        self.run_import(self.row('A1', stock=500), self.row('A3', stock=7))
+
+        stock = dict(Product.objects.values_list('pk', 'stock'))
+        self.assertEqual(ledger_deltas(), {pk: quantity for pk, quantity in stock.items() if quantity})
+        self.assertEqual(sorted(stock.values()), [0, 5, 7])
+
+
+class StorefrontCacheTests(TestCase):
+    def setUp(self):
+        caches['storefront'].clear()
+        self.products = create_catalog(products=2)
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        first = self.client.get(reverse('shop'))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('shop'))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(dict(second.items()), dict(first.items()))
+
+    def test_cached_pages_keep_their_headers(self):
+        class TaggedView(CachedPageMixin, TemplateView):
+            template_name = 'stationery/contact.html'
+
+            def get(self, request, *args, **kwargs):
+                response = super().get(request, *args, **kwargs)
+                response['X-Robots-Tag'] = 'noindex'
+                return response
+
+        def fetch():
+            request = RequestFactory().get('/tagged/')
+            request.user = AnonymousUser()
+            response = TaggedView.as_view()(request)
+            return response.render() if hasattr(response, 'render') else response
+
+        fetch()
+        cached = fetch()
+        self.assertNotIsInstance(cached, TemplateResponse)
+        self.assertEqual(cached['X-Robots-Tag'], 'noindex')
+
+    def test_price_changes_invalidate_cached_pages(self):
+        self.client.get(reverse('shop'))
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.products[0]
+            product.sale_price = Decimal('12.34')
+            product.save()
+        self.assertContains(self.client.get(reverse('shop')), '$12.34')
+
+    def test_version_counters_are_never_culled(self):
+        with tempfile.TemporaryDirectory() as location:
+            versions = VersionCache(location, {'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': 2}})
+            for i in range(5):
+                versions.set(f'counter:{i}', i)
+            self.assertEqual(len(versions.get_many([f'counter:{i}' for i in range(5)])), 5)
+
+    def test_expired_entries_are_culled(self):
+        with tempfile.TemporaryDirectory() as location:
+            versions = VersionCache(location, {'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': 2}})
+            versions.set('counter', 1)
+            versions.set('change:1', [1], 1)
+            with mock.patch('time.time', return_value=time.time() + 2):
+                versions.set('change:2', [2], 60)
+                self.assertEqual(len(versions._list_cache_files()), 2)
+                self.assertEqual(versions.get('counter'), 1)
+
+
+class ShopFacetTests(TestCase):
+    def setUp(self):
+        caches['storefront'].clear()
+        self.products = create_catalog(products=3)
+        for product, color in zip(self.products, ('azul', 'azul', 'rojo')):
+            product.attributes = {'color': color, 'recargable': color == 'rojo'}
+            product.save()
+        self.category = self.products[0].category
+
+    def test_category_pages_list_attribute_values(self):
+        response = self.client.get(reverse('shop'), {'category': self.category.pk})
+        color, refill = response.context['facets']
+        self.assertEqual(color['label'], 'color')
+        self.assertEqual([(o['label'], o['count']) for o in color['options']], [('azul', 2), ('rojo', 1)])
+        self.assertEqual([(o['label'], o['count']) for o in refill['options']], [('No', 2), ('Sí', 1)])
+        self.assertContains(response, f'?category={self.category.pk}&amp;attr_color=rojo')
+
+        response = self.client.get(reverse('shop') + '?' + refill['options'][1]['query'])
+        self.assertEqual([p.name for p in response.context['products']], [self.products[2].name])
+        refill = response.context['facets'][1]
+        self.assertTrue(refill['options'][0]['active'])
+        self.assertNotIn('attr_recargable', refill['options'][0]['query'])
+
+    def test_shop_without_category_skips_facets(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shop'))
+        self.assertEqual(response.context['facets'], [])
+        self.assertFalse(any('json_each' in query['sql'] for query in queries))
+
+
+class ShopPaginationTests(TestCase):
+    def setUp(self):
+        caches['storefront'].clear()
+        self.products = create_catalog(products=3)
+
+    def cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def test_tampered_cursors_fall_back_to_the_first_page(self):
+        first = self.client.get(reverse('shop'), {'sort': 'name'}).context['products']
+        for sort, values in [
+            ('name', ['x', 'abc']),
+            ('name', [None, 1]),
+            ('new', ['not-a-date', 1]),
+            ('new', ['2024-13-45T00:00:00', 1]),
+            ('new', [{'a': 1}, 1]),
+        ]:
+            with self.subTest(sort=sort, values=values):
+                response = self.client.get(reverse('shop'), {'sort': sort, 'after': self.cursor(values)})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['products']), len(first))
+        response = self.client.get(reverse('shop'), {'before': 'not base64!'})
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_pages_seek_with_a_row_value(self):
+        Product.objects.bulk_create([
+            Product(
+                name=f'Borrador {i}', sale_price=1, purchase_price=1, minimum_stock=0, stock=0,
+                category=self.products[0].category,
+            )
+            for i in range(7)
+        ])
+        for ordering in (('name', 'id'), ('-creation_date', '-id')):
+            with self.subTest(ordering=ordering):
+                paginator = KeysetPaginator(Product.objects.all(), ordering, per_page=3)
+                page, seen = paginator.page(), []
+                while True:
+                    seen += page.object_list
+                    if not page.has_next:
+                        break
+                    with CaptureQueriesContext(connection) as queries:
+                        page = paginator.page(after=page.next_cursor)
+                    self.assertNotIn(' OR ', queries[0]['sql'])
+                    self.assertIn(' > (' if ordering[0] == 'name' else ' < (', queries[0]['sql'])
+                self.assertEqual(seen, list(Product.objects.order_by(*ordering)))
+                self.assertEqual(
+                    [p.pk for p in paginator.page(before=page.previous_cursor)], [p.pk for p in seen[-4:-1]]
+                )
+
+                boundary = seen[3]
+                seek = Product.objects.filter(
+                    paginator.seek(getattr(boundary, paginator.field_name), boundary.pk, True)
+                ).order_by(*ordering)[:4]
+                if connection.vendor == 'sqlite':
+                    self.assertIn('SEARCH stationery_product USING INDEX', seek.explain())
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        caches['storefront'].clear()
+        category, = {p.category for p in create_catalog(products=1)}
+        self.brand = Brand.objects.create(name='Faber-Castell')
+        self.pencil = Product.objects.create(
+            name='Lápiz grafito HB', description='Madera de cedro', sale_price=2, purchase_price=1,
+            minimum_stock=1, stock=5, category=category, brand=self.brand, attributes={'color': 'rojo'},
+        )
+        self.notebook = Product.objects.create(
+            name='Cuaderno rayado', description='Ideal para lápiz y tinta', sale_price=3, purchase_price=1,
+            minimum_stock=1, stock=5, category=category,
+        )
+        search.reindex()
+
+    def names(self, query):
+        return list(search.search_products(query).values_list('name', flat=True))
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.names('lapiz'), ['Lápiz grafito HB', 'Cuaderno rayado'])
+        self.assertEqual(self.names('lapiz graf'), ['Lápiz grafito HB'])
+
+    def test_brand_category_and_attributes_are_searchable(self):
+        self.assertEqual(self.names('faber'), ['Lápiz grafito HB'])
+        self.assertEqual(self.names('rojo'), ['Lápiz grafito HB'])
+        self.assertEqual(len(self.names('escritura')), 3)
+        self.assertEqual(self.names('acuarela'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.name = 'Pelikan'
+            self.brand.save()
+        self.assertEqual(self.names('pelikan'), ['Lápiz grafito HB'])
+        self.assertEqual(self.names('faber'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pencil.delete()
+        self.assertEqual(self.names('lapiz'), ['Cuaderno rayado'])
+
+    def test_queryset_filters_apply_before_ranking(self):
+        Product.objects.filter(pk=self.pencil.pk).update(active=False)
+        found = search.search_products('lapiz', Product.objects.filter(active=True), limit=1)
+        self.assertEqual([(p.name, p.rank > 0) for p in found], [('Cuaderno rayado', True)])
+        self.assertEqual(self.names('lapiz'), ['Lápiz grafito HB', 'Cuaderno rayado'])
+
+    def test_shop_orders_by_relevance(self):
+        response = self.client.get(reverse('shop'), {'q': 'lapiz'})
+        self.assertEqual([p.name for p in response.context['products']], ['Lápiz grafito HB', 'Cuaderno rayado'])
+
+
+class ProductLookupTests(TestCase):
+    def setUp(self):
+        caches['storefront'].clear()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+        self.products = create_catalog(products=5)
+        Product.objects.filter(pk=self.products[0].pk).update(active=False)
+        search.reindex()
+        warm_caches()
+
+    def names(self, **params):
+        response = self.client.get(reverse('admin_product_lookup'), {'term': 'lapicero', **params})
+        return sorted(result['name'] for result in response.json()['results'])
+
+    def test_only_the_purchase_inline_offers_inactive_products(self):
+        self.assertEqual(self.names(), [f'Lapicero {i}' for i in range(1, 5)])
+        self.assertEqual(self.names(inactive='1'), [f'Lapicero {i}' for i in range(5)])
+        self.assertIn(
+            'product-lookup/?inactive=1',
+            self.client.get(reverse('admin:stationery_purchase_add')).content.decode(),
+        )
+        self.assertNotIn(
+            'product-lookup/?inactive=1',
+            self.client.get(reverse('admin:stationery_sale_add')).content.decode(),
+        )
+
+    def test_requests_for_a_prefix_in_flight_wait_for_its_result(self):
+        cache = caching.storefront_cache()
+        key = autocomplete._prefix_key('lapicero', caching.get_version(caching.CATALOG))
+        cache.add(f'{key}:in-flight', True, autocomplete.COALESCE_WINDOW)
+        threading.Timer(0.05, cache.set, [key, autocomplete._search('lapicero'), 60]).start()
+        with mock.patch.object(autocomplete, '_search', side_effect=AssertionError("searched twice")):
+            self.assertEqual(len(autocomplete.candidate_ids('lapicero')), 4)
+
+    @mock.patch.object(autocomplete, 'CANDIDATE_LIMIT', 3)
+    def test_truncated_prefixes_are_not_narrowed_from(self):
+        self.assertEqual(len(autocomplete.candidate_ids('lapi', include_inactive=True)), 3)
+        self.assertEqual(
+            autocomplete.candidate_ids('lapicero 4', include_inactive=True), [self.products[4].pk]
+        )
+        self.assertEqual(autocomplete.candidate_ids('lapicero 0'), [])
+
+
+class AdminDashboardTests(TestCase):
+    # sales, open sales, stock, receivables, payables, top sellers
+    kpi_queries = 6
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+        self.products = create_catalog()
+        self.customer = Customer.objects.create(name='Cliente')
+
+    def add_year_of_rollups(self):
+        today = timezone.localdate()
+        category = self.products[0].category
+        days = [today - timedelta(days=offset) for offset in range(365)]
+        DailyCategorySales.objects.bulk_create([
+            DailyCategorySales(day=day, category=category, units=10, revenue=100, cost=50) for day in days
+        ])
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(day=day, product=product, units=2, revenue=20, cost=10)
+            for day in days for product in self.products
+        ])
+
+    def test_kpis_cost_fixed_queries(self):
+        self.add_year_of_rollups()
+        with self.assertNumQueries(self.kpi_queries):
+            kpis = compute_kpis()
+        today = kpis['today']
+        elapsed = (today - today.replace(month=1, day=1)).days + 1
+        self.assertEqual(kpis['sales']['today']['units'], 10)
+        self.assertEqual(kpis['sales']['year']['revenue'], 100 * elapsed)
+        self.assertEqual(kpis['sales']['year']['margin'], 50 * elapsed)
+        self.assertEqual(kpis['stock']['cost_value'], 5 * 1000 * len(self.products))
+        self.assertEqual(kpis['top_sellers'][0]['units'], 60)
+
+    def test_rollups_follow_posted_sales(self):
+        pending = TransactionStatus.objects.get(code='PENDING')
+        sale = Sale.objects.create(payment_method_id='CA', status=pending, customer=self.customer)
+        sale.post_lines([SaleDetail(product_id=p.pk, quantity=2) for p in self.products])
+        kpis = compute_kpis()
+        self.assertEqual(kpis['sales']['today']['revenue'], 20 * len(self.products))
+        self.assertEqual(kpis['sales']['today']['margin'], 10 * len(self.products))
+        self.assertEqual(kpis['open_sales'], 1)
+
+    def test_cost_stays_at_booking_time_price(self):
+        product = self.products[0]
+        pending = TransactionStatus.objects.get(code='PENDING')
+        sale = Sale.objects.create(payment_method_id='CA', status=pending, customer=self.customer)
+        sale.post_lines([SaleDetail(product_id=product.pk, quantity=10)])
+        supplier = Supplier.objects.create(name='Proveedor', company=Company.objects.create(name='Distribuidora'))
+        purchase = Purchase.objects.create(supplier=supplier, status=pending)
+        purchase.receive_lines([PurchaseDetail(product_id=product.pk, quantity=5, unit_price=8)])
+
+        rows = DailyProductSales.objects.filter(product=product)
+        self.assertEqual(list(rows.values_list('cost', flat=True)), [50])
+        rollups.rebuild()
+        self.assertEqual(list(rows.values_list('cost', flat=True)), [50])
+
+        Sale.cancel_many(Sale.objects.filter(pk=sale.pk))
+        self.assertEqual(list(rows.values_list('units', 'cost')), [(0, 0)])
+
+    def test_received_purchases_settle_their_invoices(self):
+        supplier = Supplier.objects.create(name='Proveedor', company=Company.objects.create(name='Distribuidora'))
+        due = timezone.localdate() + timedelta(days=1)
+        for number, code in enumerate(('RECEIVED', 'PENDING', 'CANCELLED')):
+            purchase = Purchase.objects.create(supplier=supplier, status=TransactionStatus.objects.get(code=code))
+            PurchaseInvoice.objects.create(
+                purchase=purchase, invoice_number=f'C-{number}', due_date=due, total_amount=100
+            )
+        payables = compute_kpis(due + timedelta(days=1))['payables']
+        self.assertEqual(payables['paid'], {'count': 1, 'amount': 100})
+        self.assertEqual(payables['overdue'], {'count': 1, 'amount': 100})
+        self.assertEqual(payables['pending']['count'], 0)
+
+    def test_dashboard_is_cached(self):
+        url = reverse('admin_dashboard')
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(first) - len(second), self.kpi_queries)
+
+
+class StockReservationTests(LedgerAssertionsMixin, TestCase):
+    def setUp(self):
+        self.products = create_catalog(products=3)
+        self.customer = Customer.objects.create(name='Cliente')
+        self.sale = Sale.objects.create(
+            payment_method_id='CA', status=TransactionStatus.objects.get(code='PENDING'), customer=self.customer
+        )
+
+    def test_shortfalls_are_reported_for_every_product(self):
+        Product.objects.filter(pk=self.products[0].pk).update(stock=2)
+        Product.objects.filter(pk=self.products[1].pk).update(stock=1)
+        with self.assertRaises(InsufficientStock) as raised:
+            with transaction.atomic():
+                reserve_stock({self.products[0].pk: 3, self.products[1].pk: 5, self.products[2].pk: 1})
+        self.assertEqual(raised.exception.shortfalls, {self.products[0].pk: (2, 3), self.products[1].pk: (1, 5)})
+        self.assertEqual(Product.objects.get(pk=self.products[2].pk).stock, 1000)
+
+    def test_short_cart_writes_nothing(self):
+        lines = [SaleDetail(product_id=self.products[0].pk, quantity=1),
+                 SaleDetail(product_id=self.products[1].pk, quantity=1001)]
+        with self.assertRaises(InsufficientStock):
+            self.sale.post_lines(lines)
+        self.assertFalse(SaleDetail.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1000)
+
+    def test_saving_a_detail_checks_stock(self):
+        Product.objects.filter(pk=self.products[0].pk).update(stock=2)
+        product = Product.objects.get(pk=self.products[0].pk)
+        with self.assertRaises(InsufficientStock):
+            SaleDetail(sale=self.sale, product=product, quantity=3, unit_price=product.sale_price).save()
+        self.assertFalse(SaleDetail.objects.exists())
+
+    def test_editing_a_detail_moves_only_the_difference(self):
+        detail, = self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        detail = SaleDetail.objects.get(pk=detail.pk)
+        detail.quantity = 7
+        detail.save()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 993)
+        self.assertLedgerMatchesStock()
+
+        detail.quantity = 4
+        detail.save()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 996)
+        self.assertLedgerMatchesStock()
+
+    def test_deleting_details_gives_stock_back(self):
+        first, second = self.sale.post_lines([SaleDetail(product_id=p.pk, quantity=5) for p in self.products[:2]])
+        SaleDetail.objects.get(pk=first.pk).delete()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1000)
+        self.assertLedgerMatchesStock()
+
+        self.sale.delete()
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).stock, 1000)
+        self.assertLedgerMatchesStock()
+
+    def test_deleting_a_sale_costs_the_same_for_any_cart(self):
+        queries = []
+        for products in (self.products[:1], self.products):
+            sale = Sale.objects.create(payment_method_id='CA', status=self.sale.status, customer=self.customer)
+            sale.post_lines([SaleDetail(product_id=p.pk, quantity=5) for p in products])
+            with CaptureQueriesContext(connection) as captured:
+                sale.delete()
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(DailyProductSales.objects.exclude(units=0).count(), 0)
+        self.assertLedgerMatchesStock()
+
+    def test_deleting_a_cancelled_sale_moves_nothing(self):
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        Sale.cancel_many(Sale.objects.filter(pk=self.sale.pk))
+        Sale.objects.filter(pk=self.sale.pk).delete()
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 1000)
+        self.assertLedgerMatchesStock()
+
+    def test_saved_lines_keep_their_product(self):
+        detail, = self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        detail = SaleDetail.objects.get(pk=detail.pk)
+        detail.product = self.products[1]
+        with self.assertRaises(ValidationError):
+            detail.save()
+        self.assertEqual(SaleDetail.objects.get(pk=detail.pk).product_id, self.products[0].pk)
+
+    def test_lines_of_cancelled_sales_cannot_be_edited(self):
+        detail, = self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        Sale.cancel_many(Sale.objects.filter(pk=self.sale.pk))
+        detail = SaleDetail.objects.get(pk=detail.pk)
+        detail.quantity = 8
+        with self.assertRaises(ValidationError):
+            detail.save()
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.total, Product.objects.get(pk=self.products[0].pk).stock), (50, 1000))
+        self.assertLedgerMatchesStock()
+
+    def test_admin_change_form_cannot_change_the_status(self):
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        url = reverse('admin:stationery_sale_change', args=[self.sale.pk])
+        response = self.client.get(url)
+        self.assertNotIn('status', response.context['adminform'].form.fields)
+        data = change_form_data(response)
+        data['status'] = TransactionStatus.objects.get(code='CANCELLED').pk
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.status.code, 'PENDING')
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 995)
+        self.assertEqual(DailyProductSales.objects.get().units, 5)
+        self.assertLedgerMatchesStock()
+
+    def test_admin_change_form_leaves_totals_to_the_lines(self):
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        url = reverse('admin:stationery_sale_change', args=[self.sale.pk])
+        data = change_form_data(self.client.get(url))
+        data['customer'] = Customer.objects.create(name='Otro').pk
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post(url, data).status_code, 302)
+        sale_updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "stationery_sale" ')]
+        self.assertEqual(len(sale_updates), 1)
+        self.assertNotIn('"total"', sale_updates[0])
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.customer.name, self.sale.total), ('Otro', 50))
+
+    def test_admin_add_form_starts_pending(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        for name in ('admin:stationery_sale_add', 'admin:stationery_purchase_add'):
+            with self.subTest(name=name):
+                status = self.client.get(reverse(name)).context['adminform'].form.fields['status']
+                self.assertEqual([code for code in status.queryset.values_list('code', flat=True)], ['PENDING'])
+
+    def test_admin_locks_booked_lines(self):
+        self.sale.post_lines([SaleDetail(product_id=self.products[0].pk, quantity=5)])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        url = reverse('admin:stationery_sale_change', args=[self.sale.pk])
+        formset = self.client.get(url).context['inline_admin_formsets'][0].formset
+        self.assertTrue(formset.forms[0].fields['product'].disabled)
+
+        Sale.cancel_many(Sale.objects.filter(pk=self.sale.pk))
+        inline = self.client.get(url).context['inline_admin_formsets'][0]
+        self.assertFalse(inline.has_change_permission)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    tills = 8
+    stock = 20
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("tills need a test database shared between connections")
+        self.products = create_catalog(products=2)
+        Product.objects.update(stock=self.stock)
+        self.customer = Customer.objects.create(name='Cliente')
+        self.pending = TransactionStatus.objects.get(code='PENDING')
+
+    def till(self, barrier, sold, failures):
+        # Carts list the products in opposite orders to provoke deadlocks.
+        products = self.products if len(sold) % 2 else self.products[::-1]
+        barrier.wait()
+        try:
+            while True:
+                sale = Sale.objects.create(payment_method_id='CA', status=self.pending, customer=self.customer)
+                try:
+                    sale.post_lines([SaleDetail(product_id=p.pk, quantity=1) for p in products])
+                except InsufficientStock:
+                    return
+                sold.append(sale.pk)
+        except Exception as error:
+            failures.append(error)
+        finally:
+            connection.close()
+
+    def test_no_oversell_under_contention(self):
+        barrier = threading.Barrier(self.tills)
+        sold, failures = [], []
+        threads = [threading.Thread(target=self.till, args=(barrier, sold, failures)) for _ in range(self.tills)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+
+        self.assertFalse(any(thread.is_alive() for thread in threads), "deadlocked tills")
+        self.assertEqual(failures, [])
+        self.assertEqual(len(sold), self.stock)
+        self.assertEqual(list(Product.objects.values_list('stock', flat=True)), [0] * len(self.products))
+        self.assertEqual(StockMovement.objects.count(), self.stock * len(self.products))
+
+
+@override_settings(QUERY_PROFILING=True, QUERY_BUDGET_STRICT=True)
+class ViewQueryBudgetTests(AdminFixturesMixin, TestCase):
+    """Fails with QueryBudgetExceeded when a page goes over QUERY_BUDGETS"""
+
+    def setUp(self):
+        super().setUp()
+        caches['storefront'].clear()
+        self.add_suppliers(10)
+        self.add_sales(10)
+        self.add_discounts(6)
+        warm_caches()
+
+    def test_admin_pages_within_budget(self):
+        for name in (
+            'admin_dashboard',
+            'admin:stationery_product_changelist',
+            'admin:stationery_sale_changelist',
+            'admin:stationery_purchase_changelist',
+            'admin:stationery_supplier_changelist',
+            'admin:stationery_discount_changelist',
+            'admin:stationery_saleinvoice_changelist',
+        ):
+            with self.subTest(name):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin_product_lookup'), {'term': 'lapi'}).status_code, 200)
+
+    def test_changelist_actions_within_budget(self):
+        pending = TransactionStatus.objects.get(code='PENDING')
+        purchases = []
+        for _ in range(5):
+            purchase = Purchase.objects.create(supplier=Supplier.objects.first(), status=pending, payment_method_id='CA')
+            purchase.receive_lines([PurchaseDetail(product_id=p.pk, quantity=2, unit_price=5) for p in self.products])
+            purchases.append(purchase.pk)
+        sales = list(Sale.objects.values_list('pk', flat=True))
+        for name, action, selected in (
+            ('admin:stationery_purchase_changelist', 'cancel_purchase', purchases[:3]),
+            ('admin:stationery_purchase_changelist', 'mark_as_received', purchases[3:]),
+            ('admin:stationery_sale_changelist', 'cancel_sale', sales[:5]),
+            ('admin:stationery_sale_changelist', 'mark_as_paid', sales[5:]),
+        ):
+            with self.subTest(action):
+                response = self.client.post(reverse(name), {'action': action, '_selected_action': selected})
+                self.assertEqual(response.status_code, 302)
+
+    def test_storefront_within_budget(self):
+        self.client.logout()
+        for url in (reverse('home'), reverse('shop'), reverse('shop') + '?q=lapicero',
+                    reverse('shopProductDetail', args=[self.products[0].pk])):
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_regression_fails(self):
+        with override_settings(QUERY_BUDGETS={'admin:stationery_sale_changelist': {'queries': 1}}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('admin:stationery_sale_changelist'))
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers(self):
+        response = self.client.get(reverse('admin:stationery_sale_changelist'))
+        self.assertIn('X-DB-Queries', response)
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+    def test_duplicate_fingerprints(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND n = 5'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s) AND n = 7'),
+        )
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', HomeView.as_view(), name='home'),
     path('shop/',ShopView.as_view(),name='shop'),
     path('shopProduct/',ShopProductView.as_view(),name='shopProduct'),
+    path('shopProduct/<int:pk>/',ShopProductView.as_view(),name='shopProductDetail'),
     path('contact/',ContactView.as_view(),name='contact'),
     path('blog/',CREATEBlogView.as_view(),name='blog'),
     path('blog1/',Blogview.as_view(),name='blog1')
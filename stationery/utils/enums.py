@@ -1,10 +1,21 @@
 from django.db import models
 
-class DiscountTypeEnum(models.IntegerChoices):
+class CodedIntegerChoices(models.IntegerChoices):
+    """Choices mirrored by a lookup table whose `code` is a member name or value"""
+
+    @classmethod
+    def from_code(cls, code):
+        """Maps a lookup table code (member name or value) to the enum member."""
+        for member in cls:
+            if code in (member.name, str(member.value)):
+                return member
+        return None
+
+class DiscountTypeEnum(CodedIntegerChoices):
     PERCENTAGE = 1, 'Percentage'
     FIXED_AMOUNT = 2, 'Fixed Amount'
 
-class ScopeTypeEnum(models.IntegerChoices):
+class ScopeTypeEnum(CodedIntegerChoices):
     ALL_PRODUCTS = 1, 'All products'
     SELECTED_PRODUCTS = 2, 'Specific products'
     ALL_CATEGORIES = 3, 'All categories'
@@ -21,4 +32,5 @@ class MovementReasonEnum(models.TextChoices):
     RETURN = 'DEVOLUCION', 'Devolución'
     ADJUSTMENT = 'AJUSTE', 'Ajuste de inventario'
     DAMAGED = 'DANADO', 'Mercancía dañada'
-    EXPIRED = 'VENCIDO', 'Producto vencido'
\ No newline at end of file
+    EXPIRED = 'VENCIDO', 'Producto vencido'
+    CANCELLATION = 'ANULACION', 'Anulación de transacción'
\ No newline at end of file
@@ -0,0 +1,54 @@
+from django.db.models import BooleanField, Expression, Func, F, IntegerField, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset):
+    """Scalar subquery returning COUNT(*) of `queryset`, usable in annotate()"""
+    counted = queryset.order_by().annotate(
+        _count=Func(F('pk'), function='COUNT', output_field=IntegerField())
+    ).values('_count')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+class RowCompare(Expression):
+    """Row-value comparison `(a, b) > (x, y)`, usable in filter().
+
+    Unlike `a > x OR (a = x AND b > y)`, the database can read it as one
+    range seek on an index over (a, b). `operator` is '>' or '<'.
+    """
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, fields, operator, values):
+        super().__init__()
+        if operator not in ('>', '<'):
+            raise ValueError(f"Unsupported operator {operator!r}")
+        self.fields = [F(field) if isinstance(field, str) else field for field in fields]
+        self.operator = operator
+        self.values = [value if hasattr(value, 'resolve_expression') else Value(value) for value in values]
+
+    def get_source_expressions(self):
+        return [*self.fields, *self.values]
+
+    def set_source_expressions(self, expressions):
+        self.fields, self.values = expressions[:len(self.fields)], expressions[len(self.fields):]
+
+    def resolve_expression(self, *args, **kwargs):
+        resolved = super().resolve_expression(*args, **kwargs)
+        # Bound values are adapted like the columns they are compared with.
+        resolved.values = [
+            Value(value.value, output_field=field.output_field) if isinstance(value, Value) else value
+            for field, value in zip(resolved.fields, resolved.values)
+        ]
+        return resolved
+
+    def as_sql(self, compiler, connection):
+        sides, params = [], []
+        for expressions in (self.fields, self.values):
+            sqls = []
+            for expression in expressions:
+                sql, expression_params = compiler.compile(expression)
+                sqls.append(sql)
+                params.extend(expression_params)
+            sides.append(f"({', '.join(sqls)})")
+        return f'{sides[0]} {self.operator} {sides[1]}', params
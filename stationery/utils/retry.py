@@ -0,0 +1,47 @@
+import functools
+import random
+import time
+from django.db import OperationalError, connection, transaction
+
+
+# PostgreSQL serialization_failure and deadlock_detected.
+RETRYABLE_PGCODES = {'40001', '40P01'}
+# SQLite reports writer contention as OperationalError with these messages.
+RETRYABLE_SQLITE_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def is_retryable(error):
+    """True for errors that only mean another transaction won the race"""
+    if not isinstance(error, OperationalError):
+        return False
+    if getattr(error.__cause__, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    return any(message in str(error) for message in RETRYABLE_SQLITE_MESSAGES)
+
+
+def retry_on_conflict(attempts=5, base_delay=0.02, max_delay=0.5):
+    """Runs the decorated function in its own transaction, retrying conflicts.
+
+    Serialization failures, deadlocks and SQLite lock errors are retried with
+    exponential backoff and jitter. When called inside an outer atomic block
+    the function runs once, since only the outermost transaction can be
+    replayed.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if connection.in_atomic_block:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+
+            for attempt in range(1, attempts + 1):
+                try:
+                    with transaction.atomic():
+                        return func(*args, **kwargs)
+                except OperationalError as error:
+                    if attempt == attempts or not is_retryable(error):
+                        raise
+                delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+                time.sleep(random.uniform(delay / 2, delay))
+        return wrapper
+    return decorator
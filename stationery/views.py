@@ -1,23 +1,127 @@
-from django.shortcuts import render
+import json
+from django.shortcuts import render, get_object_or_404
 from django.views.generic import TemplateView
 
+from .caching import CachedPageMixin, annotate_card_versions
+from .catalog import ATTRIBUTE_PREFIX, search_catalog
+from .discounts import discount_engine
+from .models import Category, Product
+from .pagination import KeysetPaginator
+from .search import search_products
+
+SHOP_ORDERINGS = {
+    'name': ('name', 'id'),
+    'new': ('-creation_date', '-id'),
+    # Only offered with a search query, which annotates `rank`.
+    'relevance': ('-rank', '-id'),
+}
+SHOP_PAGE_SIZE = 24
+# Values listed per attribute in the shop sidebar.
+FACET_VALUES = 10
+# Columns the product cards render; everything else stays deferred.
+CARD_FIELDS = ('id', 'name', 'sale_price', 'image', 'category_id', 'category__name', 'brand__name', 'creation_date')
+
+
+def with_discounts(products):
+    discounts = discount_engine.resolve(products)
+    for product in products:
+        product.discount = discounts[product.pk]
+        if product.discount is not None:
+            product.final_price = product.sale_price - product.discount.calculate_discount(product.sale_price)
+    return products
+
+
+def facet_groups(category, facets, filters, params):
+    """Sidebar entries: the most common values of each attribute, with toggle links"""
+    properties = (category.product_schema or {}).get('properties', {})
+    groups = []
+    for key in sorted(facets):
+        options = []
+        for value, count in sorted(facets[key].items(), key=lambda item: (-item[1], str(item[0])))[:FACET_VALUES]:
+            query = params.copy()
+            query.pop('after', None)
+            query.pop('before', None)
+            active = key in filters and filters[key] == value and type(filters[key]) is type(value)
+            if active:
+                query.pop(ATTRIBUTE_PREFIX + key, None)
+            else:
+                query[ATTRIBUTE_PREFIX + key] = value if isinstance(value, str) else json.dumps(value)
+            options.append({
+                'label': 'Sí' if value is True else 'No' if value is False else value,
+                'count': count,
+                'active': active,
+                'query': query.urlencode(),
+            })
+        groups.append({'label': properties.get(key, {}).get('title', key), 'options': options})
+    return groups
+
+
 # Create your views here.
-class HomeView(TemplateView):
+class HomeView(CachedPageMixin, TemplateView):
     template_name = 'stationery/index.html'
 
-class ShopView(TemplateView):
+class ShopView(CachedPageMixin, TemplateView):
     template_name = 'stationery/shop.html'
 
-class ShopProductView(TemplateView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        params = self.request.GET
+        category = None
+        if params.get('category', '').isdigit():
+            category = Category.objects.filter(pk=params['category']).first()
+
+        queryset = Product.objects.filter(active=True).select_related('brand', 'category').only(*CARD_FIELDS)
+        query = params.get('q', '').strip()
+        if query:
+            queryset = search_products(query, queryset)
+        # Attributes only make sense within one category's schema.
+        products, filters, facets = search_catalog(
+            params, queryset=queryset, category=category, facets=category is not None
+        )
+        default_sort = 'relevance' if query else 'name'
+        sort = params.get('sort') if params.get('sort') in SHOP_ORDERINGS else default_sort
+        if sort == 'relevance' and not query:
+            sort = 'name'
+        page = KeysetPaginator(products, SHOP_ORDERINGS[sort], SHOP_PAGE_SIZE).page(
+            after=params.get('after'), before=params.get('before')
+        )
+        with_discounts(page.object_list)
+        annotate_card_versions(page.object_list)
+
+        base_query = params.copy()
+        base_query.pop('after', None)
+        base_query.pop('before', None)
+        context.update({
+            'page': page,
+            'products': page.object_list,
+            'category': category,
+            'filters': filters,
+            'facets': facet_groups(category, facets, filters, params) if category else [],
+            'sort': sort,
+            'q': query,
+            'base_query': base_query.urlencode(),
+        })
+        return context
+
+class ShopProductView(CachedPageMixin, TemplateView):
     template_name= 'stationery/shop-single.html'
 
-class ContactView(TemplateView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if 'pk' in kwargs:
+            product = get_object_or_404(
+                Product.objects.filter(active=True).select_related('brand', 'category'), pk=kwargs['pk']
+            )
+            context['product'] = with_discounts([product])[0]
+        return context
+
+class ContactView(CachedPageMixin, TemplateView):
     template_name='stationery/contact.html'
 
-class CREATEBlogView(TemplateView):
+class CREATEBlogView(CachedPageMixin, TemplateView):
     template_name='stationery/blog-single.html'
 
-class Blogview(TemplateView):
+class Blogview(CachedPageMixin, TemplateView):
     template_name='stationery/blog.html'
 
 